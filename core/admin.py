@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseAdmin
-from .models import User
+from .jobs import retry_failed_jobs
+from .models import User, FailedJob, OutboxEmail
+from .outbox import resend_outbox_emails
 # Register your models here.
 @admin.register(User)
 class UserAdmin(BaseAdmin):
@@ -12,4 +14,32 @@ class UserAdmin(BaseAdmin):
                 "fields": ("username", "usable_password", "password1", "password2", "email", "first_name", "last_name"),
             },
         ),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(FailedJob)
+class FailedJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'args', 'attempts', 'failed_at']
+    list_filter = ['name']
+    readonly_fields = ['name', 'args', 'kwargs', 'attempts', 'error', 'failed_at']
+    actions = ['retry']
+
+    @admin.action(description='Retry selected jobs')
+    def retry(self, request, queryset):
+        queued = retry_failed_jobs(queryset)
+        self.message_user(request, f'{queued} job(s) queued again.')
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['id', 'key', 'kind', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['key']
+    readonly_fields = ['key', 'kind', 'object_id', 'payload', 'status', 'attempts', 'last_error',
+                       'created_at', 'next_attempt_at', 'sent_at']
+    actions = ['resend']
+
+    @admin.action(description='Send selected emails again')
+    def resend(self, request, queryset):
+        queued = resend_outbox_emails(queryset)
+        self.message_user(request, f'{queued} email(s) queued; they are sent by deliver_emails.')
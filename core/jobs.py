@@ -0,0 +1,130 @@
+"""
+Background jobs.
+
+A job is a module-level function taking JSON-serializable arguments, marked
+with ``@job``. ``enqueue(func, ...)`` (or ``func.enqueue(...)``) hands it to
+the backend named by JOBS_BACKEND once the current transaction commits, so a
+job never runs against rows that were rolled back or not committed yet.
+
+* ``ThreadPoolBackend`` (default) runs jobs in this process on at most
+  JOBS_THREAD_WORKERS threads. Queued jobs are lost if the process dies.
+* ``CeleryBackend`` sends them to the Celery broker (CELERY_BROKER_URL) for
+  ``celery -A ecommerce_backend worker``.
+
+A failing job is retried up to JOBS_MAX_ATTEMPTS times, waiting
+JOBS_RETRY_BACKOFF seconds and doubling each time. After the last attempt it
+is recorded as a ``FailedJob``, which can be queued again from the admin.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def job(func=None, *, max_attempts=None):
+    """
+    Mark a module-level function as a job and give it an ``enqueue`` method.
+    ``max_attempts`` overrides JOBS_MAX_ATTEMPTS for this job.
+    """
+    if func is None:
+        return partial(job, max_attempts=max_attempts)
+    func.max_attempts = max_attempts
+    func.enqueue = partial(enqueue, func)
+    return func
+
+
+def job_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def max_attempts(name):
+    return getattr(import_string(name), 'max_attempts', None) or settings.JOBS_MAX_ATTEMPTS
+
+
+def retry_delay(attempt):
+    """Seconds to wait after failed attempt number ``attempt`` (1-based)."""
+    return settings.JOBS_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+def enqueue(func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` in the background after the current transaction commits."""
+    name = job_name(func)
+    transaction.on_commit(lambda: get_backend().submit(name, list(args), kwargs))
+
+
+def run_job(name, args, kwargs):
+    """Run one attempt of a job."""
+    return import_string(name)(*args, **kwargs)
+
+
+def dead_letter(name, args, kwargs, attempts, error):
+    from .models import FailedJob
+
+    logger.error("Job %s%s failed after %s attempts: %s", name, tuple(args), attempts, error)
+    FailedJob.objects.create(name=name, args=args, kwargs=kwargs, attempts=attempts, error=str(error))
+
+
+def retry_failed_jobs(queryset):
+    """Queue failed jobs again and remove their records. Returns how many were queued."""
+    count = 0
+    with transaction.atomic():
+        for failed in queryset.select_for_update():
+            transaction.on_commit(partial(get_backend().submit, failed.name, failed.args, failed.kwargs))
+            failed.delete()
+            count += 1
+    return count
+
+
+class ThreadPoolBackend:
+    """Runs jobs on a bounded pool of threads in the current process."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=settings.JOBS_THREAD_WORKERS, thread_name_prefix='jobs')
+        # Set by shutdown(): jobs waiting for a retry are recorded as failed
+        # instead of holding up the exit.
+        self.stopped = threading.Event()
+
+    def submit(self, name, args, kwargs):
+        return self.executor.submit(self._run, name, args, kwargs)
+
+    def _run(self, name, args, kwargs):
+        attempts = max_attempts(name)
+        try:
+            for attempt in range(1, attempts + 1):
+                try:
+                    return run_job(name, args, kwargs)
+                except Exception as e:
+                    if attempt == attempts:
+                        dead_letter(name, args, kwargs, attempt, e)
+                        return None
+                    logger.warning("Job %s%s failed (attempt %s of %s), retrying: %s",
+                                   name, tuple(args), attempt, attempts, e)
+                    if self.stopped.wait(retry_delay(attempt)):
+                        dead_letter(name, args, kwargs, attempt, e)
+                        return None
+        finally:
+            connection.close()
+
+    def shutdown(self, wait=True):
+        self.stopped.set()
+        self.executor.shutdown(wait=wait)
+
+
+class CeleryBackend:
+    """Sends jobs to Celery workers; see ``core.tasks.run_job_task``."""
+
+    def submit(self, name, args, kwargs):
+        from .tasks import run_job_task
+
+        return run_job_task.apply_async(args=(name, args, kwargs))
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.JOBS_BACKEND)()
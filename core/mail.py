@@ -0,0 +1,173 @@
+"""
+Outgoing email over a shared connection.
+
+Jobs hand their messages to ``get_dispatcher()`` instead of calling
+``EmailMessage.send()``, which opens (and for SMTP, TLS-handshakes) a new
+connection per message. A single dispatcher thread per process drains the
+queue through one connection from ``get_connection()``:
+
+* at most EMAIL_BATCH_SIZE messages are sent per connection before it is
+  recycled, and it is closed after EMAIL_CONNECTION_IDLE_TIMEOUT seconds
+  without mail;
+* at most EMAIL_SEND_RATE messages per second are sent (0 for no limit);
+* a message that fails is retried on a fresh connection up to
+  EMAIL_SEND_RETRIES times before its error is handed back to the sender.
+
+The thread is a daemon so it never keeps a process alive, but ``close()`` is
+registered with ``atexit``: on exit the process first sends what is already
+queued, waiting at most EMAIL_SHUTDOWN_TIMEOUT seconds.
+"""
+import atexit
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+# Queued by close(): the thread stops once everything before it was sent.
+_STOP = object()
+
+
+class EmailDispatcher:
+    def __init__(self, batch_size=50, rate=0, retries=2, idle_timeout=5, connection_factory=get_connection):
+        self.batch_size = batch_size
+        self.interval = 1.0 / rate if rate else 0
+        self.retries = retries
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory
+        self.queue = queue.Queue()
+        self.connection = None
+        self.sent_on_connection = 0
+        self.next_slot = time.monotonic()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, message):
+        """Queue ``message``; the returned Future resolves once it was sent (or failed)."""
+        future = Future()
+        self.queue.put((message, future))
+        self._ensure_thread()
+        return future
+
+    def send(self, message):
+        """Queue ``message`` and wait until it is sent. Raises the sending error, if any."""
+        return self.submit(message).result()
+
+    def close(self, timeout=None):
+        """
+        Send every message queued so far, then stop the thread and close the
+        connection. Waits at most ``timeout`` seconds; a later ``submit``
+        starts the thread again.
+        """
+        with self.lock:
+            thread = self.thread
+            if thread is None or not thread.is_alive():
+                return
+            self.queue.put((_STOP, None))
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.warning("Email dispatcher still had %s messages to send at shutdown", self.queue.qsize())
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='email-dispatcher', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        stopping = False
+        while True:
+            try:
+                message, future = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close()
+                continue
+            batch = [(message, future)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for message, future in batch:
+                if message is _STOP:
+                    stopping = True
+                elif future.set_running_or_notify_cancel():
+                    self._deliver(message, future)
+            if stopping:
+                # Under the lock, so a message submitted from now on starts a new thread.
+                with self.lock:
+                    if self.queue.empty():
+                        self._close()
+                        self.thread = None
+                        return
+
+    def _deliver(self, message, future):
+        for attempt in range(self.retries + 1):
+            self._wait_for_slot()
+            try:
+                connection = self._open()
+                connection.send_messages([message])
+            except (smtplib.SMTPException, OSError) as e:
+                logger.warning("Sending email to %s failed (attempt %s): %s", message.to, attempt + 1, e)
+                self._close()
+                error = e
+                continue
+            except Exception as e:
+                future.set_exception(e)
+                return
+            self.sent_on_connection += 1
+            if self.sent_on_connection >= self.batch_size:
+                self._close()
+            future.set_result(1)
+            return
+        future.set_exception(error)
+
+    def _wait_for_slot(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_slot > now:
+            time.sleep(self.next_slot - now)
+        self.next_slot = max(self.next_slot, now) + self.interval
+
+    def _open(self):
+        if self.connection is None:
+            connection = self.connection_factory()
+            connection.open()
+            self.connection = connection
+            self.sent_on_connection = 0
+        return self.connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except Exception:
+            logger.debug("Error closing the email connection", exc_info=True)
+        self.connection = None
+
+
+def get_dispatcher():
+    """Return this process's email dispatcher."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EmailDispatcher(
+                    batch_size=settings.EMAIL_BATCH_SIZE,
+                    rate=settings.EMAIL_SEND_RATE,
+                    retries=settings.EMAIL_SEND_RETRIES,
+                    idle_timeout=settings.EMAIL_CONNECTION_IDLE_TIMEOUT,
+                )
+                atexit.register(_dispatcher.close, settings.EMAIL_SHUTDOWN_TIMEOUT)
+    return _dispatcher
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import OutboxEmail
+from core.outbox import deliver_outbox_emails, resend_outbox_emails
+
+
+class Command(BaseCommand):
+    help = 'Send pending emails from the outbox, or queue failed ones again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop.')
+        parser.add_argument('--resend', nargs='*', type=int, metavar='EMAIL_ID',
+                            help='Queue the given emails (or every failed email when no id is given) and send them.')
+
+    def handle(self, *args, **options):
+        if options['resend'] is not None:
+            emails = OutboxEmail.objects.all()
+            if options['resend']:
+                emails = emails.filter(pk__in=options['resend'])
+            else:
+                emails = emails.filter(status=OutboxEmail.STATUS_FAILED)
+            queued = resend_outbox_emails(emails)
+            if options['resend'] and not queued:
+                raise CommandError('None of the given emails exist or they are already pending.')
+            self.stdout.write(f'Queued {queued} email(s) to be sent again.')
+
+        while True:
+            sent, failed = deliver_outbox_emails(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} email(s), {failed} failed permanently.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -1,6 +1,66 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 # Create your models here.
 
 class User(AbstractUser):
-    email = models.EmailField(unique=True)
\ No newline at end of file
+    email = models.EmailField(unique=True)
+
+
+class FailedJob(models.Model):
+    """A background job (core.jobs) that failed on every attempt."""
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-failed_at']
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)}'
+
+
+class OutboxEmail(models.Model):
+    """
+    Email waiting to be sent. Rows are written in the same transaction as the
+    change they announce; ``core.outbox.deliver_outbox_emails`` renders and
+    sends them in batches and retries failures with backoff.
+    """
+    KIND_ORDER_STATUS = 'order_status'
+    KIND_WELCOME = 'welcome'
+    KIND_CHOICES = (
+        (KIND_ORDER_STATUS, 'Order status'),
+        (KIND_WELCOME, 'Welcome'),
+    )
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    # e.g. "order:42:confirmation:created"; a second email with the same key is dropped.
+    key = models.CharField(max_length=255, unique=True)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # Order or user id, depending on ``kind``.
+    object_id = models.PositiveBigIntegerField()
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.key} ({self.status})'
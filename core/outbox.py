@@ -0,0 +1,244 @@
+"""
+Transactional email outbox.
+
+Code that changes an order (or creates a user) queues its email with one
+INSERT into ``OutboxEmail`` inside the same transaction, so the email exists
+if and only if the change was committed. Each email has a unique key, and a
+second insert with the same key is ignored: every status change gets its own
+key, while a confirmation is keyed on the event it confirms (the order being
+placed, or a payment reference) so that event is only announced once.
+
+``deliver_outbox_emails`` claims due rows in batches with SELECT ... FOR
+UPDATE SKIP LOCKED (where the database supports it) and leases them for
+EMAIL_OUTBOX_LEASE seconds by pushing back their ``next_attempt_at``, then
+commits. The emails are rendered and sent outside any transaction, and each
+one is marked sent as soon as it went out. Failures are retried with backoff
+and marked failed after EMAIL_OUTBOX_MAX_ATTEMPTS attempts; emails left behind
+by a run that died are sent again once their lease expires. A delivery run is
+queued after every transaction that added emails, and retried or expired
+emails are picked up by the periodic run (CELERY_BEAT_SCHEDULE) or by
+``manage.py deliver_emails --loop``.
+"""
+import logging
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from store.models import Order, OrderItem
+from store.pricing import price_order_items
+
+from .jobs import job
+from .mail import get_dispatcher
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+ORDER_EMAILS = {
+    Order.STATUS_SHIPPED: ('Your Order #{id} Has Shipped!', 'order_shipped.html'),
+    Order.STATUS_COMPLETED: ('Your Order #{id} is Complete!', 'order_completed.html'),
+    Order.STATUS_CANCELLED: ('Your Order #{id} Has Been Cancelled', 'order_cancelled.html'),
+}
+ORDER_CONFIRMATION = ('Your Simply Organice Order #{id} is Confirmed!', 'order_confirmation.html')
+
+
+# Queueing
+
+def order_status_email(order_id, status):
+    """The email announcing that order ``order_id`` reached ``status``."""
+    # Orders can return to a status, and each change is announced.
+    return OutboxEmail(key=f'order:{order_id}:{status}:{uuid4().hex}', kind=OutboxEmail.KIND_ORDER_STATUS,
+                       object_id=order_id, payload={'status': status})
+
+
+def order_confirmation_email(order_id, event):
+    """
+    The confirmation for order ``order_id``, sent once per ``event``: ``created``
+    or ``payment:<reference>``.
+    """
+    return OutboxEmail(key=f'order:{order_id}:confirmation:{event}', kind=OutboxEmail.KIND_ORDER_STATUS,
+                       object_id=order_id, payload={'confirmation': True})
+
+
+def payment_confirmation_email(order_id, reference):
+    return order_confirmation_email(order_id, f'payment:{reference}')
+
+
+def queue_emails(emails):
+    """Queue outbox rows in one INSERT, ignoring any whose key was already queued."""
+    if not emails:
+        return
+    OutboxEmail.objects.bulk_create(emails, ignore_conflicts=True)
+    # Runs once the current transaction commits.
+    deliver_outbox_emails.enqueue()
+
+
+def queue_order_email(order_id, status):
+    queue_emails([order_status_email(order_id, status)])
+
+
+def queue_order_confirmation(order_id, event):
+    queue_emails([order_confirmation_email(order_id, event)])
+
+
+def queue_welcome_email(user_id):
+    queue_emails([OutboxEmail(key=f'welcome:{user_id}', kind=OutboxEmail.KIND_WELCOME, object_id=user_id)])
+
+
+# Rendering
+
+def _message(subject, template_name, context, recipient):
+    email = EmailMessage(
+        subject=subject,
+        body=render_to_string(template_name, context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient]
+    )
+    email.content_subtype = 'html'
+    return email
+
+
+def _order_message(order, payload):
+    if payload.get('confirmation'):
+        subject, template_name = ORDER_CONFIRMATION
+    else:
+        subject, template_name = ORDER_EMAILS.get(payload.get('status'), ORDER_CONFIRMATION)
+
+    quote = price_order_items(order.items.all())
+    order_items_with_total = []
+    for priced in quote.lines:
+        item = priced.line
+        item.total_price = priced.total
+        order_items_with_total.append(item)
+
+    context = {
+        'customer_name': order.customer.user.first_name,
+        'order_id': order.id,
+        'recipient_name': order.recipient_name,
+        'order_items': order_items_with_total,
+        'total_amount': order.total,
+    }
+    return _message(subject.format(id=order.id), template_name, context, order.customer.user.email)
+
+
+def _welcome_message(user):
+    context = {
+        'first_name': user.first_name or user.username,
+    }
+    return _message('Welcome to Simply Organice!', 'welcome_email.html', context, user.email)
+
+
+def _load(emails):
+    """Fetch the orders (with items) and users the emails are about."""
+    order_ids = [e.object_id for e in emails if e.kind == OutboxEmail.KIND_ORDER_STATUS]
+    user_ids = [e.object_id for e in emails if e.kind == OutboxEmail.KIND_WELCOME]
+    orders = Order.objects.select_related('customer__user').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+    ).in_bulk(order_ids) if order_ids else {}
+    users = get_user_model().objects.in_bulk(user_ids) if user_ids else {}
+    return orders, users
+
+
+def _render(email, orders, users):
+    """Build the message for an outbox row, or None if what it is about no longer exists."""
+    if email.kind == OutboxEmail.KIND_ORDER_STATUS:
+        order = orders.get(email.object_id)
+        return order and _order_message(order, email.payload)
+    user = users.get(email.object_id)
+    return user and _welcome_message(user)
+
+
+# Delivery
+
+def _failed_attempt(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.STATUS_FAILED
+        logger.error("Email %s failed after %s attempts: %s", email.key, email.attempts, error)
+        return True
+    email.next_attempt_at = timezone.now() + timedelta(
+        seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1))
+    logger.warning("Email %s failed (attempt %s): %s", email.key, email.attempts, error)
+    return False
+
+
+def _claim(batch_size):
+    """Lease up to ``batch_size`` due emails to this run and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+            status=OutboxEmail.STATUS_PENDING, next_attempt_at__lte=now
+        ).order_by('id')[:batch_size])
+        if emails:
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE))
+    return emails
+
+
+def _save(email):
+    email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+
+
+@job
+def deliver_outbox_emails(batch_size=100):
+    """Send due outbox emails in batches. Returns ``(sent, failed)`` counts for this run."""
+    dispatcher = get_dispatcher()
+    sent = failed = 0
+    while True:
+        emails = _claim(batch_size)
+        if not emails:
+            break
+
+        # Hand the whole batch to the dispatcher first so it goes out over one connection.
+        orders, users = _load(emails)
+        futures = []
+        for email in emails:
+            try:
+                message = _render(email, orders, users)
+            except Exception as e:
+                logger.exception("Rendering email %s failed", email.key)
+                failed += _failed_attempt(email, e)
+                _save(email)
+                continue
+            if message is None:
+                email.attempts += 1
+                email.status = OutboxEmail.STATUS_FAILED
+                subject = 'Order' if email.kind == OutboxEmail.KIND_ORDER_STATUS else 'User'
+                email.last_error = f'{subject} {email.object_id} no longer exists.'
+                failed += 1
+                _save(email)
+                continue
+            futures.append((email, dispatcher.submit(message)))
+
+        # Record each email as soon as it went out, so an error later in the
+        # batch can never cause it to be sent twice.
+        for email, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += _failed_attempt(email, e)
+            else:
+                email.attempts += 1
+                email.status = OutboxEmail.STATUS_SENT
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+            _save(email)
+
+        # Retried emails are not due yet, so a short batch means the outbox is drained.
+        if len(emails) < batch_size:
+            break
+    return sent, failed
+
+
+def resend_outbox_emails(queryset):
+    """Queue emails (typically failed ones) to be sent again. Returns how many were queued."""
+    return queryset.exclude(status=OutboxEmail.STATUS_PENDING).update(
+        status=OutboxEmail.STATUS_PENDING, attempts=0, last_error='', next_attempt_at=timezone.now())
@@ -1,3 +1,240 @@
-from django.test import TestCase
+import socketserver
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ecommerce_backend.celery import app as celery_app
+from store.models import Branch, Order
+from store.payments import process_paystack_events
+
+from . import jobs, outbox
+from .jobs import job
+from .mail import EmailDispatcher
+from .models import FailedJob, OutboxEmail
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='ama', email='ama@example.com', password='x')
+        self.order = Order.objects.create(
+            customer=user.customer, branch=Branch.objects.create(name='Accra'),
+            recipient_name='Ama', recipient_number='0200000000', recipient_address='Accra', total=50)
+        OutboxEmail.objects.all().delete()
+        mail.outbox = []
+
+    def keys(self):
+        return list(OutboxEmail.objects.order_by('id').values_list('key', flat=True))
+
+    def test_every_status_change_is_announced(self):
+        for status in (Order.STATUS_SHIPPED, Order.STATUS_PENDING, Order.STATUS_SHIPPED):
+            self.order.status = status
+            self.order.save()
+        self.assertEqual(len(self.keys()), 3)
+
+    def test_confirmations_are_sent_once_per_event(self):
+        outbox.queue_order_confirmation(self.order.pk, 'created')
+        outbox.queue_emails([outbox.payment_confirmation_email(self.order.pk, 'ref-1')])
+        outbox.queue_emails([outbox.payment_confirmation_email(self.order.pk, 'ref-1')])
+        self.assertEqual(self.keys(), [f'order:{self.order.pk}:confirmation:created',
+                                       f'order:{self.order.pk}:confirmation:payment:ref-1'])
+
+    def test_delivery_marks_each_email_as_it_goes_out(self):
+        for event in ('created', 'payment:ref-1'):
+            outbox.queue_order_confirmation(self.order.pk, event)
+        first, second = OutboxEmail.objects.order_by('id')
+
+        save = OutboxEmail.save
+
+        def fail_for_second(email, *args, **kwargs):
+            if email.pk == second.pk:
+                raise RuntimeError('database went away')
+            return save(email, *args, **kwargs)
+
+        with mock.patch.object(OutboxEmail, 'save', fail_for_second), self.assertRaises(RuntimeError):
+            outbox.deliver_outbox_emails()
+        self.assertEqual(len(mail.outbox), 2)
+        first.refresh_from_db()
+        self.assertEqual(first.status, OutboxEmail.STATUS_SENT)
+
+        # The second email stays leased, then goes out again once the lease expired.
+        self.assertEqual(outbox.deliver_outbox_emails(), (0, 0))
+        OutboxEmail.objects.filter(pk=second.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.deliver_outbox_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[-1].subject, f'Your Simply Organice Order #{self.order.pk} is Confirmed!')
+
+
+class StubSMTP(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP server that accepts every message after ``delay`` seconds,
+    counting connections and messages. The next ``drop`` messages are answered
+    by closing the connection instead.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0, drop=0):
+        self.delay = delay
+        self.drop = drop
+        self.connections = 0
+        self.messages = 0
+        super().__init__(('127.0.0.1', 0), StubSMTPHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def connection(self):
+        return get_connection('django.core.mail.backends.smtp.EmailBackend', host='127.0.0.1',
+                              port=self.server_address[1], username='', password='', use_tls=False)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stub ESMTP')
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command == 'DATA':
+                if self.server.drop:
+                    self.server.drop -= 1
+                    return
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(self.server.delay)
+                self.server.messages += 1
+                self.reply('250 Queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+
+class EmailDispatcherTests(TestCase):
+    def setUp(self):
+        mail.outbox = []
+
+    def dispatcher(self, **kwargs):
+        dispatcher = EmailDispatcher(idle_timeout=60, **kwargs)
+        self.addCleanup(dispatcher.close, 5)
+        return dispatcher
+
+    def smtp(self, **kwargs):
+        server = StubSMTP(**kwargs)
+        self.addCleanup(server.stop)
+        return server
+
+    def message(self, n):
+        return EmailMessage(f'Message {n}', 'body', 'shop@example.com', [f'customer{n}@example.com'])
+
+    def test_close_sends_the_queued_mail_first(self):
+        dispatcher = self.dispatcher()
+        futures = [dispatcher.submit(self.message(n)) for n in range(3)]
+        dispatcher.close()
+        self.assertEqual([message.subject for message in mail.outbox], ['Message 0', 'Message 1', 'Message 2'])
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertIsNone(dispatcher.thread)
+
+        # A message submitted after close() starts a new thread.
+        dispatcher.send(self.message(3))
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_messages_share_one_smtp_connection(self):
+        server = self.smtp(delay=0.05)
+        dispatcher = self.dispatcher(batch_size=2, connection_factory=server.connection)
+        for n in range(3):
+            dispatcher.submit(self.message(n))
+        dispatcher.close(5)
+        # Recycled after batch_size messages.
+        self.assertEqual((server.messages, server.connections), (3, 2))
+
+    def test_dropped_connection_is_retried_on_a_fresh_one(self):
+        server = self.smtp(drop=1)
+        dispatcher = self.dispatcher(connection_factory=server.connection)
+        with self.assertLogs('core.mail', 'WARNING'):
+            self.assertEqual(dispatcher.send(self.message(0)), 1)
+        self.assertEqual((server.messages, server.connections), (1, 2))
+
+    def test_error_is_handed_back_after_the_last_retry(self):
+        server = self.smtp(drop=2)
+        dispatcher = self.dispatcher(retries=1, connection_factory=server.connection)
+        with self.assertLogs('core.mail', 'WARNING'), self.assertRaises(OSError):
+            dispatcher.send(self.message(0))
+        self.assertEqual(server.messages, 0)
+
+
+calls = []
+
+
+@job(max_attempts=3)
+def flaky_job(failures):
+    """Fails the first ``failures`` times it runs."""
+    calls.append(failures)
+    if len(calls) <= failures:
+        raise ConnectionError('broker went away')
+    return len(calls)
+
+
+@override_settings(JOBS_BACKEND='core.jobs.CeleryBackend', JOBS_RETRY_BACKOFF=0)
+class EagerJobTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        jobs.get_backend.cache_clear()
+        self.addCleanup(jobs.get_backend.cache_clear)
+        # Run Celery tasks (and their retries) in this thread instead of sending them to a broker.
+        celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+        self.addCleanup(setattr, celery_app.conf, 'CELERY_TASK_ALWAYS_EAGER', False)
+
+    def test_failed_attempts_are_retried(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            flaky_job.enqueue(2)
+        self.assertEqual(calls, [2, 2, 2])
+        self.assertFalse(FailedJob.objects.exists())
+
+    def test_job_is_dead_lettered_after_its_last_attempt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            flaky_job.enqueue(5)
+        self.assertEqual(len(calls), 3)
+        failed = FailedJob.objects.get()
+        self.assertEqual((failed.name, failed.args, failed.attempts), ('core.tests.flaky_job', [5], 3))
+
+    def test_job_is_not_queued_when_the_transaction_rolls_back(self):
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                flaky_job.enqueue(0)
+                raise RuntimeError
+        self.assertEqual(calls, [])
+
+    def test_periodic_runs_pick_up_retried_emails(self):
+        user = get_user_model().objects.create_user(username='kofi', email='kofi@example.com', password='x')
+        OutboxEmail.objects.all().delete()
+        mail.outbox = []
+        # Due for a retry, with no new email queued to trigger a delivery run.
+        OutboxEmail.objects.create(key='retry', kind=OutboxEmail.KIND_WELCOME, object_id=user.pk, attempts=1,
+                                   next_attempt_at=timezone.now() - timedelta(seconds=1))
+
+        schedule = celery_app.conf.beat_schedule
+        self.assertEqual({entry['args'][0] for entry in schedule.values()},
+                         {jobs.job_name(outbox.deliver_outbox_emails), jobs.job_name(process_paystack_events)})
+        for entry in schedule.values():
+            celery_app.tasks[entry['task']].apply_async(args=entry['args'])
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.STATUS_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_delivery_jobs_retry_transient_errors(self):
+        for func in (outbox.deliver_outbox_emails, process_paystack_events):
+            self.assertEqual(jobs.max_attempts(jobs.job_name(func)), settings.JOBS_MAX_ATTEMPTS)
@@ -0,0 +1,20 @@
+"""
+Celery app for ecommerce_backend, used when JOBS_BACKEND is
+'core.jobs.CeleryBackend'. Start a worker with:
+
+    celery -A ecommerce_backend worker
+
+and the scheduler for the periodic delivery runs (CELERY_BEAT_SCHEDULE) with:
+
+    celery -A ecommerce_backend beat
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_backend.settings')
+
+app = Celery('ecommerce_backend')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
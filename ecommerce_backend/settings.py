@@ -15,6 +15,7 @@ from decouple import config
 from datetime import timedelta
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
@@ -100,6 +101,82 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared across workers when REDIS_URL is set, so catalog invalidation is seen everywhere.
+
+REDIS_URL = config('REDIS_URL', default=None)
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cart contents live in the database by default. 'store.cart_storage.RedisCartStore'
+# keeps them in Redis and writes them back at checkout and from `manage.py flush_carts`.
+CART_STORE = config('CART_STORE', default='store.cart_storage.DatabaseCartStore')
+CART_REDIS_URL = config('CART_REDIS_URL', default=REDIS_URL or 'redis://localhost:6379/0')
+CART_REDIS_TTL = config('CART_REDIS_TTL', default=60 * 60 * 24 * 30, cast=int)
+# Carts untouched for this long are deleted by `manage.py reap_carts`.
+CART_IDLE_DAYS = config('CART_IDLE_DAYS', default=30, cast=int)
+
+# How long responses to POST /orders/ and initialize-payment are kept for
+# requests retried with the same Idempotency-Key header. They are kept in the
+# default cache, so retries are only recognized across workers when REDIS_URL is set.
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24, cast=int)
+
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 15, cast=int)
+
+# Background jobs (core/jobs.py): emails and webhook processing. The default
+# runs them on a bounded thread pool in each web process; set
+# JOBS_BACKEND=core.jobs.CeleryBackend to send them to Celery workers instead.
+JOBS_BACKEND = config('JOBS_BACKEND', default='core.jobs.ThreadPoolBackend')
+JOBS_THREAD_WORKERS = config('JOBS_THREAD_WORKERS', default=4, cast=int)
+# A failing job is retried after JOBS_RETRY_BACKOFF seconds, doubling each time,
+# and recorded as a FailedJob after JOBS_MAX_ATTEMPTS attempts.
+JOBS_MAX_ATTEMPTS = config('JOBS_MAX_ATTEMPTS', default=3, cast=int)
+JOBS_RETRY_BACKOFF = config('JOBS_RETRY_BACKOFF', default=5, cast=float)
+
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL or 'redis://localhost:6379/0')
+CELERY_TASK_ACKS_LATE = True
+# Run tasks in the calling process (tests, local development without a broker).
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+
+# Retried outbox emails and webhook events, and emails whose lease expired after
+# a crashed run, are only picked up by the next delivery run. Celery beat
+# (`celery -A ecommerce_backend beat`) starts one every JOBS_POLL_INTERVAL
+# seconds; with the thread pool backend run `manage.py deliver_emails --loop`
+# and `manage.py process_paystack_events --loop` instead.
+JOBS_POLL_INTERVAL = config('JOBS_POLL_INTERVAL', default=60, cast=float)
+CELERY_BEAT_SCHEDULE = {
+    'deliver-outbox-emails': {
+        'task': 'core.run_job',
+        'schedule': JOBS_POLL_INTERVAL,
+        'args': ('core.outbox.deliver_outbox_emails', [], {}),
+    },
+    'process-paystack-events': {
+        'task': 'core.run_job',
+        'schedule': JOBS_POLL_INTERVAL,
+        'args': ('store.payments.process_paystack_events', [], {}),
+    },
+}
+
+# Upper bounds (GHS) of the price buckets reported by /store/products/facets/
+CATALOG_PRICE_BUCKETS = [50, 100, 200, 500]
+
+# Product search (PostgreSQL text search configuration). Used for the stored
+# search vectors too: after changing it, run manage.py rebuild_search_index.
+SEARCH_CONFIG = 'english'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -187,6 +264,8 @@ SIMPLE_JWT = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -195,6 +274,52 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('EMAIL_HOST_USER')
+# Outgoing mail shares one connection per process (core/mail.py): it is
+# recycled after EMAIL_BATCH_SIZE messages and closed after
+# EMAIL_CONNECTION_IDLE_TIMEOUT idle seconds. EMAIL_SEND_RATE caps messages per
+# second (0 for no limit); a failed send is retried EMAIL_SEND_RETRIES times.
+# At exit a process waits up to EMAIL_SHUTDOWN_TIMEOUT seconds for queued mail.
+EMAIL_BATCH_SIZE = config('EMAIL_BATCH_SIZE', default=50, cast=int)
+EMAIL_SEND_RATE = config('EMAIL_SEND_RATE', default=0, cast=float)
+EMAIL_SEND_RETRIES = config('EMAIL_SEND_RETRIES', default=2, cast=int)
+EMAIL_CONNECTION_IDLE_TIMEOUT = config('EMAIL_CONNECTION_IDLE_TIMEOUT', default=5, cast=float)
+EMAIL_SHUTDOWN_TIMEOUT = config('EMAIL_SHUTDOWN_TIMEOUT', default=30, cast=float)
+# Outbox emails (core/outbox.py) that fail are retried after
+# EMAIL_OUTBOX_RETRY_DELAY seconds, doubling each time, until they are marked failed.
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_RETRY_DELAY = config('EMAIL_OUTBOX_RETRY_DELAY', default=60, cast=int)
+# A delivery run leases the emails it claims for this many seconds; emails a
+# crashed run never marked sent are picked up again once the lease runs out.
+EMAIL_OUTBOX_LEASE = config('EMAIL_OUTBOX_LEASE', default=300, cast=int)
 
 PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY')
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY')
+# Shared HTTP session used for Paystack calls (store/paystack.py).
+PAYSTACK_POOL_SIZE = config('PAYSTACK_POOL_SIZE', default=10, cast=int)
+# Seconds a call waits for a free pooled connection before failing.
+PAYSTACK_POOL_TIMEOUT = config('PAYSTACK_POOL_TIMEOUT', default=5, cast=float)
+PAYSTACK_CONNECT_TIMEOUT = config('PAYSTACK_CONNECT_TIMEOUT', default=3.05, cast=float)
+PAYSTACK_READ_TIMEOUT = config('PAYSTACK_READ_TIMEOUT', default=10, cast=float)
+PAYSTACK_MAX_RETRIES = config('PAYSTACK_MAX_RETRIES', default=3, cast=int)
+PAYSTACK_RETRY_BACKOFF = config('PAYSTACK_RETRY_BACKOFF', default=0.5, cast=float)
+# Circuit breaker (store/circuit_breaker.py): after this many failed or slow
+# (over PAYSTACK_CIRCUIT_SLOW_CALL seconds) calls in a row, payment endpoints
+# answer 503 without calling Paystack for PAYSTACK_CIRCUIT_RESET_TIMEOUT
+# seconds, then let one call through to probe for recovery. Its state is in the
+# default cache, so workers only share the circuit when REDIS_URL is set.
+PAYSTACK_CIRCUIT_FAILURE_THRESHOLD = config('PAYSTACK_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+PAYSTACK_CIRCUIT_SLOW_CALL = config('PAYSTACK_CIRCUIT_SLOW_CALL', default=5, cast=float)
+PAYSTACK_CIRCUIT_RESET_TIMEOUT = config('PAYSTACK_CIRCUIT_RESET_TIMEOUT', default=30, cast=int)
+# Webhook inbox retries: first retry after PAYSTACK_EVENT_RETRY_DELAY seconds,
+# doubling each time, until the event is marked failed.
+PAYSTACK_EVENT_MAX_ATTEMPTS = config('PAYSTACK_EVENT_MAX_ATTEMPTS', default=5, cast=int)
+PAYSTACK_EVENT_RETRY_DELAY = config('PAYSTACK_EVENT_RETRY_DELAY', default=60, cast=int)
+# How long a Paystack verify result is reused for polls of the same reference.
+# Orders whose payment is already final are answered without asking Paystack.
+PAYSTACK_VERIFY_CACHE_TTL = config('PAYSTACK_VERIFY_CACHE_TTL', default=5, cast=int)
+# Serve initialize-payment, verify and the webhook from async views. Only useful
+# when running under an ASGI server (ecommerce_backend/asgi.py).
+PAYSTACK_ASYNC_VIEWS = config('PAYSTACK_ASYNC_VIEWS', default=False, cast=bool)
+# How long initialize-payment keeps handing back an existing checkout for an
+# unchanged order before asking Paystack for a new one.
+PAYSTACK_ACCESS_CODE_TTL = config('PAYSTACK_ACCESS_CODE_TTL', default=60 * 60 * 12, cast=int)
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Collection, Product, Customer, Order, OrderItem, Cart, CartItem, Branch, BranchAccount, ProductImage,ProductSize
+from .models import Collection, Product, Customer, Order, OrderItem, Cart, CartItem, Branch, BranchAccount, ProductImage,ProductSize, \
+    PaystackEvent
+from .payments import replay_paystack_events
+from .pricing import backfill_order_totals
 
 @admin.register(Collection)
 class CollectionAdmin(admin.ModelAdmin):
@@ -45,10 +48,11 @@ class OrderItemInline(admin.TabularInline):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'get_customer_name', 'recipient_name', 'status', 'payment_status', 'created_at', 'branch']
+    list_display = ['id', 'get_customer_name', 'recipient_name', 'total', 'status', 'payment_status', 'created_at', 'branch']
     list_filter = ['status', 'payment_status', 'created_at', 'branch']
     search_fields = ['recipient_name', 'customer__user__first_name', 'customer__user__last_name', 'customer__user__username', 'customer__phone']
-    readonly_fields = ['created_at', 'paystack_ref', 'paystack_access_code', 'payment_status', 'customer', 'get_customer_phone']  # Added get_customer_phone
+    readonly_fields = ['created_at', 'paystack_ref', 'paystack_access_code', 'payment_status', 'customer', 'get_customer_phone',
+                       'subtotal', 'customization_total', 'total', 'paystack_amount', 'paystack_initialized_at']  # Added get_customer_phone
     inlines = [OrderItemInline]
 
     def get_customer_name(self, obj):
@@ -70,6 +74,11 @@ class OrderAdmin(admin.ModelAdmin):
         qs = qs.select_related('customer__user', 'branch')
         return qs.filter(payment_status=Order.PAYMENT_COMPLETED)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Items removed in the inline change what the order costs.
+        backfill_order_totals(Order.objects.filter(pk=form.instance.pk))
+
     fieldsets = (
         ('Customer Information', {
             'fields': ('customer', 'get_customer_phone', 'recipient_name', 'recipient_number', 'recipient_address')
@@ -81,7 +90,8 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('delivery_date', 'delivery_time', 'secret_message')
         }),
         ('Payment Information', {
-            'fields': ('paystack_ref', 'paystack_access_code')
+            'fields': ('subtotal', 'customization_total', 'total', 'paystack_ref', 'paystack_access_code',
+                       'paystack_amount', 'paystack_initialized_at')
         }),
     )
 class CartItemInline(admin.TabularInline):
@@ -91,10 +101,10 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['id', 'user', 'created_at', 'updated_at']
+    list_filter = ['created_at', 'updated_at']
     search_fields = ['id', 'user__username']
-    readonly_fields = ['id', 'created_at']
+    readonly_fields = ['id', 'created_at', 'updated_at']
     inlines = [CartItemInline]
 
 @admin.register(Branch)
@@ -105,4 +115,18 @@ class BranchAdmin(admin.ModelAdmin):
 @admin.register(BranchAccount)
 class BranchAccountAdmin(admin.ModelAdmin):
     list_display = ['user', 'branch']
-    search_fields = ['user__username', 'branch__name']
\ No newline at end of file
+    search_fields = ['user__username', 'branch__name']
+
+@admin.register(PaystackEvent)
+class PaystackEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'reference', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['status', 'event']
+    search_fields = ['reference', 'key']
+    readonly_fields = ['key', 'event', 'reference', 'payload', 'status', 'attempts', 'last_error',
+                       'received_at', 'next_attempt_at', 'processed_at']
+    actions = ['replay']
+
+    @admin.action(description='Replay selected events')
+    def replay(self, request, queryset):
+        queued = replay_paystack_events(queryset)
+        self.message_user(request, f'{queued} event(s) queued; they are applied by process_paystack_events.')
@@ -0,0 +1,106 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+# Version namespaces. Every cached catalog response embeds the versions it was
+# built from in its key, so bumping a version makes the old entries unreachable
+# (they simply expire) without touching any other key in the cache.
+CATALOG_NAMESPACE = 'catalog'
+COLLECTIONS_NAMESPACE = 'collections'
+
+
+def product_namespace(product_id):
+    return f'product:{product_id}'
+
+
+def _version_key(namespace):
+    return f'store:version:{namespace}'
+
+
+def get_version(namespace):
+    """Return the current version number for a namespace, creating it if missing."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted version never restarts at a value
+        # that older, still-cached entries were built with.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate every cache entry built from the given namespace."""
+    key = _version_key(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def build_cache_key(prefix, request, namespaces):
+    """
+    Build a response cache key that varies by namespace versions, the
+    staff/non-staff audience and the (normalized) query string.
+    """
+    versions = '.'.join(str(get_version(namespace)) for namespace in namespaces)
+    audience = 'staff' if request.user.is_staff else 'public'
+    query = sorted(
+        (key, value)
+        for key in request.query_params
+        for value in request.query_params.getlist(key)
+    )
+    raw = f'{request.get_host()}{request.path}?{query}'
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'store:{prefix}:{versions}:{audience}:{digest}'
+
+
+class CachedCatalogMixin:
+    """
+    Caches the serialized output of ``list`` and ``retrieve``.
+
+    List responses depend on the whole catalog; a single product only depends on
+    itself and on the collection names, so editing one product leaves every
+    other product's detail entry intact.
+    """
+    cache_prefix = None
+    cache_timeout = None
+
+    def get_cache_timeout(self):
+        if self.cache_timeout is not None:
+            return self.cache_timeout
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+    def get_list_cache_namespaces(self):
+        return [CATALOG_NAMESPACE, COLLECTIONS_NAMESPACE]
+
+    def get_detail_cache_namespaces(self):
+        return [product_namespace(self.kwargs[self.lookup_url_kwarg or self.lookup_field]),
+                COLLECTIONS_NAMESPACE]
+
+    def _cached_response(self, key, render):
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.get_cache_timeout())
+        return response
+
+    def cached_list_response(self, name, request, render):
+        """Cache any response that depends on the same data as the list (e.g. extra list actions)."""
+        key = build_cache_key(f'{self.cache_prefix}:{name}', request, self.get_list_cache_namespaces())
+        return self._cached_response(key, render)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_list_response(
+            'list', request, lambda: super(CachedCatalogMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        key = build_cache_key(f'{self.cache_prefix}:detail', request, self.get_detail_cache_namespaces())
+        return self._cached_response(key, lambda: super(CachedCatalogMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,629 @@
+"""
+Pluggable storage for cart contents.
+
+The cart API talks to the backend named by ``settings.CART_STORE``:
+
+* ``DatabaseCartStore`` (default) reads and writes ``Cart``/``CartItem`` rows directly.
+* ``RedisCartStore`` keeps cart items in Redis hashes and only writes them to the
+  database when the cart is flushed, i.e. at checkout or from
+  ``manage.py flush_carts``. ``Cart`` rows themselves are still created in the
+  database so orders and the admin can refer to them.
+
+Both return ``Cart``/``CartItem`` instances so the serializers do not care
+which backend is in use.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+
+from .models import Cart, CartItem, Product, set_prefetched
+
+OP_ADD = 'add'
+OP_UPDATE = 'update'
+OP_REMOVE = 'remove'
+
+
+def _line_key(item):
+    return item.product_id, item.with_customization, item.selected_size
+
+
+def _fail(index, message):
+    raise serializers.ValidationError({'operations': {index: [message]}})
+
+
+def plan_operations(cart_id, items, operations):
+    """
+    Apply add/update/remove operations to ``items`` in memory, in order.
+
+    Returns ``{line key: CartItem}`` describing the resulting cart; new lines are
+    unsaved ``CartItem`` instances and lines that became identical are merged.
+    Raises ValidationError naming the first failing operation.
+    """
+    by_id = {item.pk: item for item in items}
+    lines = {_line_key(item): item for item in items}
+
+    product_ids = {op['product_id'] for op in operations if op['op'] == OP_ADD}
+    known_products = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True)) if product_ids else set()
+
+    for index, op in enumerate(operations):
+        if op['op'] == OP_ADD:
+            if op['product_id'] not in known_products:
+                _fail(index, 'This product does not exist')
+            key = (op['product_id'], op.get('with_customization', False), op.get('selected_size') or '')
+            if key in lines:
+                lines[key].quantity += op['quantity']
+            else:
+                lines[key] = CartItem(cart_id=cart_id, product_id=key[0], quantity=op['quantity'],
+                                      with_customization=key[1], selected_size=key[2])
+            continue
+
+        item = by_id.get(op['id'])
+        if item is None or lines.get(_line_key(item)) is not item:
+            _fail(index, 'No item with the given ID in this cart')
+        del lines[_line_key(item)]
+        if op['op'] == OP_REMOVE:
+            continue
+
+        item.quantity = op.get('quantity', item.quantity)
+        item.with_customization = op.get('with_customization', item.with_customization)
+        item.selected_size = op.get('selected_size', item.selected_size) or ''
+        key = _line_key(item)
+        if key in lines:
+            # The update made this line identical to another one: merge them.
+            lines[key].quantity += item.quantity
+        else:
+            lines[key] = item
+    return lines
+
+
+def write_lines(cart_id, original, lines):
+    """
+    Make the cart's rows match ``lines``, keeping the id of every row that is
+    still in the cart. ``original`` maps the ids of the rows currently stored
+    to their ``(line key, quantity)``; lines without a pk are inserted.
+    """
+    kept = {item.pk: item for item in lines if item.pk is not None}
+    to_delete = [pk for pk in original if pk not in kept]
+    to_create = [item for item in lines if item.pk is None]
+    to_update = []
+    # Rows whose line key changed, by the key they still hold.
+    moving = {}
+    for pk, item in kept.items():
+        if original[pk][0] != _line_key(item):
+            moving[original[pk][0]] = item
+        elif original[pk][1] != item.quantity:
+            to_update.append(item)
+
+    if to_delete:
+        CartItem.objects.filter(pk__in=to_delete).delete()
+    # Move each row onto its new key once no other row holds it, so the unique
+    # constraint never sees two rows with the same key.
+    while moving:
+        ready = [(key, item) for key, item in moving.items() if _line_key(item) not in moving]
+        if not ready:
+            # The remaining rows swap keys among themselves: re-insert one of them.
+            key, item = moving.popitem()
+            CartItem.objects.filter(pk=item.pk).delete()
+            item.pk = None
+            to_create.append(item)
+            continue
+        for key, item in ready:
+            item.save(update_fields=['quantity', 'with_customization', 'selected_size'])
+            del moving[key]
+    if to_update:
+        CartItem.objects.bulk_update(to_update, ['quantity'])
+    if to_create:
+        CartItem.objects.bulk_create(to_create)
+
+
+class BaseCartStore(ABC):
+    """
+    Interface shared by the cart backends.
+
+    ``product_queryset`` arguments decide how each item's ``product`` is loaded
+    (e.g. full cards or only pricing columns); ``None`` means items are not needed.
+    """
+
+    @abstractmethod
+    def get_or_create_cart(self, user_id, product_queryset=None):
+        """Return ``(cart, created)`` for the user's cart."""
+
+    @abstractmethod
+    def get_carts(self, user_id, product_queryset=None):
+        """Return all of the user's carts."""
+
+    @abstractmethod
+    def get_cart(self, cart_id, user_id, product_queryset=None):
+        """Return the cart if it belongs to the user, else None."""
+
+    @abstractmethod
+    def get_items(self, cart_id, user_id, product_queryset):
+        """Return the cart's items; empty if the cart does not belong to the user."""
+
+    @abstractmethod
+    def add_item(self, cart_id, user_id, product_id, quantity, with_customization=False, selected_size=''):
+        """Add to (or increment) a line; None if the cart or product does not exist."""
+
+    def update_item(self, cart_id, user_id, item, **changes):
+        """
+        Change a line the way a batch ``update`` would: a line that becomes
+        identical to another one is merged into it. Returns the resulting line.
+        """
+        lines = self.apply_operations(cart_id, user_id, [{'op': OP_UPDATE, 'id': item.pk, **changes}])
+        key = (item.product_id, changes.get('with_customization', item.with_customization),
+               changes.get('selected_size', item.selected_size) or '')
+        updated = lines[key]
+        if hasattr(item, '_state') and 'product' in item._state.fields_cache:
+            updated.product = item.product
+        return updated
+
+    @abstractmethod
+    def remove_item(self, cart_id, user_id, item_id):
+        """Remove a line; returns whether there was one to remove."""
+
+    @abstractmethod
+    def apply_operations(self, cart_id, user_id, operations):
+        """Apply batch operations (see ``plan_operations``); returns ``{line key: CartItem}``."""
+
+    @abstractmethod
+    def delete_cart(self, cart_id, user_id):
+        """Delete the cart if it belongs to the user; returns whether it did."""
+
+    def flush(self, cart_id, user_id=None):
+        """
+        Persist the cart's items to the database, in a transaction of their own.
+        With ``user_id``, a cart belonging to someone else is left alone.
+        """
+
+    def flush_dirty(self):
+        """Persist every cart changed since its last flush; returns how many were flushed."""
+        return 0
+
+    def discard(self, cart_id):
+        """Forget any state held outside the database (after checkout or deletion)."""
+
+    def get_item(self, cart_id, user_id, item_id, product_queryset):
+        items = self.get_items(cart_id, user_id, product_queryset)
+        return next((item for item in items if item.pk == item_id), None)
+
+
+class DatabaseCartStore(BaseCartStore):
+
+    def _carts(self, user_id, product_queryset):
+        queryset = Cart.objects.filter(user_id=user_id)
+        if product_queryset is not None:
+            queryset = queryset.prefetch_related(Prefetch('items__product', queryset=product_queryset))
+        return queryset
+
+    def get_or_create_cart(self, user_id, product_queryset=None):
+        cart = self._carts(user_id, product_queryset).first()
+        if cart:
+            return cart, False
+        return Cart.objects.create(user_id=user_id), True
+
+    def get_carts(self, user_id, product_queryset=None):
+        return list(self._carts(user_id, product_queryset))
+
+    def get_cart(self, cart_id, user_id, product_queryset=None):
+        return self._carts(user_id, product_queryset).filter(pk=cart_id).first()
+
+    def get_items(self, cart_id, user_id, product_queryset):
+        # Ownership is checked by the join instead of a separate exists() query.
+        return list(CartItem.objects.filter(cart_id=cart_id, cart__user_id=user_id).prefetch_related(
+            Prefetch('product', queryset=product_queryset)))
+
+    def get_item(self, cart_id, user_id, item_id, product_queryset):
+        return CartItem.objects.filter(pk=item_id, cart_id=cart_id, cart__user_id=user_id).prefetch_related(
+            Prefetch('product', queryset=product_queryset)).first()
+
+    def add_item(self, cart_id, user_id, product_id, quantity, with_customization=False, selected_size=''):
+        item = CartItem.objects.add_or_increment(cart_id, user_id, product_id, quantity,
+                                                 with_customization, selected_size)
+        if item is not None:
+            Cart.objects.filter(pk=cart_id).touch()
+        return item
+
+    def remove_item(self, cart_id, user_id, item_id):
+        deleted, _ = CartItem.objects.filter(pk=item_id, cart_id=cart_id, cart__user_id=user_id).delete()
+        if deleted:
+            Cart.objects.filter(pk=cart_id).touch()
+        return bool(deleted)
+
+    def apply_operations(self, cart_id, user_id, operations):
+        with transaction.atomic():
+            if not Cart.objects.select_for_update().filter(pk=cart_id, user_id=user_id).exists():
+                raise NotFound('No cart with the given ID was found')
+
+            existing = list(CartItem.objects.filter(cart_id=cart_id))
+            original = {item.pk: (_line_key(item), item.quantity) for item in existing}
+            lines = plan_operations(cart_id, existing, operations)
+            write_lines(cart_id, original, list(lines.values()))
+            Cart.objects.filter(pk=cart_id).touch()
+        return lines
+
+    def delete_cart(self, cart_id, user_id):
+        deleted, _ = Cart.objects.filter(pk=cart_id, user_id=user_id).delete()
+        return bool(deleted)
+
+
+# Adds quantity to a line, creating it if needed, in one round trip.
+# KEYS: meta, lines, items, quantities, dirty set
+# ARGV: line key, quantity, cart id, ttl, user id
+# Returns nil (cart not loaded), -1 (not the owner) or {id, quantity, created}.
+_ADD_ITEM_SCRIPT = """
+local owner = redis.call('HGET', KEYS[1], 'user_id')
+if not owner then return nil end
+if owner ~= ARGV[5] then return -1 end
+local id = redis.call('HGET', KEYS[2], ARGV[1])
+local created = 0
+if not id then
+  id = redis.call('HINCRBY', KEYS[1], 'next_id', -1)
+  redis.call('HSET', KEYS[2], ARGV[1], id)
+  redis.call('HSET', KEYS[3], id, ARGV[1])
+  created = 1
+end
+local quantity = redis.call('HINCRBY', KEYS[4], id, ARGV[2])
+redis.call('SADD', KEYS[5], ARGV[3])
+for i = 1, 4 do redis.call('EXPIRE', KEYS[i], ARGV[4]) end
+return {tonumber(id), quantity, created}
+"""
+
+
+class RedisCartStore(BaseCartStore):
+    """
+    Write-behind cart store.
+
+    Per cart it keeps a ``meta`` hash (owner, creation time, item id counter),
+    ``lines`` (line key -> item id), ``items`` (item id -> line key) and
+    ``qty`` (item id -> quantity). Carts are loaded from the database on first
+    use and expire after ``CART_REDIS_TTL`` seconds without writes.
+
+    Lines keep the id of their database row. Lines added since the last flush
+    have negative ids; the flush gives them their row's id and records the old
+    one in ``alias`` so requests still using it find the line.
+    """
+
+    def __init__(self, client=None, prefix='store', ttl=None):
+        if client is None:
+            client = redis.Redis.from_url(settings.CART_REDIS_URL)
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = ttl or getattr(settings, 'CART_REDIS_TTL', 60 * 60 * 24 * 30)
+        self._add_item = self.redis.register_script(_ADD_ITEM_SCRIPT)
+
+    # Keys
+
+    def _keys(self, cart_id):
+        base = f'{self.prefix}:cart:{cart_id}'
+        return f'{base}:meta', f'{base}:lines', f'{base}:items', f'{base}:qty'
+
+    def _alias_key(self, cart_id):
+        return f'{self.prefix}:cart:{cart_id}:alias'
+
+    def _user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}:cart'
+
+    @property
+    def _dirty_key(self):
+        return f'{self.prefix}:carts:dirty'
+
+    @staticmethod
+    def _encode_line(product_id, with_customization, selected_size):
+        return f'{product_id}|{int(bool(with_customization))}|{selected_size or ""}'
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    # Loading and reading
+
+    def _load(self, cart_id):
+        """Copy a cart from the database into Redis. Returns its meta hash, or None."""
+        cart = Cart.objects.filter(pk=cart_id).first()
+        if cart is None:
+            return None
+        items = list(CartItem.objects.filter(cart_id=cart_id))
+        meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+        meta = {
+            'user_id': cart.user_id or '',
+            'created_at': cart.created_at.isoformat(),
+            'next_id': 0,
+        }
+        with self.redis.pipeline() as pipe:
+            pipe.delete(meta_key, lines_key, items_key, qty_key, self._alias_key(cart_id))
+            pipe.hset(meta_key, mapping=meta)
+            for item in items:
+                line = self._encode_line(item.product_id, item.with_customization, item.selected_size)
+                pipe.hset(lines_key, line, item.pk)
+                pipe.hset(items_key, item.pk, line)
+                pipe.hset(qty_key, item.pk, item.quantity)
+            for key in (meta_key, lines_key, items_key, qty_key):
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        return {key: str(value) for key, value in meta.items()}
+
+    def _meta(self, cart_id):
+        meta = self.redis.hgetall(self._keys(cart_id)[0])
+        if not meta:
+            return self._load(cart_id)
+        return {self._decode(key): self._decode(value) for key, value in meta.items()}
+
+    def _read_items(self, cart_id):
+        meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+        with self.redis.pipeline() as pipe:
+            pipe.hgetall(items_key)
+            pipe.hgetall(qty_key)
+            lines, quantities = pipe.execute()
+        items = []
+        for item_id, line in lines.items():
+            product_id, with_customization, selected_size = self._decode(line).split('|', 2)
+            items.append(CartItem(
+                id=int(item_id), cart_id=cart_id, product_id=int(product_id),
+                quantity=int(quantities.get(item_id, 0)), with_customization=with_customization == '1',
+                selected_size=selected_size,
+            ))
+        # Saved lines first, then the ones added since the last flush, oldest first.
+        return sorted(items, key=lambda item: (item.pk < 0, abs(item.pk)))
+
+    def _hydrate(self, cart_id, meta, product_queryset):
+        cart = Cart(id=cart_id, user_id=int(meta['user_id']) if meta['user_id'] else None,
+                    created_at=datetime.fromisoformat(meta['created_at']))
+        if product_queryset is not None:
+            set_prefetched(cart, 'items', self._attach_products(self._read_items(cart_id), product_queryset))
+        return cart
+
+    @staticmethod
+    def _attach_products(items, product_queryset):
+        products = product_queryset.in_bulk({item.product_id for item in items})
+        attached = []
+        for item in items:
+            if item.product_id in products:
+                item.product = products[item.product_id]
+                attached.append(item)
+        return attached
+
+    def _owned_meta(self, cart_id, user_id):
+        meta = self._meta(cart_id)
+        if meta is None or meta['user_id'] != str(user_id):
+            return None
+        return meta
+
+    def get_or_create_cart(self, user_id, product_queryset=None):
+        cart_id = self.redis.get(self._user_key(user_id))
+        if cart_id is not None:
+            cart_id = self._decode(cart_id)
+            meta = self._owned_meta(cart_id, user_id)
+            if meta is not None:
+                return self._hydrate(cart_id, meta, product_queryset), False
+
+        created = False
+        cart = Cart.objects.filter(user_id=user_id).first()
+        if cart is None:
+            cart = Cart.objects.create(user_id=user_id)
+            created = True
+        self.redis.set(self._user_key(user_id), str(cart.pk), ex=self.ttl)
+        meta = self._meta(cart.pk)
+        return self._hydrate(str(cart.pk), meta, product_queryset), created
+
+    def get_carts(self, user_id, product_queryset=None):
+        carts = []
+        for cart_id in Cart.objects.filter(user_id=user_id).values_list('pk', flat=True):
+            meta = self._owned_meta(str(cart_id), user_id)
+            if meta is not None:
+                carts.append(self._hydrate(str(cart_id), meta, product_queryset))
+        return carts
+
+    def get_cart(self, cart_id, user_id, product_queryset=None):
+        meta = self._owned_meta(str(cart_id), user_id)
+        if meta is None:
+            return None
+        return self._hydrate(str(cart_id), meta, product_queryset)
+
+    def get_items(self, cart_id, user_id, product_queryset):
+        if self._owned_meta(str(cart_id), user_id) is None:
+            return []
+        return self._attach_products(self._read_items(str(cart_id)), product_queryset)
+
+    def get_item(self, cart_id, user_id, item_id, product_queryset):
+        item_id, = self._resolve_ids(str(cart_id), [item_id])
+        return super().get_item(cart_id, user_id, item_id, product_queryset)
+
+    def _resolve_ids(self, cart_id, item_ids, client=None):
+        """Map ids a flush has replaced (see ``flush``) to the lines' current ids."""
+        if not any(item_id < 0 for item_id in item_ids):
+            return list(item_ids)
+        aliases = (client or self.redis).hmget(self._alias_key(cart_id), item_ids)
+        return [int(alias) if alias is not None else item_id for item_id, alias in zip(item_ids, aliases)]
+
+    # Writing
+
+    def add_item(self, cart_id, user_id, product_id, quantity, with_customization=False, selected_size=''):
+        cart_id = str(cart_id)
+        line = self._encode_line(product_id, with_customization, selected_size)
+        for attempt in range(2):
+            result = self._add_item(keys=[*self._keys(cart_id), self._dirty_key],
+                                    args=[line, quantity, cart_id, self.ttl, str(user_id)])
+            if result is None and attempt == 0 and self._load(cart_id) is not None:
+                continue
+            break
+        if result is None or result == -1:
+            return None
+        item_id, quantity, created = result
+        # Only a new line can name an unknown product; adding to an existing
+        # line needs no database query.
+        if created and not Product.objects.filter(pk=product_id).exists():
+            meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+            with self.redis.pipeline() as pipe:
+                pipe.hdel(lines_key, line)
+                pipe.hdel(items_key, item_id)
+                pipe.hdel(qty_key, item_id)
+                pipe.execute()
+            return None
+        return CartItem(id=int(item_id), cart_id=cart_id, product_id=product_id, quantity=int(quantity),
+                        with_customization=with_customization, selected_size=selected_size or '')
+
+    def _queue_write(self, pipe, cart_id, lines, next_id):
+        """Queue commands replacing the cart's lines, allocating ids for new ones."""
+        meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+        pipe.delete(lines_key, items_key, qty_key)
+        for item in lines.values():
+            if item.pk is None:
+                next_id -= 1
+                item.pk = next_id
+            line = self._encode_line(item.product_id, item.with_customization, item.selected_size)
+            pipe.hset(lines_key, line, item.pk)
+            pipe.hset(items_key, item.pk, line)
+            pipe.hset(qty_key, item.pk, item.quantity)
+        pipe.hset(meta_key, 'next_id', next_id)
+        pipe.sadd(self._dirty_key, cart_id)
+        for key in (meta_key, lines_key, items_key, qty_key):
+            pipe.expire(key, self.ttl)
+
+    def apply_operations(self, cart_id, user_id, operations):
+        cart_id = str(cart_id)
+        if self._owned_meta(cart_id, user_id) is None:
+            raise NotFound('No cart with the given ID was found')
+        meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+
+        # Optimistic locking: re-plan if another request changes the cart
+        # between reading it and writing the result back.
+        while True:
+            with self.redis.pipeline() as pipe:
+                try:
+                    pipe.watch(meta_key, items_key, qty_key)
+                    next_id = int(pipe.hget(meta_key, 'next_id') or 0)
+                    ids = self._resolve_ids(cart_id, [op.get('id', 0) for op in operations], pipe)
+                    resolved = [{**op, 'id': item_id} if 'id' in op else op
+                                for op, item_id in zip(operations, ids)]
+                    lines = plan_operations(cart_id, self._read_items(cart_id), resolved)
+                    pipe.multi()
+                    self._queue_write(pipe, cart_id, lines, next_id)
+                    pipe.execute()
+                    return lines
+                except redis.WatchError:
+                    continue
+
+    def remove_item(self, cart_id, user_id, item_id):
+        try:
+            self.apply_operations(cart_id, user_id, [{'op': OP_REMOVE, 'id': item_id}])
+        except (NotFound, serializers.ValidationError):
+            return False
+        return True
+
+    def delete_cart(self, cart_id, user_id):
+        deleted, _ = Cart.objects.filter(pk=cart_id, user_id=user_id).delete()
+        self.discard(cart_id)
+        return bool(deleted)
+
+    # Persistence
+
+    def flush(self, cart_id, user_id=None):
+        cart_id = str(cart_id)
+        keys = self._keys(cart_id)
+        if user_id is not None:
+            owner = self.redis.hget(keys[0], 'user_id')
+            if owner is not None and self._decode(owner) != str(user_id):
+                return
+        while True:
+            with self.redis.pipeline() as pipe:
+                try:
+                    # A change made while the cart is being written to the
+                    # database aborts the EXEC below: the database transaction
+                    # rolls back and the flush starts over, so the cart is only
+                    # marked clean with the contents that were actually saved.
+                    pipe.watch(*keys)
+                    if not pipe.exists(keys[0]):
+                        pipe.multi()
+                        pipe.srem(self._dirty_key, cart_id)
+                        pipe.execute()
+                        return
+                    items = self._read_items(cart_id)
+                    with transaction.atomic():
+                        if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                            pipe.reset()
+                            self.discard(cart_id)
+                            return
+                        renumbered = self._save_items(cart_id, items)
+                        pipe.multi()
+                        self._queue_renumber(pipe, cart_id, renumbered)
+                        pipe.srem(self._dirty_key, cart_id)
+                        pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def _save_items(self, cart_id, items):
+        """
+        Write the cart's lines to the database. Returns ``{old id: CartItem}``
+        for the lines that were inserted and so got a new id.
+        """
+        original = {item.pk: (_line_key(item), item.quantity) for item in CartItem.objects.filter(cart_id=cart_id)}
+        # Products deleted since they were added to the cart are dropped.
+        products = set(Product.objects.filter(pk__in={item.product_id for item in items}).values_list('pk', flat=True))
+        lines, renumbered = [], {}
+        for item in items:
+            if item.quantity <= 0 or item.product_id not in products:
+                continue
+            if item.pk not in original:
+                renumbered[item.pk] = item
+                item.pk = None
+            lines.append(item)
+        write_lines(cart_id, original, lines)
+        if any(item.pk is None for item in renumbered.values()):
+            # The database did not return the new ids from the INSERT.
+            ids = {
+                _line_key(row): row.pk
+                for row in CartItem.objects.filter(cart_id=cart_id).only(
+                    'pk', 'product_id', 'with_customization', 'selected_size')
+            }
+            for item in renumbered.values():
+                item.pk = ids[_line_key(item)]
+        Cart.objects.filter(pk=cart_id).touch()
+        return renumbered
+
+    def _queue_renumber(self, pipe, cart_id, renumbered):
+        """Queue commands moving inserted lines to their new ids."""
+        if not renumbered:
+            return
+        meta_key, lines_key, items_key, qty_key = self._keys(cart_id)
+        alias_key = self._alias_key(cart_id)
+        pipe.hdel(items_key, *renumbered)
+        pipe.hdel(qty_key, *renumbered)
+        for old_id, item in renumbered.items():
+            line = self._encode_line(item.product_id, item.with_customization, item.selected_size)
+            pipe.hset(lines_key, line, item.pk)
+            pipe.hset(items_key, item.pk, line)
+            pipe.hset(qty_key, item.pk, item.quantity)
+            pipe.hset(alias_key, old_id, item.pk)
+        pipe.expire(alias_key, self.ttl)
+
+    def flush_dirty(self):
+        flushed = 0
+        for cart_id in self.redis.smembers(self._dirty_key):
+            self.flush(self._decode(cart_id))
+            flushed += 1
+        return flushed
+
+    def discard(self, cart_id):
+        cart_id = str(cart_id)
+        meta = self.redis.hgetall(self._keys(cart_id)[0])
+        user_id = meta.get(b'user_id') or meta.get('user_id')
+        with self.redis.pipeline() as pipe:
+            pipe.delete(*self._keys(cart_id), self._alias_key(cart_id))
+            pipe.srem(self._dirty_key, cart_id)
+            if user_id:
+                pipe.delete(self._user_key(self._decode(user_id)))
+            pipe.execute()
+
+
+@lru_cache(maxsize=None)
+def get_cart_store():
+    return import_string(getattr(settings, 'CART_STORE', 'store.cart_storage.DatabaseCartStore'))()
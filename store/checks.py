@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Cache backends whose contents are private to one process.
+LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _shared_cache():
+    return settings.DEBUG or settings.CACHES['default']['BACKEND'] not in LOCAL_CACHES
+
+
+@register(Tags.caches)
+def check_circuit_breaker_cache(app_configs, **kwargs):
+    """
+    The Paystack circuit breaker keeps its state in the default cache. With a
+    process-local cache every worker counts failures and opens its own circuit,
+    so warn unless the cache is shared (or DEBUG is on).
+    """
+    if _shared_cache():
+        return []
+    return [Warning(
+        'The default cache is local to each process, so the Paystack circuit breaker '
+        'only opens in the worker that saw the failures.',
+        hint='Set REDIS_URL so every worker shares the circuit state.',
+        id='store.W001',
+    )]
+
+
+@register(Tags.caches)
+def check_idempotency_cache(app_configs, **kwargs):
+    """
+    Idempotency keys and their stored responses live in the default cache. With
+    a process-local cache a retry that reaches another worker runs again.
+    """
+    if _shared_cache():
+        return []
+    return [Warning(
+        'The default cache is local to each process, so an Idempotency-Key retry '
+        'that reaches another worker places the order or starts the payment again.',
+        hint='Set REDIS_URL so every worker sees the same idempotency keys.',
+        id='store.W002',
+    )]
@@ -0,0 +1,131 @@
+"""
+Circuit breaker for calls to an external service, with its state in the
+default cache. Workers only share the circuit when that cache is shared
+(Redis, with REDIS_URL set); with the LocMem fallback each process keeps its
+own circuit and opens it only after failures it saw itself. ``manage.py
+check`` warns about this outside DEBUG (see ``store/checks.py``).
+
+* closed: calls go through. Failures and slow calls in a row are counted; a
+  success resets the count.
+* open: after ``failure_threshold`` failures or slow calls in a row, calls
+  fail immediately with ``CircuitOpenError`` for ``reset_timeout`` seconds.
+* half-open: once the timeout has passed, a single call is let through as a
+  probe. Its success closes the circuit, its failure opens it again.
+
+Each state change is logged and counted in the cache (see ``stats``).
+"""
+import logging
+import math
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f'{name} circuit is open; retry in {retry_after}s.')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, slow_call=5.0, reset_timeout=30, probe_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        # A probe that never reports back (its worker died) stops blocking
+        # other probes after this many seconds.
+        self.probe_timeout = probe_timeout
+        prefix = f'circuit:{name}'
+        self.opened_key = f'{prefix}:opened_at'
+        self.failures_key = f'{prefix}:failures'
+        self.probe_key = f'{prefix}:probe'
+        self.transitions_key = f'{prefix}:transitions'
+
+    def before_call(self):
+        """
+        Check the circuit before calling the service. Returns a token to hand to
+        ``after_call``; raises ``CircuitOpenError`` if the call must not be made.
+        """
+        state = cache.get_many([self.opened_key, self.failures_key])
+        opened_at = state.get(self.opened_key)
+        if opened_at is None:
+            return {'probe': False, 'failures': state.get(self.failures_key, 0)}
+
+        remaining = opened_at + self.reset_timeout - time.time()
+        if remaining > 0:
+            raise CircuitOpenError(self.name, math.ceil(remaining))
+        # Half-open: the first caller to take the probe lock tries the service.
+        if not cache.add(self.probe_key, time.time(), self.probe_timeout):
+            raise CircuitOpenError(self.name, 1)
+        self._changed(OPEN, HALF_OPEN)
+        return {'probe': True, 'failures': state.get(self.failures_key, 0)}
+
+    def after_call(self, token, ok, elapsed):
+        """Record the outcome of a call allowed by ``before_call``."""
+        if ok and elapsed >= self.slow_call:
+            logger.warning("%s call took %.1fs (slow call threshold %.1fs)", self.name, elapsed, self.slow_call)
+            ok = False
+
+        if token['probe']:
+            if ok:
+                cache.delete_many([self.opened_key, self.failures_key, self.probe_key])
+                self._changed(HALF_OPEN, CLOSED)
+            else:
+                cache.set(self.opened_key, time.time(), None)
+                cache.delete(self.probe_key)
+                self._changed(HALF_OPEN, OPEN, 'probe failed')
+            return
+
+        if ok:
+            if token['failures']:
+                cache.delete(self.failures_key)
+            return
+
+        cache.add(self.failures_key, 0, None)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            # Deleted by a concurrent success.
+            return
+        # add() lets only one worker open the circuit and report it.
+        if failures >= self.failure_threshold and cache.add(self.opened_key, time.time(), None):
+            self._changed(CLOSED, OPEN, f'after {failures} failed or slow calls')
+
+    def state(self):
+        opened_at = cache.get(self.opened_key)
+        if opened_at is None:
+            return CLOSED
+        return OPEN if opened_at + self.reset_timeout > time.time() else HALF_OPEN
+
+    def stats(self):
+        """Current state, failure streak and how many times each state was entered."""
+        return {
+            'state': self.state(),
+            'failures': cache.get(self.failures_key, 0),
+            'transitions': {
+                state: cache.get(f'{self.transitions_key}:{state}', 0) for state in (OPEN, HALF_OPEN, CLOSED)
+            },
+        }
+
+    def reset(self):
+        """Close the circuit and clear the failure streak."""
+        cache.delete_many([self.opened_key, self.failures_key, self.probe_key])
+
+    def _changed(self, previous, state, reason=''):
+        key = f'{self.transitions_key}:{state}'
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+        log = logger.info if state == CLOSED else logger.warning
+        log("%s circuit %s -> %s%s", self.name, previous, state, f' ({reason})' if reason else '')
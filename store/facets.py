@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db.models import Case, CharField, Count, Value, When
+
+
+def _price_buckets():
+    """Return [(label, low, high)] built from the ascending CATALOG_PRICE_BUCKETS boundaries."""
+    bounds = list(getattr(settings, 'CATALOG_PRICE_BUCKETS', [50, 100, 200, 500]))
+    lows = [0] + bounds
+    highs = bounds + [None]
+    return [
+        (f'{low}-{high}' if high is not None else f'{low}+', low, high)
+        for low, high in zip(lows, highs)
+    ]
+
+
+def product_facets(queryset):
+    """
+    Count products per collection, price bucket, ``is_customizable`` and
+    ``has_size_options`` with a single grouped query over ``queryset``.
+
+    The database groups by the combination of all four dimensions; the
+    per-facet totals are then folded together in Python, which is cheap because
+    the number of combinations is tiny compared to the number of products.
+    """
+    buckets = _price_buckets()
+    price_bucket = Case(
+        *[When(price__lt=high, then=Value(label)) for label, low, high in buckets if high is not None],
+        default=Value(buckets[-1][0]),
+        output_field=CharField(),
+    )
+    rows = (
+        queryset.order_by()
+        .values('collection_id', 'collection__name', 'is_customizable', 'has_size_options',
+                price_bucket=price_bucket)
+        .annotate(count=Count('id'))
+    )
+
+    total = 0
+    collections = {}
+    price_counts = {label: 0 for label, low, high in buckets}
+    customizable = {'true': 0, 'false': 0}
+    size_options = {'true': 0, 'false': 0}
+
+    for row in rows:
+        count = row['count']
+        total += count
+        collection = collections.setdefault(
+            row['collection_id'],
+            {'id': row['collection_id'], 'name': row['collection__name'], 'count': 0}
+        )
+        collection['count'] += count
+        price_counts[row['price_bucket']] += count
+        customizable['true' if row['is_customizable'] else 'false'] += count
+        size_options['true' if row['has_size_options'] else 'false'] += count
+
+    return {
+        'count': total,
+        'collections': sorted(collections.values(), key=lambda c: c['name']),
+        'price_buckets': [
+            {'label': label, 'min': low, 'max': high, 'count': price_counts[label]}
+            for label, low, high in buckets
+        ],
+        'is_customizable': customizable,
+        'has_size_options': size_options,
+    }
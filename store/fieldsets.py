@@ -0,0 +1,96 @@
+from rest_framework import serializers
+
+
+def _parse_names(value):
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def get_sparse_params(request):
+    """
+    Return ``(fields, expand)`` from ``?fields=`` and ``?expand=``.
+
+    Either one is ``None`` when the parameter is absent; both ``None`` means
+    the client wants the full, default representation.
+    """
+    if request is None:
+        return None, None
+    return _parse_names(request.query_params.get('fields')), _parse_names(request.query_params.get('expand'))
+
+
+def is_sparse(request):
+    fields, expand = get_sparse_params(request)
+    return fields is not None or expand is not None
+
+
+def wants_field(request, name):
+    """True if the top-level field ``name`` is part of the response."""
+    fields, expand = get_sparse_params(request)
+    return fields is None or name in fields or name in (expand or ())
+
+
+def wants_expanded(request, name):
+    """True if the expandable relation ``name`` is rendered as a nested object."""
+    fields, expand = get_sparse_params(request)
+    if fields is None and expand is None:
+        return True
+    return name in (expand or ())
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets and opt-in expansion for model serializers.
+
+    Without ``?fields=``/``?expand=`` the serializer renders exactly as declared.
+    Otherwise:
+
+    * ``?fields=a,b`` keeps only those fields on the top-level serializer. It
+      may also name ``Meta.optional_fields``, which are never rendered by default.
+    * relations in ``Meta.expandable_fields`` are nested objects only when
+      named in ``?expand=`` (at any depth). Unexpanded to-one relations render
+      as their primary key, and unexpanded to-many relations are left out.
+    """
+
+    def _is_root(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        requested, expand = get_sparse_params(request)
+        if requested is None and expand is None:
+            return fields
+
+        expand = expand or set()
+        for name, factory in getattr(self.Meta, 'optional_fields', {}).items():
+            if requested and name in requested:
+                fields[name] = factory()
+
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name not in fields or name in expand:
+                continue
+            field = fields[name]
+            if isinstance(field, serializers.ListSerializer):
+                del fields[name]
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        if requested is not None and self._is_root():
+            fields = {name: field for name, field in fields.items() if name in requested or name in expand}
+        return fields
+
+
+def sparse_only(queryset, request, always=()):
+    """
+    Restrict the loaded columns to the concrete model fields named in
+    ``?fields=`` (plus the primary key and ``always``). Without ``?fields=``
+    the queryset is returned unchanged.
+    """
+    fields, expand = get_sparse_params(request)
+    if fields is None:
+        return queryset
+    model = queryset.model
+    columns = {field.name for field in model._meta.concrete_fields} & fields
+    return queryset.only(model._meta.pk.name, *always, *sorted(columns))
@@ -0,0 +1,131 @@
+"""
+``Idempotency-Key`` support for unsafe endpoints.
+
+The first request with a given key runs normally and its response is stored in
+the cache for ``IDEMPOTENCY_KEY_TTL`` seconds. Retries with the same key (same
+user, same endpoint, same body) get the stored response back without running the
+view again. Keys are optional: requests without the header are not affected.
+The cache has to be shared by every worker for this to hold (see store.W002).
+"""
+import inspect
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+# How long a request may hold a key before another attempt can take over.
+LOCK_TIMEOUT = 60
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def _cache_key(request, key):
+    scope = f'{request.user.pk}:{request.method}:{request.path}:{key}'
+    return 'store:idempotency:' + hashlib.sha256(scope.encode('utf-8')).hexdigest()
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _error(message, status_code):
+    return Response({'error': message}, status=status_code)
+
+
+def _check_key(request):
+    """Return ``(key, error response)`` for the request's Idempotency-Key header."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key and len(key) > MAX_KEY_LENGTH:
+        return None, _error(f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.',
+                            status.HTTP_400_BAD_REQUEST)
+    return key, None
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return _error('This Idempotency-Key was already used with a different request.',
+                      status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(stored['data'], status=stored['status'], headers={REPLAYED_HEADER: 'true'})
+
+
+def _in_progress():
+    return _error('A request with this Idempotency-Key is still being processed.', status.HTTP_409_CONFLICT)
+
+
+def _record(response, fingerprint):
+    return {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data}
+
+
+def idempotent(view_method):
+    """
+    Decorate a view handler (``post``, ``create``...) to honour ``Idempotency-Key``.
+    Works for both sync and ``async def`` handlers.
+
+    Only responses below 500 are stored, including errors the handler raises
+    (validation, not found...); a server error releases the key so the client
+    can retry it.
+    """
+    if inspect.iscoroutinefunction(view_method):
+        @wraps(view_method)
+        async def async_wrapper(self, request, *args, **kwargs):
+            key, error = _check_key(request)
+            if error or not key:
+                return error or await view_method(self, request, *args, **kwargs)
+
+            cache_key = _cache_key(request, key)
+            fingerprint = _fingerprint(request)
+            stored = await cache.aget(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            if not await cache.aadd(f'{cache_key}:lock', fingerprint, LOCK_TIMEOUT):
+                return _in_progress()
+            try:
+                try:
+                    response = await view_method(self, request, *args, **kwargs)
+                except Exception as exc:
+                    # Re-raises anything that is not an API error.
+                    response = self.handle_exception(exc)
+                if response.status_code < 500:
+                    await cache.aset(cache_key, _record(response, fingerprint), _ttl())
+            finally:
+                await cache.adelete(f'{cache_key}:lock')
+            return response
+
+        return async_wrapper
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key, error = _check_key(request)
+        if error or not key:
+            return error or view_method(self, request, *args, **kwargs)
+
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+        if not cache.add(f'{cache_key}:lock', fingerprint, LOCK_TIMEOUT):
+            return _in_progress()
+        try:
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+            if response.status_code < 500:
+                cache.set(cache_key, _record(response, fingerprint), _ttl())
+        finally:
+            cache.delete(f'{cache_key}:lock')
+        return response
+
+    return wrapper
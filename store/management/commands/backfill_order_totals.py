@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Order
+from store.pricing import backfill_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Compute and store subtotal, customization total and total for orders that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Recompute every order, not only those with a zero total.')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if not options['all']:
+            orders = orders.filter(total=0)
+
+        updated = backfill_order_totals(orders, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Backfilled totals for {updated} orders.'))
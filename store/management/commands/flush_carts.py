@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.cart_storage import get_cart_store
+
+
+class Command(BaseCommand):
+    help = 'Write carts changed in the cart store back to the database.'
+
+    def handle(self, *args, **options):
+        flushed = get_cart_store().flush_dirty()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} cart(s).'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from store.paystack import get_circuit_breaker
+
+
+class Command(BaseCommand):
+    help = 'Show the state of the Paystack circuit breaker, or close it with --reset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Close the circuit and clear the failure count.')
+
+    def handle(self, *args, **options):
+        breaker = get_circuit_breaker()
+        if options['reset']:
+            breaker.reset()
+            self.stdout.write(self.style.SUCCESS('Paystack circuit closed.'))
+
+        stats = breaker.stats()
+        transitions = ', '.join(f'{state}: {count}' for state, count in stats['transitions'].items())
+        self.stdout.write(
+            f"State: {stats['state']}\n"
+            f"Consecutive failures: {stats['failures']}\n"
+            f"Times entered ({transitions})"
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import PaystackEvent
+from store.payments import process_paystack_events, replay_paystack_events
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Paystack webhook events from the inbox, or queue failed ones again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the inbox instead of exiting.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop.')
+        parser.add_argument('--replay', nargs='*', type=int, metavar='EVENT_ID',
+                            help='Queue the given events (or every failed event when no id is given) and process them.')
+
+    def handle(self, *args, **options):
+        if options['replay'] is not None:
+            events = PaystackEvent.objects.all()
+            if options['replay']:
+                events = events.filter(pk__in=options['replay'])
+            else:
+                events = events.filter(status=PaystackEvent.STATUS_FAILED)
+            queued = replay_paystack_events(events)
+            if options['replay'] and not queued:
+                raise CommandError('None of the given events exist or they are already pending.')
+            self.stdout.write(f'Queued {queued} event(s) for replay.')
+
+        while True:
+            processed, failed = process_paystack_events(options['batch_size'])
+            if processed or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Processed {processed} event(s), {failed} failed permanently.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
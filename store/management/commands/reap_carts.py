@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from store.cart_storage import get_cart_store
+from store.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Delete carts that have not been modified for a while, in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CART_IDLE_DAYS,
+                            help='Delete carts idle for more than this many days.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        store = get_cart_store()
+        # Carts changed only in the cart store get their real last-modified time first.
+        store.flush_dirty()
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        carts_deleted = items_deleted = 0
+        while True:
+            # One short transaction per batch; carts locked by a concurrent
+            # request are skipped and picked up on the next run.
+            with transaction.atomic():
+                cart_ids = list(Cart.objects.idle_since(cutoff).select_for_update(skip_locked=True)
+                                .order_by('updated_at').values_list('pk', flat=True)[:batch_size])
+                if not cart_ids:
+                    break
+                items_deleted += CartItem.objects.filter(cart_id__in=cart_ids).delete()[0]
+                carts_deleted += Cart.objects.filter(pk__in=cart_ids).delete()[1].get(Cart._meta.label, 0)
+
+            for cart_id in cart_ids:
+                store.discard(cart_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Reclaimed {carts_deleted} carts and {items_deleted} cart items idle since {cutoff:%Y-%m-%d %H:%M}.'))
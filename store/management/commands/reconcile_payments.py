@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store import reconciliation
+
+
+class Command(BaseCommand):
+    help = 'Verify pending orders with Paystack and mark them paid or failed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=30,
+                            help='Only orders whose payment was initialized at least this many minutes ago.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent Paystack requests.')
+        parser.add_argument('--rate', type=float, default=10, help='Maximum Paystack requests per second.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after checking this many orders.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without saving.')
+
+    def handle(self, *args, **options):
+        summary = reconciliation.reconcile_pending_orders(
+            min_age=timedelta(minutes=options['min_age']),
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            rate=options['rate'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+        )
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Checked {summary['checked']} pending orders: "
+            f"{summary[reconciliation.COMPLETED]} paid, {summary[reconciliation.FAILED]} failed, "
+            f"{summary[reconciliation.STILL_PENDING]} still pending, "
+            f"{summary[reconciliation.MISMATCHED]} mismatched, {summary[reconciliation.ERRORS]} errors."
+        ))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:55
+
+import store.models
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        # The same text search configuration the queries use (store.search).
+        config = getattr(settings, 'SEARCH_CONFIG', 'english')
+        schema_editor.execute(
+            "UPDATE store_product SET search_vector = "
+            "setweight(to_tsvector(%s::regconfig, coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector(%s::regconfig, coalesce(description, '')), 'B')",
+            params=[config, config],
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS store_product_search_vector_gin '
+            'ON store_product USING GIN (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS store_product_fts "
+            "USING fts5(name, description, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            'INSERT INTO store_product_fts (rowid, name, description) '
+            'SELECT id, name, description FROM store_product'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_vector_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS store_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=store.models.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
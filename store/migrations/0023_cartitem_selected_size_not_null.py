@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:59
+
+from django.db import migrations, models
+
+
+def merge_sizeless_cart_items(apps, schema_editor):
+    """Fold NULL and '' selected_size lines for the same cart/product/customization into one '' line."""
+    CartItem = apps.get_model('store', 'CartItem')
+    kept = {}
+    for item in CartItem.objects.filter(
+            models.Q(selected_size__isnull=True) | models.Q(selected_size='')).order_by('pk'):
+        key = (item.cart_id, item.product_id, item.with_customization)
+        if key in kept:
+            kept[key].quantity += item.quantity
+            item.delete()
+        else:
+            kept[key] = item
+    for item in kept.values():
+        item.selected_size = ''
+        item.save(update_fields=['quantity', 'selected_size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_collection_product_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_sizeless_cart_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='selected_size',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+    ]
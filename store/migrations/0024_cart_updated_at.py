@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_updated_at(apps, schema_editor):
+    # Nothing records when existing carts were last used, and their creation
+    # time would make active carts look idle to the first reap_carts run.
+    # Start every existing cart's idle clock now instead.
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(updated_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_cartitem_selected_size_not_null'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(seed_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['updated_at'], name='store_cart_updated_08faa2_idx'),
+        ),
+    ]
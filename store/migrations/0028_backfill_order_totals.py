@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:12
+
+from decimal import Decimal
+
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def backfill_totals(apps, schema_editor):
+    # Orders placed before 0019 have a zero total, which payment initialization
+    # rejects. Their items captured the prices at purchase; add those up.
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    db = schema_editor.connection.alias
+    orders = Order.objects.using(db).filter(total=0).order_by('pk').only('pk')
+
+    last_pk = 0
+    while True:
+        batch = list(orders.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+
+        totals = {order.pk: [Decimal('0.00'), Decimal('0.00')] for order in batch}
+        items = OrderItem.objects.using(db).filter(order_id__in=totals).values_list(
+            'order_id', 'price_at_purchase', 'quantity', 'with_customization', 'customization_price_at_purchase')
+        for order_id, price, quantity, with_customization, customization_price in items:
+            totals[order_id][0] += price * quantity
+            if with_customization:
+                totals[order_id][1] += customization_price * quantity
+
+        for order in batch:
+            order.subtotal, order.customization_total = totals[order.pk]
+            order.total = order.subtotal + order.customization_total
+        Order.objects.using(db).bulk_update(batch, ['subtotal', 'customization_total', 'total'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_order_paystack_ref_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, connections, transaction
+from django.contrib.postgres.search import SearchVectorField as PostgresSearchVectorField
+from django.db.models import OuterRef, Subquery, Min, Max, F, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from uuid import uuid4
 from django.contrib import admin
 from .validators import validate_file_size
@@ -7,6 +11,32 @@ from cloudinary.models import CloudinaryField
 
 from django.conf import settings
 
+
+def set_prefetched(instance, related_name, objects):
+    """
+    Make ``instance.<related_name>.all()`` return ``objects`` without a query,
+    exactly as if they had been loaded with prefetch_related().
+    """
+    queryset = getattr(instance, related_name).model.objects.none()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[related_name] = queryset
+
+
+class SearchVectorField(PostgresSearchVectorField):
+    """
+    A ``tsvector`` column on PostgreSQL. Other databases have no such type, so
+    there it is a plain text column that stays empty (see store.search).
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return super().db_type(connection)
+        return models.TextField().db_type(connection)
+
+
 # Create your models here.
 class Branch(models.Model):
     name = models.CharField(max_length=100)
@@ -21,9 +51,44 @@ class BranchAccount(models.Model):
         return f"{self.user.username} - {self.branch.name}"
 class Collection(models.Model):
     name = models.CharField(max_length=100)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
     def __str__(self):
         return self.name
 
+    @classmethod
+    def refresh_product_counts(cls, collection_ids=None):
+        """
+        Recompute product_count for the given collections (every collection when
+        None) in a single UPDATE that only touches counts that are wrong.
+        Returns how many collections changed.
+        """
+        counts = Product.objects.filter(collection=OuterRef('pk')).order_by().values('collection').annotate(
+            count=Count('pk')).values('count')
+        actual = Coalesce(Subquery(counts), 0)
+        collections = cls.objects.all() if collection_ids is None else cls.objects.filter(pk__in=collection_ids)
+        return collections.exclude(product_count=actual).update(product_count=actual)
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_first_image(self):
+        first_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by('pk').values('image')[:1]
+        return self.annotate(first_image=Subquery(first_image, output_field=CloudinaryField('image')))
+
+    def with_card_data(self):
+        """
+        Annotate everything a product card needs (first image, size price range and
+        collection name) so it is fetched in the same query as the products.
+        """
+        sizes = ProductSize.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.with_first_image().annotate(
+            min_size_price=Subquery(sizes.annotate(value=Min('price')).values('value')),
+            max_size_price=Subquery(sizes.annotate(value=Max('price')).values('value')),
+            collection_name=F('collection__name'),
+        )
+
+    def cards(self):
+        return self.with_card_data().prefetch_related('sizes').defer('search_vector')
+
 
 class Product(models.Model):
     name = models.CharField(max_length=100)
@@ -34,6 +99,9 @@ class Product(models.Model):
     is_customizable = models.BooleanField(default=False)
     customization_price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     has_size_options = models.BooleanField(default=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         indexes = [
@@ -42,6 +110,7 @@ class Product(models.Model):
             models.Index(fields=['price']),
             models.Index(fields=['is_customizable']),
             models.Index(fields=['customization_price']),
+            models.Index(fields=['is_available', 'price', 'id']),
         ]
 
     def __str__(self):
@@ -115,9 +184,19 @@ class Order(models.Model):
     branch = models.ForeignKey(Branch, on_delete=models.PROTECT)
     paystack_ref = models.CharField(max_length=100, blank=True, null=True)
     paystack_access_code = models.CharField(max_length=100, blank=True, null=True)
+    # What paystack_ref/paystack_access_code were initialized for, so a repeated
+    # initialize-payment can hand back the same checkout instead of a new one.
+    paystack_authorization_url = models.URLField(max_length=255, blank=True, null=True)
+    paystack_amount = models.DecimalField(decimal_places=2, max_digits=10, blank=True, null=True)
+    paystack_email = models.EmailField(blank=True, null=True)
+    paystack_callback_url = models.URLField(max_length=500, blank=True, null=True)
+    paystack_initialized_at = models.DateTimeField(blank=True, null=True)
     secret_message = models.TextField(blank=True, null=True, help_text="Private message from customer")
     delivery_date = models.DateField(blank=True, null=True, help_text="Preferred delivery date")
     delivery_time = models.TimeField(blank=True, null=True, help_text="Preferred delivery time")
+    subtotal = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+    customization_total = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+    total = models.DecimalField(decimal_places=2, max_digits=10, default=0)
 
     class Meta:
         permissions = [
@@ -125,13 +204,33 @@ class Order(models.Model):
         ]
         indexes = [
             models.Index(fields=['customer', 'created_at']),
+            models.Index(fields=['created_at', 'id']),
             models.Index(fields=['status']),
             models.Index(fields=['payment_status']),
+            models.Index(fields=['paystack_ref']),
         ]
 
     def __str__(self):
         return f'Order {self.pk} - {self.recipient_name}'
 
+    def has_reusable_paystack_checkout(self, amount, email, callback_url=None):
+        """
+        True if the stored Paystack checkout was initialized for this amount,
+        email and callback URL, is still pending and is not older than
+        PAYSTACK_ACCESS_CODE_TTL seconds.
+        """
+        if not (self.paystack_access_code and self.paystack_authorization_url and self.paystack_initialized_at):
+            return False
+        if self.payment_status != self.PAYMENT_PENDING:
+            return False
+        age = timezone.now() - self.paystack_initialized_at
+        return (
+            age.total_seconds() < settings.PAYSTACK_ACCESS_CODE_TTL
+            and self.paystack_amount == amount
+            and self.paystack_email == email
+            and (self.paystack_callback_url or None) == (callback_url or None)
+        )
+
     def save(self, *args, **kwargs):
         # Check if this is an update (not a new order)
         if self.pk:
@@ -144,11 +243,11 @@ class Order(models.Model):
                 # Import here to avoid circular import
                 from core.tasks import send_email_task
 
-                # Save first, then send email
-                super().save(*args, **kwargs)
-
-
-                send_email_task(self.id)
+                # Save and queue the email together: the outbox row exists
+                # only if the new status was committed.
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                    send_email_task(self.id, self.status)
                 return
 
         # If it's a new order or status didn't change, just save normally
@@ -164,10 +263,88 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f'Order {self.pk} - {self.product.name}'
+class CartQuerySet(models.QuerySet):
+    def touch(self):
+        """Mark carts as active now. Item writes bypass Cart.save(), so they call this."""
+        return self.update(updated_at=timezone.now())
+
+    def idle_since(self, cutoff):
+        return self.filter(updated_at__lt=cutoff)
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)  # ADD THIS
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+
+class CartItemQuerySet(models.QuerySet):
+    def add_or_increment(self, cart_id, user_id, product_id, quantity, with_customization=False, selected_size=''):
+        """
+        Add ``quantity`` of a product to a cart owned by ``user_id`` in one atomic
+        statement, incrementing the existing line if there is one.
+
+        Returns the resulting CartItem (unsaved copy carrying the new quantity), or
+        None when the cart does not belong to the user or the product does not exist.
+        """
+        selected_size = selected_size or ''
+        if _supports_upsert_returning(connections[self.db]):
+            row = self._upsert(cart_id, user_id, product_id, quantity, with_customization, selected_size)
+            if row is None:
+                return None
+            item_id, quantity = row
+            return CartItem(id=item_id, cart_id=cart_id, product_id=product_id, quantity=quantity,
+                            with_customization=with_customization, selected_size=selected_size)
+
+        # Databases without INSERT ... ON CONFLICT ... RETURNING: lock the cart row
+        # so concurrent adds to the same cart run one after another.
+        with transaction.atomic(using=self.db):
+            if not Cart.objects.using(self.db).select_for_update().filter(pk=cart_id, user_id=user_id).exists():
+                return None
+            if not Product.objects.using(self.db).filter(pk=product_id).exists():
+                return None
+            item, created = self.get_or_create(
+                cart_id=cart_id, product_id=product_id, with_customization=with_customization,
+                selected_size=selected_size, defaults={'quantity': quantity})
+            if not created:
+                self.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+                item.quantity += quantity
+            return item
+
+    def _upsert(self, cart_id, user_id, product_id, quantity, with_customization, selected_size):
+        conn = connections[self.db]
+        qn = conn.ops.quote_name
+        item_table = qn(CartItem._meta.db_table)
+        sql = (
+            f'INSERT INTO {item_table} (cart_id, product_id, quantity, with_customization, selected_size) '
+            f'SELECT c.id, p.id, %s, %s, %s FROM {qn(Cart._meta.db_table)} c, {qn(Product._meta.db_table)} p '
+            f'WHERE c.id = %s AND c.user_id = %s AND p.id = %s '
+            f'ON CONFLICT (cart_id, product_id, with_customization, selected_size) '
+            f'DO UPDATE SET quantity = {item_table}.quantity + excluded.quantity '
+            f'RETURNING id, quantity'
+        )
+        params = [quantity, with_customization, selected_size,
+                  Cart._meta.pk.get_db_prep_value(cart_id, conn), user_id, product_id]
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+
+def _supports_upsert_returning(connection):
+    """Whether ``connection`` runs INSERT ... ON CONFLICT DO UPDATE ... RETURNING."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
 
 
 class CartItem(models.Model):
@@ -175,20 +352,61 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     with_customization = models.BooleanField(default=False)
-    selected_size = models.CharField(max_length=50, blank=True, null=True)
+    # '' rather than NULL when no size is chosen: NULLs never collide in the
+    # unique constraint, which would break the add-to-cart upsert.
+    selected_size = models.CharField(max_length=50, blank=True, default='')
+
+    objects = CartItemQuerySet.as_manager()
 
     class Meta:
         unique_together = [['cart', 'product', 'with_customization', 'selected_size']]
 
     @property
     def total_price(self):
-        base_price = self.product.price * self.quantity
-        if self.with_customization and self.product.is_customizable:
-            base_price += (self.product.customization_price * self.quantity)
-        return base_price
+        # store.pricing imports ProductSize from this module.
+        from .pricing import price_lines
+        return price_lines([self]).total
 
 
 
 
 
 
+
+
+class PaystackEvent(models.Model):
+    """
+    Inbox of Paystack webhook deliveries. The webhook only stores the raw event
+    and acknowledges it; ``store.payments.process_paystack_events`` applies
+    them to orders in arrival order, retrying failures with backoff.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSED = 'processed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSED, 'Processed'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    # "<event>:<transaction id or reference>"; Paystack redelivers the same
+    # event until it is acknowledged, so this is what deduplicates.
+    key = models.CharField(max_length=255, unique=True)
+    event = models.CharField(max_length=100)
+    reference = models.CharField(max_length=100, blank=True, default='')
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id']),
+            models.Index(fields=['reference']),
+        ]
+
+    def __str__(self):
+        return f'{self.event} {self.reference} ({self.status})'
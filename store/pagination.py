@@ -1,4 +1,161 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.settings import api_settings
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on every ordering field.
+
+    DRF's CursorPagination only filters on the first ordering field and skips
+    the rows sharing its value with an OFFSET, which gets slower (and is capped
+    at ``offset_cutoff``) on columns with many ties such as price. Here the
+    cursor position holds the value of each ordering field and a page starts
+    with ``(a > x) OR (a = x AND b > y) ...``, so no rows are ever skipped by
+    offset. ``unique_field`` is appended to orderings that do not end with it.
+    """
+    unique_field = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip('-') == self.unique_field for field in ordering):
+            ordering += (self.unique_field,)
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            attr = field.lstrip('-')
+            values.append(str(instance[attr] if isinstance(instance, dict) else getattr(instance, attr)))
+        return json.dumps(values)
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _after_position(self, values, reverse):
+        """The rows after ``values`` in the requested direction."""
+        def after(field, value):
+            # Test for: (cursor reversed) XOR (field reversed)
+            lookup = 'lt' if reverse != field.startswith('-') else 'gt'
+            return Q(**{f'{field.lstrip("-")}__{lookup}': value})
+
+        # Built from the last field outwards:
+        # a > x OR (a = x AND (b > y OR (b = y AND ...)))
+        fields = list(zip(self.ordering, values))
+        last_field, last_value = fields.pop()
+        return reduce(
+            lambda condition, item: after(*item) | (Q(**{item[0].lstrip('-'): item[1]}) & condition),
+            reversed(fields), after(last_field, last_value))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Same flow as CursorPagination.paginate_queryset, filtering on the
+        # whole position instead of the first ordering field.
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*(
+                field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self._after_position(self._decode_position(current_position), reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    page_size = 10
+    ordering = ('price', 'id')
+    # Ranked search results (see store.search) page by relevance.
+    search_ordering = ('-rank', 'id')
+
+    def get_ordering(self, request, queryset, view):
+        if 'rank' in queryset.query.annotations and not request.query_params.get(api_settings.ORDERING_PARAM):
+            return self.search_ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    page_size = 10
+    ordering = ('-created_at', '-id')
+
+
+class PaginationModeMixin:
+    """
+    Lets clients pick the pagination style with ``?pagination=cursor|page``.
+
+    Cursor (keyset) pagination skips the COUNT(*) and the OFFSET scan, so it is the
+    better choice for infinite scrolling; page numbers stay available for clients
+    that need a total count. A request carrying a ``cursor`` parameter is always
+    served in cursor mode.
+    """
+    pagination_modes = {}
+    default_pagination_mode = 'page'
+
+    def get_pagination_mode(self):
+        if 'cursor' in self.request.query_params:
+            return 'cursor'
+        mode = self.request.query_params.get('pagination', self.default_pagination_mode)
+        return mode if mode in self.pagination_modes else self.default_pagination_mode
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_modes.get(self.get_pagination_mode())
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
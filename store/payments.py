@@ -0,0 +1,492 @@
+"""
+Payment flows shared by the sync and async payment views.
+
+The views only fetch the order and talk to Paystack (blocking or not); every
+decision and database write lives here and returns a ``PaymentResponse`` that
+the view turns into an HTTP response. Functions that write run in a
+transaction, so async views call them through ``sync_to_async``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework import status
+
+from core.jobs import job
+from .models import Order, PaystackEvent
+from .paystack import PaystackAPI, AsyncPaystackAPI
+
+logger = logging.getLogger(__name__)
+
+PaymentResponse = namedtuple('PaymentResponse', ['data', 'status'])
+
+
+def _error(message, status_code, **extra):
+    return PaymentResponse({"error": message, **extra}, status_code)
+
+
+def _send_confirmation(order):
+    from core.outbox import payment_confirmation_email, queue_emails
+    queue_emails([payment_confirmation_email(order.id, order.paystack_ref)])
+
+
+def unavailable_error(result):
+    """A 503 when Paystack was not called because its circuit is open, else None."""
+    if result.get('retry_after') is None:
+        return None
+    return _error(result['message'], status.HTTP_503_SERVICE_UNAVAILABLE, retry_after=result['retry_after'])
+
+
+def order_access_error(order, user):
+    """Orders are loaded with ``select_related('customer')``; only their owner may pay for them."""
+    if order is None:
+        return _error("Order not found.", status.HTTP_404_NOT_FOUND)
+    if order.customer.user_id != user.id:
+        return _error("You don't have permission to access this order.", status.HTTP_403_FORBIDDEN)
+    return None
+
+
+# Initialization
+
+def _checkout_response(order):
+    return PaymentResponse({
+        "message": "Payment initialized successfully",
+        "authorization_url": order.paystack_authorization_url,
+        "access_code": order.paystack_access_code,
+        "reference": order.paystack_ref,
+        "amount": float(order.total),
+        "currency": "GHS"
+    }, status.HTTP_200_OK)
+
+
+def initialization_error(order, user):
+    """Return why ``user`` cannot start paying for ``order``, or None."""
+    error = order_access_error(order, user)
+    if error:
+        return error
+    if order.payment_status == Order.PAYMENT_COMPLETED:
+        return _error("This order has already been paid.", status.HTTP_400_BAD_REQUEST)
+    if order.total <= 0:
+        return _error("Order total must be greater than zero.", status.HTTP_400_BAD_REQUEST)
+    if not user.email:
+        return _error("Customer email is required for payment.", status.HTTP_400_BAD_REQUEST)
+    return None
+
+
+def reusable_checkout(order, email, callback_url):
+    """The stored checkout when nothing material changed since it was initialized, else None."""
+    if order.has_reusable_paystack_checkout(order.total, email, callback_url):
+        return _checkout_response(order)
+    return None
+
+
+def record_checkout(order, email, callback_url, result):
+    """
+    Copy a Paystack initialize result onto the order (without saving it) and
+    return the response for the client.
+    """
+    error = unavailable_error(result)
+    if error:
+        return error
+    if not result['status']:
+        return _error(result['message'], status.HTTP_400_BAD_REQUEST)
+
+    payment_data = result['data']
+    order.paystack_ref = payment_data['reference']
+    order.paystack_access_code = payment_data['access_code']
+    order.paystack_authorization_url = payment_data['authorization_url']
+    order.paystack_amount = order.total
+    order.paystack_email = email
+    order.paystack_callback_url = callback_url
+    order.paystack_initialized_at = timezone.now()
+    # A new checkout is a new attempt: a failed earlier one no longer decides the order.
+    if order.payment_status == Order.PAYMENT_FAILED:
+        order.payment_status = Order.PAYMENT_PENDING
+    return _checkout_response(order)
+
+
+# Verification
+
+def settled_verification(order, user):
+    """
+    Answer a verify poll from ``order`` (the order holding the reference, with
+    its customer) once its payment is confirmed, or return None if Paystack
+    must be asked. A failed payment is not final: the customer can start a new
+    checkout for the order.
+    """
+    if order is None or order.payment_status != Order.PAYMENT_COMPLETED:
+        return None
+    error = order_access_error(order, user)
+    if error:
+        return error
+    return PaymentResponse({
+        "message": "Payment already confirmed.",
+        "order_id": order.id,
+        "reference": order.paystack_ref,
+        "amount": float(order.paystack_amount or order.total),
+        "currency": "GHS"
+    }, status.HTTP_200_OK)
+
+
+# Polls for the same reference wait this long between looks at the cache
+# while another request is asking Paystack.
+VERIFY_POLL_INTERVAL = 0.1
+# How long an uncached result stays around for the polls that were waiting on it.
+VERIFY_SHARED_TTL = 2
+
+
+def _verify_cache_key(reference):
+    return 'store:paystack:verify:' + hashlib.sha256(reference.encode('utf-8')).hexdigest()
+
+
+def _verify_lock_timeout():
+    # Long enough for a call and all its retries.
+    return math.ceil((settings.PAYSTACK_CONNECT_TIMEOUT + settings.PAYSTACK_READ_TIMEOUT) * (
+        settings.PAYSTACK_MAX_RETRIES + 1))
+
+
+def _cacheable(result):
+    """
+    Only a transaction Paystack reported on (pending or paid) is cached; errors,
+    unknown references and failed payments are asked about again next time.
+    """
+    data = result.get('data')
+    return isinstance(data, dict) and data.get('status') not in (None, 'failed')
+
+
+def verify_reference(reference):
+    """
+    ``PaystackAPI.verify_payment`` behind a short-lived cache. Results are kept
+    for PAYSTACK_VERIFY_CACHE_TTL seconds, and while one request is asking
+    Paystack about a reference, others polling the same reference wait for
+    its result instead of making their own call.
+    """
+    key = _verify_cache_key(reference)
+    lock_key = f'{key}:lock'
+    # Hands an uncached result to the polls that waited for it.
+    shared_key = f'{key}:shared'
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    if cache.add(lock_key, 1, _verify_lock_timeout()):
+        cache.delete(shared_key)
+        try:
+            result = PaystackAPI.verify_payment(reference)
+            if _cacheable(result):
+                cache.set(key, result, settings.PAYSTACK_VERIFY_CACHE_TTL)
+            else:
+                cache.set(shared_key, result, VERIFY_SHARED_TTL)
+        finally:
+            cache.delete(lock_key)
+        return result
+
+    while True:
+        time.sleep(VERIFY_POLL_INTERVAL)
+        found = cache.get_many([key, shared_key, lock_key])
+        if key in found or shared_key in found:
+            return found.get(key, found.get(shared_key))
+        if lock_key not in found:
+            # The other request gave up without a result; ask ourselves.
+            return PaystackAPI.verify_payment(reference)
+
+
+async def averify_reference(reference):
+    """Async counterpart of ``verify_reference``."""
+    key = _verify_cache_key(reference)
+    lock_key = f'{key}:lock'
+    shared_key = f'{key}:shared'
+    result = await cache.aget(key)
+    if result is not None:
+        return result
+
+    if await cache.aadd(lock_key, 1, _verify_lock_timeout()):
+        await cache.adelete(shared_key)
+        try:
+            result = await AsyncPaystackAPI.verify_payment(reference)
+            if _cacheable(result):
+                await cache.aset(key, result, settings.PAYSTACK_VERIFY_CACHE_TTL)
+            else:
+                await cache.aset(shared_key, result, VERIFY_SHARED_TTL)
+        finally:
+            await cache.adelete(lock_key)
+        return result
+
+    while True:
+        await asyncio.sleep(VERIFY_POLL_INTERVAL)
+        found = await cache.aget_many([key, shared_key, lock_key])
+        if key in found or shared_key in found:
+            return found.get(key, found.get(shared_key))
+        if lock_key not in found:
+            return await AsyncPaystackAPI.verify_payment(reference)
+
+
+def verification_order_id(result):
+    """Return ``(order_id, None)`` from a verify result, or ``(None, PaymentResponse)`` on error."""
+    error = unavailable_error(result)
+    if error:
+        return None, error
+    if not result['status']:
+        return None, _error(result['message'], status.HTTP_400_BAD_REQUEST)
+    order_id = result['data'].get('metadata', {}).get('order_id', None)
+    if not order_id:
+        return None, _error("Order ID not found in transaction metadata.", status.HTTP_400_BAD_REQUEST)
+    return order_id, None
+
+
+def apply_verification(order, reference, payment_data):
+    """Update ``order`` from a verified Paystack transaction."""
+    payment_status = payment_data.get('status')
+    amount = float(payment_data.get('amount', 0)) / 100
+    currency = payment_data.get('currency', 'GHS')
+    paid_at = payment_data.get('paid_at')
+
+    if payment_status == 'success':
+        if order.payment_status == Order.PAYMENT_COMPLETED:
+            return PaymentResponse({
+                "message": "Payment already confirmed.",
+                "order_id": order.id,
+                "amount": amount,
+                "currency": currency,
+                "paid_at": paid_at
+            }, status.HTTP_200_OK)
+
+        if order.payment_status == Order.PAYMENT_PENDING:
+            with transaction.atomic():
+                order = Order.objects.select_for_update().get(id=order.id)
+                if order.payment_status == Order.PAYMENT_PENDING:
+                    order.payment_status = Order.PAYMENT_COMPLETED
+                    order.paystack_ref = reference
+                    order.save()
+                    _send_confirmation(order)
+
+            return PaymentResponse({
+                "message": "Payment verified successfully and order updated.",
+                "order_id": order.id,
+                "reference": reference,
+                "amount": amount,
+                "currency": currency,
+                "paid_at": paid_at
+            }, status.HTTP_200_OK)
+
+        return PaymentResponse({
+            "message": f"Payment status is {order.payment_status}",
+            "order_id": order.id,
+            "amount": amount,
+            "currency": currency
+        }, status.HTTP_200_OK)
+
+    if payment_status == 'failed':
+        if order.payment_status == Order.PAYMENT_PENDING:
+            order.payment_status = Order.PAYMENT_FAILED
+            order.paystack_ref = reference
+            order.save()
+
+        return _error(
+            "Payment verification failed.", status.HTTP_400_BAD_REQUEST,
+            order_id=order.id,
+            status=payment_status,
+            gateway_response=payment_data.get('gateway_response', 'Payment was not successful')
+        )
+
+    return _error(
+        f"Payment status is {payment_status}", status.HTTP_400_BAD_REQUEST,
+        order_id=order.id,
+        status=payment_status,
+        message=payment_data.get('gateway_response', 'Payment could not be completed')
+    )
+
+
+# Webhooks
+
+def _event_key(webhook_data):
+    event = webhook_data.get('event', '')
+    data = webhook_data.get('data') or {}
+    identity = data.get('id') or data.get('reference')
+    if identity is None:
+        # Nothing identifies the delivery; fall back to its content.
+        identity = hashlib.sha256(json.dumps(webhook_data, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'{event}:{identity}'[:255]
+
+
+def handle_webhook(payload, signature):
+    """
+    Authenticate a Paystack webhook delivery (raw body and X-Paystack-Signature)
+    and store it in the PaystackEvent inbox. Redeliveries of a stored event
+    are acknowledged without being stored twice. Nothing touches orders here;
+    see ``process_paystack_events``.
+    """
+    if not signature:
+        return _error("No signature provided", status.HTTP_400_BAD_REQUEST)
+    if not PaystackAPI.verify_webhook_signature(payload, signature):
+        return _error("Invalid signature", status.HTTP_400_BAD_REQUEST)
+
+    try:
+        webhook_data = json.loads(payload)
+    except json.JSONDecodeError:
+        return _error("Invalid JSON payload", status.HTTP_400_BAD_REQUEST)
+    if not isinstance(webhook_data, dict):
+        return _error("Invalid JSON payload", status.HTTP_400_BAD_REQUEST)
+
+    # One INSERT; a redelivered event hits the unique key and is skipped.
+    data = webhook_data.get('data') or {}
+    PaystackEvent.objects.bulk_create([PaystackEvent(
+        key=_event_key(webhook_data),
+        event=str(webhook_data.get('event', ''))[:100],
+        reference=str(data.get('reference') or '')[:100],
+        payload=webhook_data,
+    )], ignore_conflicts=True)
+    process_paystack_events.enqueue()
+    return PaymentResponse({"status": "received"}, status.HTTP_200_OK)
+
+
+def apply_webhook_event(webhook_data):
+    """Apply one stored webhook event to its order. Raises on unexpected errors so the event is retried."""
+    event = webhook_data.get('event')
+    if event == 'charge.success':
+        _apply_successful_payment(webhook_data)
+    elif event == 'charge.failed':
+        _apply_failed_payment(webhook_data)
+
+
+def _apply_successful_payment(webhook_data):
+    data = webhook_data.get('data', {})
+    order_id = data.get('metadata', {}).get('order_id')
+    reference = data.get('reference')
+    payment_status = data.get('status')
+
+    if not order_id:
+        logger.warning("Webhook received but no order_id in metadata")
+        return
+    if not reference:
+        logger.warning("Webhook received but no reference")
+        return
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id).first()
+        if order is None:
+            logger.warning("Webhook received for non-existent order: %s", order_id)
+            return
+
+        if order.payment_status == Order.PAYMENT_PENDING:
+            if payment_status == 'success':
+                order.payment_status = Order.PAYMENT_COMPLETED
+                order.paystack_ref = reference
+                order.save()
+                _send_confirmation(order)
+                logger.info("Order %s payment confirmed via webhook", order_id)
+            else:
+                order.payment_status = Order.PAYMENT_FAILED
+                order.paystack_ref = reference
+                order.save()
+                logger.warning("Order %s marked as failed (unexpected status in charge.success)", order_id)
+        else:
+            logger.info("Order %s already processed. Current status: %s", order_id, order.payment_status)
+
+
+def _apply_failed_payment(webhook_data):
+    data = webhook_data.get('data', {})
+    order_id = data.get('metadata', {}).get('order_id')
+    reference = data.get('reference')
+
+    if not order_id or not reference:
+        return
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id).first()
+        if order is None:
+            logger.warning("Webhook received for non-existent order: %s", order_id)
+            return
+
+        if order.payment_status == Order.PAYMENT_PENDING:
+            order.payment_status = Order.PAYMENT_FAILED
+            order.paystack_ref = reference
+            order.save()
+            logger.info("Order %s payment failed via webhook", order_id)
+
+
+def _due_events():
+    """
+    Pending events that are due and not waiting behind an earlier pending event
+    for the same reference, in arrival order.
+    """
+    earlier = PaystackEvent.objects.filter(
+        status=PaystackEvent.STATUS_PENDING, reference=OuterRef('reference'), id__lt=OuterRef('id')
+    ).exclude(reference='')
+    return PaystackEvent.objects.filter(
+        status=PaystackEvent.STATUS_PENDING, next_attempt_at__lte=timezone.now()
+    ).filter(~Exists(earlier)).order_by('id')
+
+
+def _process_event(event_id):
+    """
+    Apply one event and record the outcome in a single transaction. Returns
+    the event's new status, or None if another worker has it or it is no
+    longer due.
+    """
+    with transaction.atomic():
+        event = _due_events().select_for_update(skip_locked=True).filter(pk=event_id).first()
+        if event is None:
+            return None
+        event.attempts += 1
+        try:
+            with transaction.atomic():
+                apply_webhook_event(event.payload)
+        except Exception as e:
+            logger.exception("Paystack event %s failed (attempt %s)", event.pk, event.attempts)
+            event.last_error = str(e)
+            if event.attempts >= settings.PAYSTACK_EVENT_MAX_ATTEMPTS:
+                event.status = PaystackEvent.STATUS_FAILED
+            else:
+                event.next_attempt_at = timezone.now() + timedelta(
+                    seconds=settings.PAYSTACK_EVENT_RETRY_DELAY * 2 ** (event.attempts - 1))
+        else:
+            event.status = PaystackEvent.STATUS_PROCESSED
+            event.processed_at = timezone.now()
+            event.last_error = ''
+        event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'processed_at'])
+        return event.status
+
+
+@job
+def process_paystack_events(batch_size=100):
+    """
+    Apply due inbox events in arrival order, each in its own transaction. A
+    failing event is retried with exponential backoff and marked failed after
+    PAYSTACK_EVENT_MAX_ATTEMPTS attempts; until then, later events for the
+    same reference wait for it, so they are never applied out of order.
+    Returns ``(processed, failed)`` counts for this run.
+
+    Events are claimed with SKIP LOCKED, so several workers (and the
+    background job queued by the webhook) never apply the same event twice.
+    Retries are due after the run that failed them, so they are applied by
+    the periodic run (CELERY_BEAT_SCHEDULE) or ``process_paystack_events --loop``.
+    """
+    processed = failed = 0
+    while True:
+        event_ids = list(_due_events().values_list('pk', flat=True)[:batch_size])
+        outcomes = [_process_event(event_id) for event_id in event_ids]
+        processed += outcomes.count(PaystackEvent.STATUS_PROCESSED)
+        failed += outcomes.count(PaystackEvent.STATUS_FAILED)
+        # Applying an event can let later ones for its reference through, so
+        # look again until nothing is due; events other workers took are
+        # theirs to finish.
+        if all(outcome is None for outcome in outcomes):
+            break
+    return processed, failed
+
+
+def replay_paystack_events(queryset):
+    """Queue events (typically failed ones) to be applied again. Returns how many were queued."""
+    return queryset.exclude(status=PaystackEvent.STATUS_PENDING).update(
+        status=PaystackEvent.STATUS_PENDING, attempts=0, last_error='', next_attempt_at=timezone.now())
@@ -1,8 +1,116 @@
+import asyncio
 import requests
 import hmac
 import hashlib
+import httpx
+import logging
+import math
+import threading
+import time
+import weakref
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from decimal import Decimal
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+_circuit_breaker = None
+
+
+class _PoolTimeoutMixin:
+    pool_timeout = None
+
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        if pool_timeout is None:
+            pool_timeout = self.pool_timeout
+        return super().urlopen(*args, pool_timeout=pool_timeout, **kwargs)
+
+
+class BoundedPoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with at most ``pool_maxsize`` connections per host. A request
+    that finds them all busy waits up to ``pool_timeout`` seconds for one to
+    be released, then fails with a ConnectionError.
+    """
+
+    def __init__(self, pool_timeout, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # requests never passes a pool timeout to urllib3, so a blocking pool
+        # would wait forever; these pools default to ours.
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(pool_cls.__name__, (_PoolTimeoutMixin, pool_cls), {'pool_timeout': self.pool_timeout})
+            for scheme, pool_cls in (('http', HTTPConnectionPool), ('https', HTTPSConnectionPool))
+        }
+
+    def send(self, request, *args, **kwargs):
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+
+def get_session():
+    """
+    Return the process-wide requests session used for Paystack calls.
+
+    Connections are kept alive and pooled (PAYSTACK_POOL_SIZE per host), so only
+    the first call in a process pays for the TCP and TLS handshakes; a call
+    waits at most PAYSTACK_POOL_TIMEOUT seconds for a free connection. Failed
+    connections are retried for every method; read errors and 429/5xx
+    responses are only retried for GET, since repeating a POST could create a
+    second transaction.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=settings.PAYSTACK_MAX_RETRIES,
+                    backoff_factor=settings.PAYSTACK_RETRY_BACKOFF,
+                    status_forcelist=PaystackAPI.RETRY_STATUSES,
+                    allowed_methods=frozenset({'GET'}),
+                    raise_on_status=False,
+                )
+                adapter = BoundedPoolAdapter(settings.PAYSTACK_POOL_TIMEOUT, pool_connections=1,
+                                             pool_maxsize=settings.PAYSTACK_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def get_circuit_breaker():
+    """
+    Return the circuit breaker guarding Paystack calls. Its state is in the
+    default cache: shared by every worker with REDIS_URL set, per process with
+    the LocMem fallback.
+    """
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        # A probe can take as long as a call and all its retries.
+        call_timeout = (settings.PAYSTACK_CONNECT_TIMEOUT + settings.PAYSTACK_READ_TIMEOUT) * (
+            settings.PAYSTACK_MAX_RETRIES + 1)
+        _circuit_breaker = CircuitBreaker(
+            'paystack',
+            failure_threshold=settings.PAYSTACK_CIRCUIT_FAILURE_THRESHOLD,
+            slow_call=settings.PAYSTACK_CIRCUIT_SLOW_CALL,
+            reset_timeout=settings.PAYSTACK_CIRCUIT_RESET_TIMEOUT,
+            probe_timeout=math.ceil(call_timeout),
+        )
+    return _circuit_breaker
 
 
 class PaystackAPI:
@@ -12,6 +120,39 @@ class PaystackAPI:
     """
 
     BASE_URL = "https://api.paystack.co"
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    @staticmethod
+    def _healthy(response):
+        """Whether a response counts as a success for the circuit breaker."""
+        return response is not None and response.status_code < 500 and response.status_code != 429
+
+    @classmethod
+    def _request(cls, method, path, **kwargs):
+        """
+        Send a request through the shared session and log how long it took.
+        Raises CircuitOpenError without calling Paystack while the circuit is open.
+        """
+        breaker = get_circuit_breaker()
+        token = breaker.before_call()
+        started = time.perf_counter()
+        response = None
+        try:
+            response = get_session().request(
+                method,
+                f"{cls.BASE_URL}{path}",
+                headers=cls._get_headers(),
+                timeout=(settings.PAYSTACK_CONNECT_TIMEOUT, settings.PAYSTACK_READ_TIMEOUT),
+                **kwargs
+            )
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            breaker.after_call(token, cls._healthy(response), elapsed)
+            logger.info(
+                "Paystack %s %s -> %s in %.0f ms", method, path,
+                response.status_code if response is not None else 'error', elapsed * 1000,
+            )
 
     @staticmethod
     def _get_headers():
@@ -36,26 +177,7 @@ class PaystackAPI:
         return int(Decimal(str(amount)) * 100)
 
     @classmethod
-    def initialize_payment(cls, email, amount, order_id, callback_url=None):
-        """
-        Initialize a payment transaction with Paystack.
-
-        Args:
-            email (str): Customer's email address
-            amount (Decimal): Amount to charge in GHS
-            order_id (int): Your order ID for reference
-            callback_url (str, optional): URL to redirect after payment
-
-        Returns:
-            dict: {
-                'status': bool,
-                'message': str,
-                'data': dict or None (contains authorization_url, access_code, reference)
-            }
-        """
-        url = f"{cls.BASE_URL}/transaction/initialize"
-
-        # Prepare the payload
+    def _initialize_payload(cls, email, amount, order_id, callback_url=None):
         payload = {
             "email": email,
             "amount": cls._convert_to_pesewas(amount),  # Convert to pesewas
@@ -75,49 +197,70 @@ class PaystackAPI:
         # Add callback URL if provided
         if callback_url:
             payload['callback_url'] = callback_url
+        return payload
 
-        try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers=cls._get_headers(),
-                timeout=10
-            )
-            print(f"PAYSTACK RESPONSE: {response.text}")
-
-            response_data = response.json()
-
-            if response.status_code == 200 and response_data.get('status'):
-                return {
-                    'status': True,
-                    'message': 'Payment initialized successfully',
-                    'data': response_data.get('data')
-                }
-            else:
-                return {
-                    'status': False,
-                    'message': response_data.get('message', 'Failed to initialize payment'),
-                    'data': None
-                }
+    @staticmethod
+    def _result(status, message, data=None):
+        return {'status': status, 'message': message, 'data': data}
+
+    @classmethod
+    def _unavailable_result(cls, error):
+        """Result for a call refused by the open circuit; ``retry_after`` marks it."""
+        result = cls._result(False, 'Payment service is temporarily unavailable. Please try again shortly.')
+        result['retry_after'] = error.retry_after
+        return result
+
+    @classmethod
+    def _initialize_result(cls, status_code, response_data):
+        if status_code == 200 and response_data.get('status'):
+            return cls._result(True, 'Payment initialized successfully', response_data.get('data'))
+        return cls._result(False, response_data.get('message', 'Failed to initialize payment'))
+
+    @classmethod
+    def _verify_result(cls, status_code, response_data):
+        if status_code == 200 and response_data.get('status'):
+            transaction_data = response_data.get('data', {})
+
+            # Check if payment was actually successful
+            if transaction_data.get('status') == 'success':
+                return cls._result(True, 'Payment verified successfully', transaction_data)
+            return cls._result(False, f"Payment status: {transaction_data.get('status')}", transaction_data)
+        return cls._result(False, response_data.get('message', 'Failed to verify payment'))
 
+    @classmethod
+    def _call(cls, method, path, parse, **kwargs):
+        try:
+            response = cls._request(method, path, **kwargs)
+            return parse(response.status_code, response.json())
+        except CircuitOpenError as e:
+            return cls._unavailable_result(e)
         except requests.exceptions.Timeout:
-            return {
-                'status': False,
-                'message': 'Request timeout. Please try again.',
-                'data': None
-            }
+            return cls._result(False, 'Request timeout. Please try again.')
         except requests.exceptions.RequestException as e:
-            return {
-                'status': False,
-                'message': f'Network error: {str(e)}',
-                'data': None
-            }
+            return cls._result(False, f'Network error: {str(e)}')
         except Exception as e:
-            return {
-                'status': False,
-                'message': f'An error occurred: {str(e)}',
-                'data': None
+            return cls._result(False, f'An error occurred: {str(e)}')
+
+    @classmethod
+    def initialize_payment(cls, email, amount, order_id, callback_url=None):
+        """
+        Initialize a payment transaction with Paystack.
+
+        Args:
+            email (str): Customer's email address
+            amount (Decimal): Amount to charge in GHS
+            order_id (int): Your order ID for reference
+            callback_url (str, optional): URL to redirect after payment
+
+        Returns:
+            dict: {
+                'status': bool,
+                'message': str,
+                'data': dict or None (contains authorization_url, access_code, reference)
             }
+        """
+        payload = cls._initialize_payload(email, amount, order_id, callback_url)
+        return cls._call('POST', '/transaction/initialize', cls._initialize_result, json=payload)
 
     @classmethod
     def verify_payment(cls, reference):
@@ -134,58 +277,7 @@ class PaystackAPI:
                 'data': dict or None (contains transaction details)
             }
         """
-        url = f"{cls.BASE_URL}/transaction/verify/{reference}"
-
-        try:
-            response = requests.get(
-                url,
-                headers=cls._get_headers(),
-                timeout=10
-            )
-
-            response_data = response.json()
-
-            if response.status_code == 200 and response_data.get('status'):
-                transaction_data = response_data.get('data', {})
-
-                # Check if payment was actually successful
-                if transaction_data.get('status') == 'success':
-                    return {
-                        'status': True,
-                        'message': 'Payment verified successfully',
-                        'data': transaction_data
-                    }
-                else:
-                    return {
-                        'status': False,
-                        'message': f"Payment status: {transaction_data.get('status')}",
-                        'data': transaction_data
-                    }
-            else:
-                return {
-                    'status': False,
-                    'message': response_data.get('message', 'Failed to verify payment'),
-                    'data': None
-                }
-
-        except requests.exceptions.Timeout:
-            return {
-                'status': False,
-                'message': 'Request timeout. Please try again.',
-                'data': None
-            }
-        except requests.exceptions.RequestException as e:
-            return {
-                'status': False,
-                'message': f'Network error: {str(e)}',
-                'data': None
-            }
-        except Exception as e:
-            return {
-                'status': False,
-                'message': f'An error occurred: {str(e)}',
-                'data': None
-            }
+        return cls._call('GET', f'/transaction/verify/{reference}', cls._verify_result)
 
     @staticmethod
     def verify_webhook_signature(payload, signature):
@@ -212,6 +304,89 @@ class PaystackAPI:
             # Compare signatures
             return hmac.compare_digest(expected_signature, signature)
 
+        except Exception:
+            logger.exception("Webhook signature verification error")
+            return False
+
+
+# One client per event loop: an httpx.AsyncClient must not be shared across loops.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the pooled httpx client for the running event loop.
+
+    Like the sync session it keeps connections alive (at most
+    PAYSTACK_POOL_SIZE) and retries failed connection attempts; GET retries on
+    429/5xx are handled by ``AsyncPaystackAPI._request``.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        limits = httpx.Limits(max_connections=settings.PAYSTACK_POOL_SIZE,
+                              max_keepalive_connections=settings.PAYSTACK_POOL_SIZE)
+        timeout = httpx.Timeout(settings.PAYSTACK_READ_TIMEOUT, connect=settings.PAYSTACK_CONNECT_TIMEOUT,
+                                pool=settings.PAYSTACK_POOL_TIMEOUT)
+        transport = httpx.AsyncHTTPTransport(limits=limits, retries=settings.PAYSTACK_MAX_RETRIES)
+        client = httpx.AsyncClient(transport=transport, timeout=timeout)
+        _async_clients[loop] = client
+    return client
+
+
+class AsyncPaystackAPI(PaystackAPI):
+    """
+    Non-blocking counterpart of PaystackAPI for async views. Same arguments and
+    return values, but ``initialize_payment`` and ``verify_payment`` are coroutines.
+    """
+
+    @classmethod
+    async def _request(cls, method, path, **kwargs):
+        breaker = get_circuit_breaker()
+        token = await sync_to_async(breaker.before_call)()
+        started = time.perf_counter()
+        response = None
+        attempts = settings.PAYSTACK_MAX_RETRIES + 1 if method == 'GET' else 1
+        try:
+            for attempt in range(attempts):
+                last_attempt = attempt == attempts - 1
+                try:
+                    response = await get_async_client().request(
+                        method, f"{cls.BASE_URL}{path}", headers=cls._get_headers(), **kwargs)
+                except httpx.TransportError:
+                    if last_attempt:
+                        raise
+                else:
+                    if response.status_code not in cls.RETRY_STATUSES or last_attempt:
+                        return response
+                await asyncio.sleep(settings.PAYSTACK_RETRY_BACKOFF * (2 ** attempt))
+        finally:
+            elapsed = time.perf_counter() - started
+            await sync_to_async(breaker.after_call)(token, cls._healthy(response), elapsed)
+            logger.info(
+                "Paystack %s %s -> %s in %.0f ms (async)", method, path,
+                response.status_code if response is not None else 'error', elapsed * 1000,
+            )
+
+    @classmethod
+    async def _call(cls, method, path, parse, **kwargs):
+        try:
+            response = await cls._request(method, path, **kwargs)
+            return parse(response.status_code, response.json())
+        except CircuitOpenError as e:
+            return cls._unavailable_result(e)
+        except httpx.TimeoutException:
+            return cls._result(False, 'Request timeout. Please try again.')
+        except httpx.HTTPError as e:
+            return cls._result(False, f'Network error: {str(e)}')
         except Exception as e:
-            print(f"Webhook signature verification error: {e}")
-            return False
\ No newline at end of file
+            return cls._result(False, f'An error occurred: {str(e)}')
+
+    @classmethod
+    async def initialize_payment(cls, email, amount, order_id, callback_url=None):
+        payload = cls._initialize_payload(email, amount, order_id, callback_url)
+        return await cls._call('POST', '/transaction/initialize', cls._initialize_result, json=payload)
+
+    @classmethod
+    async def verify_payment(cls, reference):
+        return await cls._call('GET', f'/transaction/verify/{reference}', cls._verify_result)
@@ -0,0 +1,140 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import ProductSize
+
+ZERO = Decimal('0.00')
+
+# The Product columns price_lines() reads; enough for .only() when the product
+# itself is not being rendered.
+PRODUCT_PRICE_FIELDS = ('price', 'customization_price', 'is_customizable', 'has_size_options')
+
+PricedLine = namedtuple('PricedLine', ['line', 'quantity', 'unit_price', 'customization_price', 'total'])
+Quote = namedtuple('Quote', ['lines', 'subtotal', 'customization_total', 'total'])
+
+
+def _is_sized(line):
+    return bool(line.selected_size) and line.product.has_size_options
+
+
+def _load_size_prices(lines):
+    """
+    Return {(product_id, size_name): price} for every sized line.
+
+    Uses prefetched ``product.sizes`` when all of them are available, otherwise
+    loads the needed rows in a single query.
+    """
+    sized = [line for line in lines if _is_sized(line)]
+    if not sized:
+        return {}
+
+    if all('sizes' in getattr(line.product, '_prefetched_objects_cache', {}) for line in sized):
+        return {
+            (size.product_id, size.size_name): size.price
+            for line in sized
+            for size in line.product.sizes.all()
+        }
+
+    rows = ProductSize.objects.filter(
+        product_id__in={line.product.pk for line in sized},
+        size_name__in={line.selected_size for line in sized},
+    ).values_list('product_id', 'size_name', 'price')
+    return {(product_id, size_name): price for product_id, size_name, price in rows}
+
+
+def _build_quote(priced_lines):
+    subtotal = sum((line.unit_price * line.quantity for line in priced_lines), ZERO)
+    customization_total = sum((line.customization_price * line.quantity for line in priced_lines), ZERO)
+    return Quote(priced_lines, subtotal, customization_total, subtotal + customization_total)
+
+
+def price_lines(lines):
+    """
+    Price cart-like lines (anything with ``product``, ``quantity``,
+    ``with_customization`` and ``selected_size``).
+
+    A line costs the selected size's price (or the product's base price when it
+    has no valid size) plus the customization price when the product is
+    customizable, times the quantity. All size prices are loaded in at most one
+    query, whatever the number of lines.
+    """
+    lines = list(lines)
+    size_prices = _load_size_prices(lines)
+
+    priced_lines = []
+    for line in lines:
+        product = line.product
+        unit_price = product.price
+        if _is_sized(line):
+            unit_price = size_prices.get((product.pk, line.selected_size), product.price)
+
+        customization_price = ZERO
+        if line.with_customization and product.is_customizable:
+            customization_price = product.customization_price
+
+        priced_lines.append(PricedLine(
+            line=line,
+            quantity=line.quantity,
+            unit_price=unit_price,
+            customization_price=customization_price,
+            total=(unit_price + customization_price) * line.quantity,
+        ))
+    return _build_quote(priced_lines)
+
+
+def price_order_items(items):
+    """Price order items from the prices captured at purchase time. Never queries."""
+    priced_lines = []
+    for item in items:
+        customization_price = item.customization_price_at_purchase if item.with_customization else ZERO
+        priced_lines.append(PricedLine(
+            line=item,
+            quantity=item.quantity,
+            unit_price=item.price_at_purchase,
+            customization_price=customization_price,
+            total=(item.price_at_purchase + customization_price) * item.quantity,
+        ))
+    return _build_quote(priced_lines)
+
+
+def backfill_order_totals(orders, batch_size=500):
+    """
+    Store subtotal, customization total and total on ``orders`` (a queryset,
+    also of a migration's historical Order model) from the prices their items
+    captured at purchase. Returns how many orders were updated.
+    """
+    money = DecimalField(max_digits=10, decimal_places=2)
+    line_subtotal = ExpressionWrapper(F('items__price_at_purchase') * F('items__quantity'), output_field=money)
+    line_customization = Case(
+        When(items__with_customization=True,
+             then=ExpressionWrapper(F('items__customization_price_at_purchase') * F('items__quantity'),
+                                    output_field=money)),
+        default=Value(0),
+        output_field=money,
+    )
+    orders = orders.order_by('pk').annotate(
+        item_subtotal=Coalesce(Sum(line_subtotal), Value(0), output_field=money),
+        item_customization_total=Coalesce(Sum(line_customization), Value(0), output_field=money),
+    ).only('pk')
+
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(orders.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+
+        for order in batch:
+            order.subtotal = order.item_subtotal
+            order.customization_total = order.item_customization_total
+            order.total = order.item_subtotal + order.item_customization_total
+
+        # bulk_update bypasses Order.save(), so no status emails are sent.
+        orders.model._base_manager.using(orders.db).bulk_update(
+            batch, ['subtotal', 'customization_total', 'total'])
+        updated += len(batch)
+        last_pk = batch[-1].pk
+    return updated
@@ -0,0 +1,127 @@
+"""
+Reconcile orders stuck in PAYMENT_PENDING against Paystack.
+
+Used by ``manage.py reconcile_payments`` for orders whose webhook never arrived
+and whose customer never came back to the verify page.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order
+from .paystack import PaystackAPI
+
+logger = logging.getLogger(__name__)
+
+# Outcomes reported in the summary.
+COMPLETED = 'completed'
+FAILED = 'failed'
+STILL_PENDING = 'still_pending'
+MISMATCHED = 'mismatched'
+ERRORS = 'errors'
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def pending_orders(min_age):
+    """Pending orders with a Paystack reference that was initialized at least ``min_age`` ago."""
+    cutoff = timezone.now() - min_age
+    return Order.objects.filter(payment_status=Order.PAYMENT_PENDING).exclude(
+        Q(paystack_ref__isnull=True) | Q(paystack_ref='')
+    ).filter(
+        Q(paystack_initialized_at__lte=cutoff) | Q(paystack_initialized_at__isnull=True, created_at__lte=cutoff)
+    )
+
+
+def classify(order, result):
+    """Map a verify_payment() result to one of the summary outcomes."""
+    data = result['data']
+    if data is None:
+        # Paystack could not be reached or does not know the reference.
+        return ERRORS
+    if str(data.get('metadata', {}).get('order_id')) != str(order.pk):
+        return MISMATCHED
+
+    transaction_status = data.get('status')
+    if transaction_status == 'success':
+        if Decimal(data.get('amount', 0)) < order.total * 100:  # Paystack amounts are in pesewas
+            return MISMATCHED
+        return COMPLETED
+    if transaction_status == 'failed':
+        return FAILED
+    return STILL_PENDING
+
+
+def _apply(outcomes):
+    """Write the final statuses in two UPDATEs and queue confirmations for newly paid orders."""
+    completed = [pk for pk, outcome in outcomes.items() if outcome == COMPLETED]
+    failed = [pk for pk, outcome in outcomes.items() if outcome == FAILED]
+    with transaction.atomic():
+        # Only orders that are still pending: the webhook or the verify page may
+        # have settled some while we were asking Paystack.
+        completed = list(Order.objects.select_for_update().filter(
+            pk__in=completed, payment_status=Order.PAYMENT_PENDING).values_list('pk', 'paystack_ref'))
+        Order.objects.filter(pk__in=[pk for pk, _ in completed]).update(payment_status=Order.PAYMENT_COMPLETED)
+        Order.objects.filter(pk__in=failed, payment_status=Order.PAYMENT_PENDING).update(
+            payment_status=Order.PAYMENT_FAILED)
+
+        from core.outbox import payment_confirmation_email, queue_emails
+        queue_emails([payment_confirmation_email(pk, reference) for pk, reference in completed])
+
+
+def reconcile_pending_orders(min_age=timedelta(minutes=30), batch_size=100, workers=4, rate=10, limit=None,
+                             dry_run=False):
+    """
+    Verify pending orders with Paystack, ``workers`` at a time and at most
+    ``rate`` requests per second, applying each batch's results in bulk.
+    Returns a Counter of outcomes (plus ``checked``).
+    """
+    summary = Counter()
+    limiter = RateLimiter(rate)
+
+    def verify(order):
+        limiter.wait()
+        return order.pk, classify(order, PaystackAPI.verify_payment(order.paystack_ref))
+
+    orders = pending_orders(min_age).only('pk', 'total', 'paystack_ref').order_by('pk')
+    last_pk = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while limit is None or summary['checked'] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - summary['checked'])
+            batch = list(orders.filter(pk__gt=last_pk)[:size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            outcomes = dict(executor.map(verify, batch))
+            summary['checked'] += len(batch)
+            summary.update(outcomes.values())
+            if not dry_run:
+                _apply(outcomes)
+            logger.info("Reconciled %s orders up to #%s: %s", len(batch), last_pk, dict(Counter(outcomes.values())))
+    return summary
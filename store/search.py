@@ -0,0 +1,102 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+# SQLite keeps its own FTS5 table whose rowid is the product id; PostgreSQL uses
+# the Product.search_vector column with a GIN index. Both are created by
+# migration 0021 and kept up to date from the product signals.
+FTS_TABLE = 'store_product_fts'
+
+
+def _search_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'english')
+
+
+def search_vector():
+    return (SearchVector('name', weight='A', config=_search_config()) +
+            SearchVector('description', weight='B', config=_search_config()))
+
+
+def update_product_search_index(product):
+    if connection.vendor == 'postgresql':
+        Product.objects.filter(pk=product.pk).update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                           [product.pk, product.name, product.description])
+
+
+def remove_product_from_search_index(product_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_search_index():
+    if connection.vendor == 'postgresql':
+        Product.objects.update(search_vector=search_vector())
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                           f'SELECT id, name, description FROM store_product')
+
+
+def _fts5_query(terms):
+    # Quote every word so user input can never be parsed as FTS5 syntax, and
+    # prefix-match so partial words still find results while typing.
+    words = [word for term in terms for word in re.findall(r'\w+', term)]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_products(queryset, terms):
+    """
+    Restrict ``queryset`` to products matching every term, annotated with a
+    ``rank`` (higher is better) and ordered by it.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(' '.join(terms), search_type='websearch', config=_search_config())
+        # ts_rank() returns a real; as a double precision the value a cursor
+        # carries compares equal to the row it came from.
+        return queryset.filter(search_vector=query).annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        ).order_by('-rank', 'id')
+
+    match = _fts5_query(terms)
+    if not match:
+        return queryset
+    # The MATCH runs inside the product query, so the view's other filters and
+    # the pagination apply in the same statement. bm25() scores are negative,
+    # lower meaning more relevant.
+    table = Product._meta.db_table
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+    ).annotate(
+        rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id',
+            [match], output_field=FloatField(),
+        )
+    ).order_by('-rank', 'id')
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Ranked full-text search on PostgreSQL and SQLite. Other databases fall
+    back to DRF's ``icontains`` search over ``search_fields``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or connection.vendor not in ('postgresql', 'sqlite'):
+            return super().filter_queryset(request, queryset, view)
+        return search_products(queryset, terms)
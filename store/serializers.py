@@ -1,6 +1,12 @@
 from rest_framework import serializers
-from .models import Product, Collection, Cart, CartItem, Customer, OrderItem, Order, Branch, ProductImage, ProductSize
+from rest_framework.exceptions import NotFound
+from .models import Product, Collection, Cart, CartItem, Customer, OrderItem, Order, Branch, ProductImage, ProductSize, \
+    set_prefetched
 from django.db import transaction
+from django.db.models import Prefetch
+from .pricing import price_lines
+from .fieldsets import SparseFieldsMixin
+from .cart_storage import OP_ADD, OP_UPDATE, OP_REMOVE, get_cart_store
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -26,7 +32,21 @@ class ProductSizeSerializer(serializers.ModelSerializer):
         fields = ['id', 'size_name', 'price', 'is_available']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+def first_image_url(obj):
+    # Products loaded with Product.objects.with_first_image() (or cards())
+    # carry the image as an annotation; anything else falls back to queries.
+    if hasattr(obj, 'first_image'):
+        return obj.first_image.url if obj.first_image else None
+    if hasattr(obj, 'images') and obj.images.exists():
+        first_image = obj.images.first()
+        if first_image and first_image.image:
+            return first_image.image.url
+    elif hasattr(obj, 'image') and obj.image:
+        return obj.image.url
+    return None
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     collection = serializers.StringRelatedField()
     sizes = ProductSizeSerializer(many=True, read_only=True)
@@ -35,6 +55,45 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'price', 'description', 'images', 'is_available', 'collection', 'is_customizable',
                   'customization_price', 'has_size_options', 'sizes']
+        expandable_fields = ['images', 'sizes']
+        optional_fields = {'image': serializers.SerializerMethodField}
+
+    def get_image(self, obj):
+        return first_image_url(obj)
+
+
+class SimpleProductSerializer(serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
+    sizes = ProductSizeSerializer(many=True, read_only=True)
+    collection = serializers.SerializerMethodField()
+    min_size_price = serializers.SerializerMethodField()
+    max_size_price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'image', 'is_customizable', 'customization_price', 'has_size_options',
+                  'sizes', 'collection', 'min_size_price', 'max_size_price']
+
+    # Products loaded through Product.objects.cards() carry these values as
+    # annotations; anything else falls back to per-object lookups.
+
+    def get_image(self, obj):
+        return first_image_url(obj)
+
+    def get_collection(self, obj):
+        if hasattr(obj, 'collection_name'):
+            return obj.collection_name
+        return obj.collection.name
+
+    def get_min_size_price(self, obj):
+        if hasattr(obj, 'min_size_price'):
+            return obj.min_size_price
+        return min((size.price for size in obj.sizes.all()), default=None)
+
+    def get_max_size_price(self, obj):
+        if hasattr(obj, 'max_size_price'):
+            return obj.max_size_price
+        return max((size.price for size in obj.sizes.all()), default=None)
 
 
 class CollectionSerializer(serializers.ModelSerializer):
@@ -46,49 +105,59 @@ class CollectionSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'products', 'product_count']
 
 
-class SimpleProductSerializer(serializers.ModelSerializer):
-    image = serializers.SerializerMethodField()
-    sizes = ProductSizeSerializer(many=True, read_only=True)
+class CollectionSummarySerializer(serializers.ModelSerializer):
+    preview = SimpleProductSerializer(source='preview_products', many=True, read_only=True)
 
     class Meta:
-        model = Product
-        fields = ['id', 'name', 'price', 'image', 'is_customizable', 'customization_price', 'has_size_options',
-                  'sizes']
+        model = Collection
+        fields = ['id', 'name', 'product_count', 'preview']
 
-    def get_image(self, obj):
-        if hasattr(obj, 'images') and obj.images.exists():
-            first_image = obj.images.first()
-            if first_image and first_image.image:
-                return first_image.image.url
-        elif hasattr(obj, 'image') and obj.image:
-            return obj.image.url
-        return None
+
+def sizeless_as_null(data):
+    # Cart items store '' for "no size"; the API keeps reporting it as null.
+    if 'selected_size' in data:
+        data['selected_size'] = data['selected_size'] or None
+    return data
+
+
+def price_into_context(context, items):
+    """
+    Price cart items in one batch and remember the results in the serializer
+    context, so item totals and the cart total never price a line twice.
+    """
+    line_prices = context.setdefault('line_prices', {})
+    missing = [item for item in items if (item.cart_id, item.pk) not in line_prices]
+    if missing:
+        for priced in price_lines(missing).lines:
+            line_prices[priced.line.cart_id, priced.line.pk] = priced
+    return [line_prices[item.cart_id, item.pk] for item in items]
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        price_into_context(self.context, items)
+        return super().to_representation(items)
+
+
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
     product = SimpleProductSerializer(read_only=True)
 
     class Meta:
         model = CartItem
         fields = ['id', 'quantity', 'product', 'total_price', 'with_customization', 'selected_size']
+        list_serializer_class = CartItemListSerializer
+        expandable_fields = ['product']
 
     def get_total_price(self, cart_item):
-        if cart_item.selected_size and cart_item.product.has_size_options:
-            try:
-                size = cart_item.product.sizes.get(size_name=cart_item.selected_size)
-                base_price = cart_item.quantity * size.price
-            except ProductSize.DoesNotExist:
-                base_price = cart_item.quantity * cart_item.product.price
-        else:
-            base_price = cart_item.quantity * cart_item.product.price
+        return price_into_context(self.context, [cart_item])[0].total
 
-        if cart_item.with_customization and cart_item.product.is_customizable:
-            base_price += (cart_item.product.customization_price * cart_item.quantity)
-        return base_price
+    def to_representation(self, instance):
+        return sizeless_as_null(super().to_representation(instance))
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     id = serializers.UUIDField(read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -98,70 +167,102 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total_price', 'created_at']
 
     def get_total_price(self, cart):
-        total = 0
-        for item in cart.items.all():
-            if item.selected_size and item.product.has_size_options:
-                try:
-                    size = item.product.sizes.get(size_name=item.selected_size)
-                    base_price = item.quantity * size.price
-                except ProductSize.DoesNotExist:
-                    base_price = item.quantity * item.product.price
-            else:
-                base_price = item.quantity * item.product.price
-
-            if item.with_customization and item.product.is_customizable:
-                base_price += (item.product.customization_price * item.quantity)
-            total += base_price
-        return total
+        return sum((priced.total for priced in price_into_context(self.context, cart.items.all())), 0)
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
     with_customization = serializers.BooleanField(default=False)
-    selected_size = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    selected_size = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
 
     class Meta:
         model = CartItem
         fields = ['id', 'product_id', 'quantity', 'with_customization', 'selected_size']
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError('This product does not exist')
-        return value
+    def validate_selected_size(self, value):
+        return value or ''
 
     def save(self, **kwargs):
         product_id = self.validated_data['product_id']
-        quantity = self.validated_data['quantity']
-        with_customization = self.validated_data.get('with_customization', False)
-        selected_size = self.validated_data.get('selected_size', '')
         cart_id = self.context['cart_id']
 
-        try:
-            cart_item = CartItem.objects.get(
-                cart_id=cart_id,
-                product_id=product_id,
-                with_customization=with_customization,
-                selected_size=selected_size
-            )
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(
-                cart_id=cart_id,
-                product_id=product_id,
-                quantity=quantity,
-                with_customization=with_customization,
-                selected_size=selected_size if selected_size else None
-            )
+        self.instance = get_cart_store().add_item(
+            cart_id=cart_id,
+            user_id=self.context['request'].user.id,
+            product_id=product_id,
+            quantity=self.validated_data['quantity'],
+            with_customization=self.validated_data.get('with_customization', False),
+            selected_size=self.validated_data.get('selected_size', '')
+        )
+        if self.instance is None:
+            if not Product.objects.filter(pk=product_id).exists():
+                raise serializers.ValidationError({'product_id': ['This product does not exist']})
+            raise NotFound('No cart with the given ID was found')
         return self.instance
 
+    def to_representation(self, instance):
+        return sizeless_as_null(super().to_representation(instance))
+
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
+    selected_size = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
+
     class Meta:
         model = CartItem
         fields = ['quantity', 'with_customization', 'selected_size']
 
+    def validate_selected_size(self, value):
+        return value or ''
+
+    def update(self, instance, validated_data):
+        return get_cart_store().update_item(
+            self.context['cart_id'], self.context['request'].user.id, instance, **validated_data)
+
+    def to_representation(self, instance):
+        return sizeless_as_null(super().to_representation(instance))
+
+
+class CartItemOperationSerializer(serializers.Serializer):
+    OP_ADD = OP_ADD
+    OP_UPDATE = OP_UPDATE
+    OP_REMOVE = OP_REMOVE
+
+    op = serializers.ChoiceField(choices=[OP_ADD, OP_UPDATE, OP_REMOVE])
+    id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=1)
+    with_customization = serializers.BooleanField(required=False)
+    selected_size = serializers.CharField(required=False, allow_blank=True, allow_null=True, max_length=50)
+
+    def validate(self, attrs):
+        if attrs['op'] == self.OP_ADD:
+            if 'product_id' not in attrs or 'quantity' not in attrs:
+                raise serializers.ValidationError('"add" requires product_id and quantity.')
+        elif 'id' not in attrs:
+            raise serializers.ValidationError(f'"{attrs["op"]}" requires the cart item id.')
+        if attrs['op'] == self.OP_UPDATE and 'product_id' in attrs:
+            raise serializers.ValidationError(
+                {'product_id': ['"update" cannot change the product; remove the item and add the new one.']})
+        if 'selected_size' in attrs:
+            attrs['selected_size'] = attrs['selected_size'] or ''
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Apply a list of add/update/remove operations to a cart atomically.
+
+    Operations are applied in order against an in-memory copy of the cart (see
+    ``cart_storage.plan_operations``), then written back by the cart store in
+    one go.
+    """
+    operations = CartItemOperationSerializer(many=True, allow_empty=False)
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        get_cart_store().apply_operations(cart_id, self.context['request'].user.id, self.validated_data['operations'])
+        return cart_id
+
 
 class CustomerSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(read_only=True)
@@ -192,16 +293,17 @@ class CustomerSerializer(serializers.ModelSerializer):
         return instance
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
     class Meta:
         model = OrderItem
         fields = ['id', 'price_at_purchase', 'product', 'quantity', 'with_customization',
                   'customization_price_at_purchase', 'selected_size']
+        expandable_fields = ['product']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
@@ -221,6 +323,9 @@ class OrderSerializer(serializers.ModelSerializer):
             'secret_message',
             'delivery_date',
             'delivery_time',
+            'subtotal',
+            'customization_total',
+            'total',
             'items'
         ]
 
@@ -241,52 +346,67 @@ class CreateOrderSerializer(serializers.Serializer):
     delivery_date = serializers.DateField(required=False, allow_null=True)
     delivery_time = serializers.TimeField(required=False, allow_null=True)
 
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError("No cart with the given ID was found")
-        elif CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise serializers.ValidationError("The Cart is Empty")
-        return cart_id
-
     def save(self, **kwargs):
+        """
+        Check out the cart in a constant number of statements, whatever its size:
+        lock the cart, load items with their product cards and sizes (3 queries),
+        look up the customer, insert the order and its items, then delete the
+        cart's items and the cart (9 statements in total).
+
+        The cart row lock serializes concurrent checkouts of the same cart; the
+        loser finds the cart gone and gets a validation error instead of a
+        second order. A cart belonging to another user is reported as missing.
+        """
+        cart_id = self.validated_data['cart_id']
+        user_id = self.context['user_id']
+        # Carts kept outside the database are written back (and committed) first,
+        # so a checkout that fails below leaves them flushed and consistent.
+        get_cart_store().flush(cart_id, user_id)
         with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-            customer = Customer.objects.get(user_id=self.context['user_id'])
+            cart = Cart.objects.select_for_update().only('pk').filter(pk=cart_id, user_id=user_id).first()
+            if cart is None:
+                raise serializers.ValidationError({'cart_id': ['No cart with the given ID was found']})
+
+            cart_items = list(CartItem.objects.filter(cart_id=cart_id).prefetch_related(
+                Prefetch('product', queryset=Product.objects.cards())))
+            if not cart_items:
+                raise serializers.ValidationError({'cart_id': ['The Cart is Empty']})
+            quote = price_lines(cart_items)
+            customer_id = Customer.objects.values_list('pk', flat=True).get(user_id=user_id)
+
             order = Order.objects.create(
-                customer=customer,
+                customer_id=customer_id,
                 recipient_name=self.validated_data['recipient_name'],
                 recipient_number=self.validated_data['recipient_number'],
                 recipient_address=self.validated_data['recipient_address'],
                 branch=self.validated_data['branch'],
                 secret_message=self.validated_data.get('secret_message', ''),
                 delivery_date=self.validated_data.get('delivery_date'),
-                delivery_time=self.validated_data.get('delivery_time')
+                delivery_time=self.validated_data.get('delivery_time'),
+                subtotal=quote.subtotal,
+                customization_total=quote.customization_total,
+                total=quote.total
             )
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id)
-
-            order_items = []
-            for item in cart_items:
-                if item.selected_size and item.product.has_size_options:
-                    try:
-                        size = item.product.sizes.get(size_name=item.selected_size)
-                        price = size.price
-                    except ProductSize.DoesNotExist:
-                        price = item.product.price
-                else:
-                    price = item.product.price
-
-                order_items.append(OrderItem(
+
+            order_items = OrderItem.objects.bulk_create([
+                OrderItem(
                     order=order,
-                    product=item.product,
-                    price_at_purchase=price,
-                    quantity=item.quantity,
-                    with_customization=item.with_customization,
-                    customization_price_at_purchase=item.product.customization_price if item.with_customization else 0,
-                    selected_size=item.selected_size
-                ))
-
-            OrderItem.objects.bulk_create(order_items)
-            Cart.objects.filter(pk=cart_id).delete()
+                    product=priced.line.product,
+                    price_at_purchase=priced.unit_price,
+                    quantity=priced.quantity,
+                    with_customization=priced.line.with_customization,
+                    # Zero when the product is not customizable, so the stored
+                    # prices always add up to the order total.
+                    customization_price_at_purchase=priced.customization_price,
+                    selected_size=priced.line.selected_size or None
+                )
+                for priced in quote.lines
+            ])
+            # The response renders these directly, products included.
+            set_prefetched(order, 'items', order_items)
+
+            cart.delete()
+            transaction.on_commit(lambda: get_cart_store().discard(cart_id))
 
             return order
 
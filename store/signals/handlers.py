@@ -1,8 +1,10 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from store.models import Customer
-from core.tasks import send_email_task, send_welcome_email_task  # <-- Add this import
+from store.models import Customer, Collection, Product, ProductImage, ProductSize
+from store.cache import CATALOG_NAMESPACE, COLLECTIONS_NAMESPACE, bump_version, product_namespace
+from store.search import update_product_search_index, remove_product_from_search_index
+from core.tasks import send_confirmation_email_task, send_welcome_email_task
 from store.signals import order_created
 
 
@@ -17,7 +19,54 @@ def create_customer_for_new_user(sender, instance, created, **kwargs):
 @receiver(order_created)
 def send_confirmation_on_order_create(sender, order, **kwargs):
     """
-    Listens for the 'order_created' signal and passes the
-    new order's ID to the Celery task.
+    Listens for the 'order_created' signal and queues the
+    order confirmation email.
     """
-    send_email_task(order.id)
\ No newline at end of file
+    send_confirmation_email_task(order.id, 'created')
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    bump_version(CATALOG_NAMESPACE)
+    bump_version(product_namespace(instance.pk))
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_collection(sender, instance, **kwargs):
+    # The collection the product is leaving, if any, also needs a recount.
+    instance._previous_collection_id = (
+        Product.objects.filter(pk=instance.pk).values_list('collection_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Product)
+def update_collection_product_counts(sender, instance, **kwargs):
+    # Only the product's old and new collection can change count. The collections
+    # namespace is part of every product detail key, so it is only bumped when a
+    # count really changed.
+    collection_ids = {instance.collection_id, getattr(instance, '_previous_collection_id', None)} - {None}
+    if collection_ids and Collection.refresh_product_counts(collection_ids):
+        bump_version(COLLECTIONS_NAMESPACE)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=ProductSize)
+def invalidate_product_children_cache(sender, instance, **kwargs):
+    bump_version(CATALOG_NAMESPACE)
+    bump_version(product_namespace(instance.product_id))
+
+
+@receiver([post_save, post_delete], sender=Collection)
+def invalidate_collection_cache(sender, instance, **kwargs):
+    bump_version(COLLECTIONS_NAMESPACE)
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, **kwargs):
+    update_product_search_index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_for_search(sender, instance, **kwargs):
+    remove_product_from_search_index(instance.pk)
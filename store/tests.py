@@ -1,3 +1,1271 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from rest_framework.throttling import UserRateThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import OutboxEmail
+from core.outbox import deliver_outbox_emails, queue_order_confirmation
+
+from . import checks, payments, paystack, reconciliation, views
+from .cart_storage import OP_ADD, OP_UPDATE, DatabaseCartStore, RedisCartStore
+from .models import Branch, Cart, CartItem, Collection, Order, OrderItem, PaystackEvent, Product, ProductSize
+from .serializers import CreateOrderSerializer
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cakes = Collection.objects.create(name='Cakes')
+        self.pastries = Collection.objects.create(name='Pastries')
+        self.products = [
+            Product.objects.create(name=f'Cake {i}', description='cake', price=10 + i, is_available=True,
+                                   collection=self.cakes)
+            for i in range(3)
+        ]
+        self.client = APIClient()
+
+    def detail_queries(self, product):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/store/products/{product.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_editing_a_product_keeps_other_product_details_cached(self):
+        other = self.products[0]
+        self.detail_queries(other)
+        self.assertEqual(self.detail_queries(other), 0)
+
+        edited = self.products[1]
+        edited.price = 99
+        edited.save()
+
+        self.assertEqual(self.detail_queries(other), 0)
+        self.assertGreater(self.detail_queries(edited), 0)
+
+    def test_moving_a_product_recounts_both_collections(self):
+        product = self.products[0]
+        product.collection = self.pastries
+        product.save()
+
+        self.cakes.refresh_from_db()
+        self.pastries.refresh_from_db()
+        self.assertEqual((self.cakes.product_count, self.pastries.product_count), (2, 1))
+
+        product.delete()
+        self.pastries.refresh_from_db()
+        self.assertEqual(self.pastries.product_count, 0)
+
+
+def paystack_result(reference, transaction_status, order_id):
+    return {
+        'status': transaction_status == 'success',
+        'message': 'Verification successful',
+        'data': {'reference': reference, 'status': transaction_status, 'amount': 5000,
+                 'currency': 'GHS', 'metadata': {'order_id': order_id}},
+    }
+
+
+class PaymentVerificationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='ama', email='ama@example.com', password='x')
+        self.order = Order.objects.create(
+            customer=self.user.customer, branch=Branch.objects.create(name='Accra'),
+            recipient_name='Ama', recipient_number='0200000000', recipient_address='Accra',
+            total=50, paystack_ref='ref-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def verify(self, reference='ref-1'):
+        return self.client.get('/store/payments/verify/', {'reference': reference})
+
+    def set_payment_status(self, payment_status):
+        Order.objects.filter(pk=self.order.pk).update(payment_status=payment_status)
+
+    @mock.patch('store.payments.PaystackAPI.verify_payment')
+    def test_confirmed_payment_is_answered_without_paystack(self, verify_payment):
+        self.set_payment_status(Order.PAYMENT_COMPLETED)
+        response = self.verify()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'Payment already confirmed.')
+        verify_payment.assert_not_called()
+
+    @mock.patch('store.payments.PaystackAPI.verify_payment')
+    def test_failed_payment_is_asked_again_and_not_cached(self, verify_payment):
+        self.set_payment_status(Order.PAYMENT_FAILED)
+        verify_payment.return_value = paystack_result('ref-1', 'failed', self.order.pk)
+        self.assertEqual(self.verify().status_code, 400)
+        self.assertEqual(self.verify().status_code, 400)
+        self.assertEqual(verify_payment.call_count, 2)
+
+    @mock.patch('store.payments.PaystackAPI.verify_payment')
+    def test_pending_transaction_is_cached(self, verify_payment):
+        verify_payment.return_value = paystack_result('ref-1', 'ongoing', self.order.pk)
+        self.verify()
+        self.verify()
+        self.assertEqual(verify_payment.call_count, 1)
+
+    @mock.patch('store.payments.PaystackAPI.verify_payment')
+    @mock.patch('store.views.PaystackAPI.initialize_payment')
+    def test_new_checkout_after_a_failed_payment_can_complete(self, initialize_payment, verify_payment):
+        self.set_payment_status(Order.PAYMENT_FAILED)
+        initialize_payment.return_value = {'status': True, 'message': 'ok', 'data': {
+            'reference': 'ref-2', 'access_code': 'code', 'authorization_url': 'https://paystack.test/ref-2'}}
+        response = self.client.post(f'/store/orders/{self.order.pk}/initialize-payment/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, Order.PAYMENT_PENDING)
+
+        verify_payment.return_value = paystack_result('ref-2', 'success', self.order.pk)
+        self.assertEqual(self.verify('ref-2').status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, Order.PAYMENT_COMPLETED)
+
+    @mock.patch('store.payments.VERIFY_POLL_INTERVAL', 0.01)
+    @mock.patch('store.payments.PaystackAPI.verify_payment')
+    def test_waiting_poll_gets_the_uncached_result_of_the_call_in_flight(self, verify_payment):
+        key = payments._verify_cache_key('ref-1')
+        result = paystack_result('ref-1', 'failed', self.order.pk)
+        cache.set(f'{key}:lock', 1)
+        cache.set(f'{key}:shared', result)
+        self.assertEqual(payments.verify_reference('ref-1'), result)
+        verify_payment.assert_not_called()
+        self.assertIsNone(cache.get(key))
+
+
+@override_settings(PAYSTACK_ACCESS_CODE_TTL=600)
+@mock.patch('store.views.PaystackAPI.initialize_payment')
+class ReusableCheckoutTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='adoma', email='adoma@example.com', password='x')
+        self.order = Order.objects.create(
+            customer=self.user.customer, branch=Branch.objects.create(name='Accra'),
+            recipient_name='Adoma', recipient_number='0200000000', recipient_address='Accra', total=50)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def initialize(self, initialize_payment, **data):
+        initialize_payment.side_effect = lambda **kwargs: {
+            'status': True, 'message': 'Authorization URL created',
+            'data': {'reference': f'ref-{initialize_payment.call_count}',
+                     'access_code': f'code-{initialize_payment.call_count}',
+                     'authorization_url': f'https://checkout.paystack.com/code-{initialize_payment.call_count}'},
+        }
+        response = self.client.post(f'/store/orders/{self.order.pk}/initialize-payment/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['access_code']
+
+    def test_unchanged_order_reuses_its_checkout(self, initialize_payment):
+        self.assertEqual(self.initialize(initialize_payment), 'code-1')
+        Order.objects.filter(pk=self.order.pk).update(paystack_initialized_at=timezone.now() - timedelta(seconds=590))
+        self.assertEqual(self.initialize(initialize_payment), 'code-1')
+        self.assertEqual(initialize_payment.call_count, 1)
+
+    def test_new_total_starts_a_new_checkout(self, initialize_payment):
+        self.initialize(initialize_payment)
+        Order.objects.filter(pk=self.order.pk).update(total=60)
+        self.assertEqual(self.initialize(initialize_payment), 'code-2')
+        self.assertEqual(initialize_payment.call_args.kwargs['amount'], 60)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.paystack_access_code, self.order.paystack_amount), ('code-2', 60))
+
+    def test_expired_checkout_is_replaced(self, initialize_payment):
+        self.initialize(initialize_payment)
+        Order.objects.filter(pk=self.order.pk).update(paystack_initialized_at=timezone.now() - timedelta(seconds=600))
+        self.assertEqual(self.initialize(initialize_payment), 'code-2')
+
+    def test_new_callback_url_starts_a_new_checkout(self, initialize_payment):
+        self.initialize(initialize_payment, callback_url='https://shop.example.com/a')
+        self.assertEqual(self.initialize(initialize_payment, callback_url='https://shop.example.com/b'), 'code-2')
+
+
+class StubPaystack(ThreadingHTTPServer):
+    """
+    Local stand-in for the Paystack API. Answers every verify call with
+    ``transaction`` (a pending one by default), or with ``transactions[reference]``
+    when set (None for an unknown reference), and every initialize call with a
+    new checkout, after ``delay`` seconds. Responses take their HTTP status
+    from ``statuses`` in turn, then ``status``. Counts requests and client
+    connections, and records each request's method and arrival time and the
+    most requests handled at once.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0, status=200):
+        self.delay = delay
+        self.status = status
+        self.statuses = []
+        self.transaction = {'status': 'ongoing'}
+        self.transactions = {}
+        self.requests = 0
+        self.connections = 0
+        self.methods = []
+        self.arrivals = []
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+        super().__init__(('127.0.0.1', 0), StubPaystackHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubPaystackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def handle_request(self):
+        """Record the request, wait ``delay`` and return its status code."""
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.methods.append(self.command)
+            server.arrivals.append(time.monotonic())
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status_code = server.statuses.pop(0) if server.statuses else server.status
+        try:
+            time.sleep(server.delay)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        return status_code
+
+    def respond(self, status_code, body):
+        body = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        status_code = self.handle_request()
+        reference = self.path.rsplit('/', 1)[-1]
+        transaction = self.server.transactions.get(reference, self.server.transaction)
+        if transaction is None:
+            self.respond(400, {'status': False, 'message': 'Transaction reference not found'})
+            return
+        self.respond(status_code, {'status': True, 'message': 'Verification successful',
+                                   'data': {'reference': reference, **transaction}})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        status_code = self.handle_request()
+        reference = f'ref-{self.server.requests}'
+        self.respond(status_code, {'status': True, 'message': 'Authorization URL created', 'data': {
+            'reference': reference, 'access_code': f'code-{self.server.requests}',
+            'authorization_url': f'https://checkout.paystack.com/code-{self.server.requests}'}})
+
+    def log_message(self, *args):
+        pass
+
+
+class StubPaystackTestCase(TestCase):
+    """Points PaystackAPI at a fresh session and a StubPaystack server."""
+    stub_options = {}
+
+    def setUp(self):
+        cache.clear()
+        self.stub = StubPaystack(**self.stub_options)
+        self.addCleanup(self.stub.stop)
+        for name, value in (('_session', None), ('_circuit_breaker', None)):
+            patcher = mock.patch.object(paystack, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(paystack.PaystackAPI, 'BASE_URL', self.stub.url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class PaystackSessionTests(StubPaystackTestCase):
+    def test_calls_reuse_one_connection(self):
+        for reference in ('ref-1', 'ref-2', 'ref-3'):
+            self.assertEqual(paystack.PaystackAPI.verify_payment(reference)['data']['reference'], reference)
+        self.assertEqual((self.stub.requests, self.stub.connections), (3, 1))
+
+    @override_settings(PAYSTACK_POOL_SIZE=1, PAYSTACK_POOL_TIMEOUT=0.2)
+    def test_call_gives_up_when_no_pooled_connection_frees_up(self):
+        self.stub.delay = 1
+        first = threading.Thread(target=paystack.PaystackAPI.verify_payment, args=('ref-1',))
+        first.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        result = paystack.PaystackAPI.verify_payment('ref-2')
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertFalse(result['status'])
+        self.assertIn('Network error', result['message'])
+        first.join()
+
+    @override_settings(PAYSTACK_MAX_RETRIES=2, PAYSTACK_RETRY_BACKOFF=0.1)
+    def test_get_is_retried_with_backoff_on_server_errors(self):
+        self.stub.statuses = [503, 429]
+        result = paystack.PaystackAPI.verify_payment('ref-1')
+        self.assertEqual(result['data']['reference'], 'ref-1')
+        self.assertEqual(self.stub.methods, ['GET', 'GET', 'GET'])
+        # urllib3 retries the first failure at once, then waits backoff * 2.
+        first, second, third = self.stub.arrivals
+        self.assertGreaterEqual(third - second, 0.2 - 0.02)
+
+    @override_settings(PAYSTACK_MAX_RETRIES=2, PAYSTACK_RETRY_BACKOFF=0.1)
+    def test_get_gives_up_after_the_last_retry(self):
+        self.stub.status = 500
+        self.assertFalse(paystack.PaystackAPI.verify_payment('ref-1')['status'])
+        self.assertEqual(self.stub.requests, 3)
+
+    @override_settings(PAYSTACK_MAX_RETRIES=2, PAYSTACK_RETRY_BACKOFF=0.1)
+    def test_post_is_never_retried(self):
+        self.stub.statuses = [503, 429]
+        results = [paystack.PaystackAPI.initialize_payment('ama@example.com', 50, 1) for _ in range(3)]
+        # One request per call: each failure reaches the caller.
+        self.assertEqual([result['status'] for result in results], [False, False, True])
+        self.assertEqual(self.stub.methods, ['POST', 'POST', 'POST'])
+        self.assertEqual(results[-1]['data']['access_code'], 'code-3')
+
+    def test_bad_signature_is_rejected(self):
+        self.assertFalse(paystack.PaystackAPI.verify_webhook_signature(b'{}', 'not-hex'))
+        with self.assertLogs('store.paystack', 'ERROR'):
+            self.assertFalse(paystack.PaystackAPI.verify_webhook_signature(b'{}', None))
+
+
+@override_settings(PAYSTACK_MAX_RETRIES=0, PAYSTACK_CIRCUIT_FAILURE_THRESHOLD=2,
+                   PAYSTACK_CIRCUIT_SLOW_CALL=0.3, PAYSTACK_CIRCUIT_RESET_TIMEOUT=30)
+class CircuitBreakerTests(StubPaystackTestCase):
+    def verify(self):
+        return paystack.PaystackAPI.verify_payment('ref-1')
+
+    def test_server_errors_open_the_circuit(self):
+        self.stub.status = 500
+        with self.assertLogs('store.circuit_breaker', 'WARNING'):
+            for _ in range(2):
+                self.assertNotIn('retry_after', self.verify())
+        result = self.verify()
+        self.assertEqual(result['retry_after'], 30)
+        self.assertEqual(self.stub.requests, 2)
+        self.assertEqual(paystack.get_circuit_breaker().stats()['transitions']['open'], 1)
+
+    def test_slow_calls_open_the_circuit(self):
+        self.stub.delay = 0.4
+        with self.assertLogs('store.circuit_breaker', 'WARNING'):
+            for _ in range(2):
+                self.assertEqual(self.verify()['data']['status'], 'ongoing')
+        self.assertIn('retry_after', self.verify())
+        self.assertEqual(self.stub.requests, 2)
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.stub.status = 500
+        with self.assertLogs('store.circuit_breaker', 'WARNING'):
+            for _ in range(2):
+                self.verify()
+        breaker = paystack.get_circuit_breaker()
+        cache.set(breaker.opened_key, time.time() - 31, None)
+        self.stub.status = 200
+        with self.assertLogs('store.circuit_breaker', 'INFO'):
+            self.assertEqual(self.verify()['data']['status'], 'ongoing')
+        self.assertEqual(breaker.state(), 'closed')
+        self.assertEqual(self.stub.requests, 3)
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in checks.check_circuit_breaker_cache(None)], ['store.W001'])
+
+
+class OneVerifyPerMinute(UserRateThrottle):
+    rate = '1/min'
+
+
+class AsyncPaymentViewTests(StubPaystackTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username='kofi', email='kofi@example.com', password='x')
+        self.order = Order.objects.create(
+            customer=self.user.customer, branch=Branch.objects.create(name='Accra'),
+            recipient_name='Kofi', recipient_number='0200000000', recipient_address='Accra',
+            total=50, paystack_ref='ref-1')
+        self.factory = AsyncRequestFactory()
+
+    async def verify(self, user=None):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+        request = self.factory.get('/store/payments/verify/', {'reference': 'ref-1'}, headers=headers)
+        return await views.AsyncVerifyPaymentView.as_view()(request)
+
+    async def test_verify_requires_authentication(self):
+        response = await self.verify()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.requests, 0)
+
+    async def test_verified_payment_completes_the_order(self):
+        self.stub.transaction = {'status': 'success', 'amount': 5000, 'metadata': {'order_id': self.order.pk}}
+        response = await self.verify(self.user)
+        self.assertEqual(response.status_code, 200)
+        await self.order.arefresh_from_db()
+        self.assertEqual(self.order.payment_status, Order.PAYMENT_COMPLETED)
+
+    @mock.patch.object(views.AsyncVerifyPaymentView, 'throttle_classes', [OneVerifyPerMinute])
+    async def test_verify_is_throttled(self):
+        self.assertEqual((await self.verify(self.user)).status_code, 400)
+        self.assertEqual((await self.verify(self.user)).status_code, 429)
+        self.assertEqual(self.stub.requests, 1)
+
+    async def test_webhook_needs_no_credentials(self):
+        request = self.factory.post('/store/payments/webhook/', b'{}', content_type='application/json',
+                                    headers={'X-Paystack-Signature': 'not-hex'})
+        response = await views.AsyncPaystackWebhookView.as_view()(request)
+        self.assertEqual((response.status_code, response.data), (400, {'error': 'Invalid signature'}))
+
+
+class ReconciliationTests(StubPaystackTestCase):
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_user(username='esi', email='esi@example.com', password='x')
+        self.branch = Branch.objects.create(name='Accra')
+        self.customer = user.customer
+
+    def add_order(self, reference, transaction_status=None, age=timedelta(hours=1), **data):
+        order = Order.objects.create(
+            customer=self.customer, branch=self.branch, recipient_name='Esi', recipient_number='0200000000',
+            recipient_address='Accra', total=50, paystack_ref=reference,
+            paystack_initialized_at=timezone.now() - age)
+        if transaction_status:
+            transaction = paystack_result(reference, transaction_status, order.pk)['data']
+            transaction.update(data)
+            self.stub.transactions[reference] = transaction
+        else:
+            self.stub.transactions[reference] = None
+        return order
+
+    def reconcile(self, **kwargs):
+        return reconciliation.reconcile_pending_orders(**{'rate': 0, **kwargs})
+
+    def statuses(self):
+        return dict(Order.objects.values_list('paystack_ref', 'payment_status'))
+
+    def test_orders_are_settled_from_paystack(self):
+        self.add_order('paid', 'success')
+        self.add_order('declined', 'failed')
+        self.add_order('ongoing', 'ongoing')
+        self.add_order('underpaid', 'success', amount=4000)
+        self.add_order('other-order', 'success', metadata={'order_id': 0})
+        self.add_order('unknown')
+
+        summary = self.reconcile(batch_size=4)
+        self.assertEqual(dict(summary), {'checked': 6, 'completed': 1, 'failed': 1, 'still_pending': 1,
+                                         'mismatched': 2, 'errors': 1})
+        self.assertEqual(self.statuses(), {
+            'paid': Order.PAYMENT_COMPLETED, 'declined': Order.PAYMENT_FAILED, 'ongoing': Order.PAYMENT_PENDING,
+            'underpaid': Order.PAYMENT_PENDING, 'other-order': Order.PAYMENT_PENDING,
+            'unknown': Order.PAYMENT_PENDING})
+        order = Order.objects.get(paystack_ref='paid')
+        self.assertEqual(list(OutboxEmail.objects.filter(key__contains=':confirmation:payment:')
+                              .values_list('key', flat=True)), [f'order:{order.pk}:confirmation:payment:paid'])
+
+    def test_recent_orders_and_dry_runs_are_left_alone(self):
+        self.add_order('recent', 'success', age=timedelta(minutes=5))
+        self.add_order('paid', 'success')
+        summary = self.reconcile(dry_run=True)
+        self.assertEqual((summary['checked'], summary['completed']), (1, 1))
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(set(self.statuses().values()), {Order.PAYMENT_PENDING})
+
+    def test_limit_caps_the_orders_checked(self):
+        for n in range(3):
+            self.add_order(f'ref-{n}', 'ongoing')
+        self.assertEqual(self.reconcile(batch_size=2, limit=3)['checked'], 3)
+        self.assertEqual(self.reconcile(limit=2)['checked'], 2)
+
+    def test_workers_bound_the_concurrent_calls_and_share_connections(self):
+        self.stub.delay = 0.1
+        for n in range(6):
+            self.add_order(f'ref-{n}', 'ongoing')
+        self.assertEqual(self.reconcile(workers=2)['checked'], 6)
+        self.assertEqual(self.stub.max_in_flight, 2)
+        self.assertLessEqual(self.stub.connections, 2)
+
+    def test_rate_spaces_the_calls(self):
+        for n in range(4):
+            self.add_order(f'ref-{n}', 'ongoing')
+        self.reconcile(workers=4, rate=20)
+        arrivals = sorted(self.stub.arrivals)
+        self.assertEqual(len(arrivals), 4)
+        # 20 calls per second: 50 ms apart, with some slack for scheduling.
+        self.assertGreaterEqual(arrivals[-1] - arrivals[0], 3 * 0.05 - 0.02)
+
+    def test_order_settled_meanwhile_is_not_confirmed_again(self):
+        order = self.add_order('paid', 'success')
+        Order.objects.filter(pk=order.pk).update(payment_status=Order.PAYMENT_COMPLETED)
+        reconciliation._apply({order.pk: reconciliation.COMPLETED})
+        self.assertFalse(OutboxEmail.objects.filter(key__contains=':confirmation:payment:').exists())
+
+
+class PaystackEventTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='yaw', email='yaw@example.com', password='x')
+        branch = Branch.objects.create(name='Accra')
+        self.orders = [
+            Order.objects.create(customer=user.customer, branch=branch, recipient_name='Yaw',
+                                 recipient_number='0200000000', recipient_address='Accra', total=50)
+            for _ in range(2)
+        ]
+
+    def add_event(self, event, order, reference):
+        return PaystackEvent.objects.create(
+            key=f'{event}:{reference}', event=event, reference=reference,
+            payload={'event': event, 'data': {'reference': reference, 'status': event.split('.')[1],
+                                              'metadata': {'order_id': order.pk}}})
+
+    def payment_statuses(self):
+        return [Order.objects.get(pk=order.pk).payment_status for order in self.orders]
+
+    def test_failed_event_holds_back_later_events_for_its_reference(self):
+        first = self.add_event('charge.success', self.orders[0], 'ref-a')
+        self.add_event('charge.failed', self.orders[0], 'ref-a')
+        self.add_event('charge.success', self.orders[1], 'ref-b')
+
+        apply = payments.apply_webhook_event
+        attempts = []
+
+        def fail_once(payload):
+            if not attempts:
+                attempts.append(payload)
+                raise ConnectionError('database went away')
+            return apply(payload)
+
+        with mock.patch('store.payments.apply_webhook_event', side_effect=fail_once):
+            self.assertEqual(payments.process_paystack_events(), (1, 0))
+        self.assertEqual(self.payment_statuses(), [Order.PAYMENT_PENDING, Order.PAYMENT_COMPLETED])
+
+        PaystackEvent.objects.filter(pk=first.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(payments.process_paystack_events(), (2, 0))
+        self.assertEqual(self.payment_statuses(), [Order.PAYMENT_COMPLETED, Order.PAYMENT_COMPLETED])
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='efua', password='x')
+        self.cart = Cart.objects.create(user=user)
+        product = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                         collection=Collection.objects.create(name='Cakes'))
+        self.small, self.medium = [
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1, selected_size=size)
+            for size in ('S', 'M')
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def batch(self, *operations):
+        return self.client.post(f'/store/carts/{self.cart.pk}/items/batch/', {'operations': operations},
+                                format='json')
+
+    def sizes(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('pk', 'selected_size'))
+
+    def test_changing_the_size_keeps_the_item(self):
+        response = self.batch({'op': OP_UPDATE, 'id': self.small.pk, 'selected_size': 'L'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sizes(), {self.small.pk: 'L', self.medium.pk: 'M'})
+
+    def test_items_can_swap_sizes(self):
+        response = self.batch(
+            {'op': OP_UPDATE, 'id': self.small.pk, 'selected_size': 'L'},
+            {'op': OP_UPDATE, 'id': self.medium.pk, 'selected_size': 'S'},
+            {'op': OP_UPDATE, 'id': self.small.pk, 'selected_size': 'M'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.sizes().values()), ['M', 'S'])
+
+    def test_patch_onto_another_line_merges_them_in_every_store(self):
+        stores = (DatabaseCartStore(), RedisCartStore(client=fakeredis.FakeRedis(server=fakeredis.FakeServer())))
+        for store in stores:
+            with self.subTest(store=type(store).__name__), \
+                    mock.patch('store.views.get_cart_store', return_value=store), \
+                    mock.patch('store.serializers.get_cart_store', return_value=store):
+                response = self.client.patch(f'/store/carts/{self.cart.pk}/items/{self.small.pk}/',
+                                             {'selected_size': 'M'}, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((response.data['quantity'], response.data['selected_size']), (2, 'M'))
+                store.flush(self.cart.pk)
+                self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('pk', 'quantity')),
+                                 [(self.medium.pk, 2)])
+            # Put the small line back for the next store.
+            self.small.save(force_insert=True)
+            CartItem.objects.filter(pk=self.medium.pk).update(quantity=1)
+
+    def test_update_cannot_change_the_product(self):
+        response = self.batch({'op': OP_UPDATE, 'id': self.small.pk, 'product_id': self.small.product_id})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data['operations'][0])
+
+    def test_sizes_longer_than_the_column_are_rejected(self):
+        response = self.client.post(f'/store/carts/{self.cart.pk}/items/', {
+            'product_id': self.small.product_id, 'quantity': 1, 'selected_size': 'X' * 51}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('selected_size', response.data)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+
+    def test_add_checks_upsert_support_on_the_queryset_database(self):
+        add = CartItem.objects.add_or_increment
+        for supported in (True, False):
+            with self.subTest(supported=supported), mock.patch(
+                    'store.models._supports_upsert_returning', return_value=supported) as supports:
+                item = add(self.cart.pk, self.cart.user_id, self.small.product_id, 2, selected_size='S')
+                supports.assert_called_once_with(connections['default'])
+            self.assertEqual(item.pk, self.small.pk)
+        self.assertEqual(CartItem.objects.get(pk=self.small.pk).quantity, 5)
+        self.assertIsNone(add(self.cart.pk, self.cart.user_id + 1, self.small.product_id, 1))
+
+
+class RedisCartStoreTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='kofi', email='kofi@example.com', password='x')
+        self.cart = Cart.objects.create(user=self.user)
+        self.bread, self.cake = [
+            Product.objects.create(name=name, description=name, price=10, is_available=True,
+                                   collection=Collection.objects.create(name='Bakery'))
+            for name in ('Bread', 'Cake')
+        ]
+        self.saved = CartItem.objects.create(cart=self.cart, product=self.bread, quantity=1)
+        self.store = RedisCartStore(client=fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+
+    def rows(self):
+        return {item.pk: (item.product_id, item.quantity, item.selected_size)
+                for item in CartItem.objects.filter(cart=self.cart)}
+
+    def test_flush_keeps_item_ids(self):
+        self.store.apply_operations(self.cart.pk, self.user.pk, [
+            {'op': OP_UPDATE, 'id': self.saved.pk, 'quantity': 3, 'selected_size': 'Large'},
+        ])
+        added = self.store.add_item(self.cart.pk, self.user.pk, self.cake.pk, 2)
+        self.assertLess(added.pk, 0)
+
+        self.store.flush(self.cart.pk)
+        rows = self.rows()
+        self.assertEqual(rows[self.saved.pk], (self.bread.pk, 3, 'Large'))
+        [new_id] = set(rows) - {self.saved.pk}
+        self.assertEqual(rows[new_id], (self.cake.pk, 2, ''))
+        self.assertEqual([item.pk for item in self.store._read_items(str(self.cart.pk))], [self.saved.pk, new_id])
+
+        # The id handed out before the flush still finds the line.
+        self.store.apply_operations(self.cart.pk, self.user.pk, [{'op': OP_UPDATE, 'id': added.pk, 'quantity': 5}])
+        self.store.flush(self.cart.pk)
+        self.assertEqual(self.rows()[new_id], (self.cake.pk, 5, ''))
+
+    def test_change_during_flush_keeps_cart_dirty_until_saved(self):
+        self.store.add_item(self.cart.pk, self.user.pk, self.bread.pk, 1)
+        save_items = self.store._save_items
+        changed = []
+
+        def save_then_change(cart_id, items):
+            renumbered = save_items(cart_id, items)
+            if not changed:
+                changed.append(self.store.add_item(self.cart.pk, self.user.pk, self.cake.pk, 4))
+            return renumbered
+
+        with mock.patch.object(self.store, '_save_items', side_effect=save_then_change):
+            self.store.flush(self.cart.pk)
+
+        self.assertEqual(sorted(self.rows().values()), [(self.bread.pk, 2, ''), (self.cake.pk, 4, '')])
+        self.assertFalse(self.store.redis.sismember(self.store._dirty_key, str(self.cart.pk)))
+
+    def test_adding_to_an_existing_line_does_not_query_the_database(self):
+        self.store.add_item(self.cart.pk, self.user.pk, self.bread.pk, 1)
+        with self.assertNumQueries(0):
+            item = self.store.add_item(self.cart.pk, self.user.pk, self.bread.pk, 1)
+        self.assertEqual((item.pk, item.quantity), (self.saved.pk, 3))
+
+    def test_adding_an_unknown_product_adds_nothing(self):
+        self.assertIsNone(self.store.add_item(self.cart.pk, self.user.pk, 9999, 1))
+        self.assertEqual([item.pk for item in self.store._read_items(str(self.cart.pk))], [self.saved.pk])
+
+    def check_out(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch('store.serializers.get_cart_store', return_value=self.store):
+            return client.post('/store/orders/', {
+                'cart_id': str(self.cart.pk), 'recipient_name': 'Kofi', 'recipient_number': '0200000000',
+                'recipient_address': 'Accra', 'branch': Branch.objects.create(name='Accra').pk,
+            }, format='json')
+
+    def test_checkout_writes_the_cart_back_first(self):
+        self.store.add_item(self.cart.pk, self.user.pk, self.cake.pk, 2)
+        response = self.check_out(self.user)
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(sorted(order.items.values_list('product_id', 'quantity')),
+                         [(self.bread.pk, 1), (self.cake.pk, 2)])
+        self.assertFalse(Cart.objects.filter(pk=self.cart.pk).exists())
+
+    def test_failed_checkout_leaves_the_written_back_cart_consistent(self):
+        self.store.add_item(self.cart.pk, self.user.pk, self.cake.pk, 2)
+        with mock.patch('store.serializers.OrderItem.objects.bulk_create', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.check_out(self.user)
+        self.assertFalse(Order.objects.exists())
+        # The write-back was committed before the checkout started, so Redis and
+        # the database agree on the lines and their ids.
+        self.assertFalse(self.store.redis.sismember(self.store._dirty_key, str(self.cart.pk)))
+        self.assertEqual({item.pk: item.quantity for item in self.store._read_items(str(self.cart.pk))},
+                         {pk: quantity for pk, (_, quantity, _) in self.rows().items()})
+
+    def test_checkout_refuses_another_users_cart(self):
+        self.store.add_item(self.cart.pk, self.user.pk, self.cake.pk, 2)
+        other = get_user_model().objects.create_user(username='abena', email='abena@example.com', password='x')
+        response = self.check_out(other)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cart_id', response.data)
+        self.assertFalse(Order.objects.exists())
+        # Nothing was written back on the other user's behalf.
+        self.assertEqual(list(self.rows()), [self.saved.pk])
+        self.assertTrue(self.store.redis.sismember(self.store._dirty_key, str(self.cart.pk)))
+
+
+class ReapCartsTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                              collection=Collection.objects.create(name='Cakes'))
+        self.users = [get_user_model().objects.create_user(username=f'user{n}', email=f'user{n}@example.com',
+                                                           password='x') for n in range(3)]
+
+    def cart(self, user, idle_days):
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=idle_days))
+        return cart
+
+    def reap(self, **options):
+        out = StringIO()
+        call_command('reap_carts', stdout=out, **options)
+        return out.getvalue()
+
+    def test_only_idle_carts_are_deleted(self):
+        idle = self.cart(self.users[0], idle_days=45)
+        recent = self.cart(self.users[1], idle_days=5)
+        # Old, but an item was added today.
+        touched = self.cart(self.users[2], idle_days=45)
+        DatabaseCartStore().add_item(touched.pk, self.users[2].pk, self.product.pk, 1)
+
+        output = self.reap(days=30, batch_size=1)
+        self.assertIn('Reclaimed 1 carts and 1 cart items', output)
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {recent.pk, touched.pk})
+        self.assertFalse(CartItem.objects.filter(cart_id=idle.pk).exists())
+
+    def test_checked_out_carts_leave_their_orders_alone(self):
+        cart = self.cart(self.users[0], idle_days=45)
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.pk), 'recipient_name': 'Ama', 'recipient_number': '0200000000',
+            'recipient_address': 'Accra', 'branch': Branch.objects.create(name='Accra').pk,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        self.assertIn('Reclaimed 0 carts and 0 cart items', self.reap(days=30))
+        order = Order.objects.get()
+        self.assertEqual(list(order.items.values_list('product_id', 'quantity')), [(self.product.pk, 1)])
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username='akua', email='akua@example.com', password='x')
+        product = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                         collection=Collection.objects.create(name='Cakes'))
+        self.order = Order.objects.create(
+            customer=user.customer, branch=Branch.objects.create(name='Accra'), recipient_name='Akua',
+            recipient_number='0200000000', recipient_address='Accra', payment_status=Order.PAYMENT_COMPLETED)
+        self.items = [
+            OrderItem.objects.create(order=self.order, product=product, quantity=2, price_at_purchase=10),
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price_at_purchase=15,
+                                     with_customization=True, customization_price_at_purchase=5),
+            # Not customized: its captured customization price does not count.
+            OrderItem.objects.create(order=self.order, product=product, quantity=1, price_at_purchase=12,
+                                     customization_price_at_purchase=5),
+        ]
+
+    def totals(self):
+        self.order.refresh_from_db()
+        return self.order.subtotal, self.order.customization_total, self.order.total
+
+    def test_migration_fills_in_zero_totals(self):
+        migration = import_module('store.migrations.0028_backfill_order_totals')
+        migration.backfill_totals(django_apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.totals(), (47, 5, 52))
+
+    def test_command_recomputes_stale_totals_only_with_all(self):
+        Order.objects.filter(pk=self.order.pk).update(subtotal=1, total=1)
+        call_command('backfill_order_totals', stdout=StringIO())
+        self.assertEqual(self.totals(), (1, 0, 1))
+        call_command('backfill_order_totals', '--all', stdout=StringIO())
+        self.assertEqual(self.totals(), (47, 5, 52))
+
+    def test_removing_an_item_in_the_admin_recomputes_the_total(self):
+        admin = get_user_model().objects.create_superuser(username='admin', email='admin@example.com', password='x')
+        self.client.force_login(admin)
+        data = {
+            'recipient_name': 'Akua', 'recipient_number': '0200000000', 'recipient_address': 'Accra',
+            'status': Order.STATUS_PENDING, 'branch': self.order.branch_id, 'secret_message': '',
+            'delivery_date': '', 'delivery_time': '',
+            'items-TOTAL_FORMS': 3, 'items-INITIAL_FORMS': 3, 'items-MIN_NUM_FORMS': 0, 'items-MAX_NUM_FORMS': 1000,
+        }
+        for n, item in enumerate(self.items):
+            data.update({f'items-{n}-id': item.pk, f'items-{n}-order': self.order.pk})
+        data['items-1-DELETE'] = 'on'
+        response = self.client.post(f'/admin/store/order/{self.order.pk}/change/', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(), (32, 0, 32))
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='adwoa', email='adwoa@example.com', password='x')
+        self.branch = Branch.objects.create(name='Accra')
+        self.collection = Collection.objects.create(name='Cakes')
+
+    def cart(self, lines):
+        cart = Cart.objects.create(user=self.user)
+        for n in range(lines):
+            product = Product.objects.create(name=f'Cake {n}', description='cake', price=10, is_available=True,
+                                             collection=self.collection, has_size_options=True)
+            ProductSize.objects.create(product=product, size_name='Large', price=15)
+            CartItem.objects.create(cart=cart, product=product, quantity=1, selected_size='Large')
+        return cart
+
+    def serializer(self, cart):
+        serializer = CreateOrderSerializer(data={
+            'cart_id': str(cart.pk), 'recipient_name': 'Adwoa', 'recipient_number': '0200000000',
+            'recipient_address': 'Accra', 'branch': self.branch.pk,
+        }, context={'user_id': self.user.pk})
+        serializer.is_valid(raise_exception=True)
+        return serializer
+
+    def test_checkout_statements_do_not_depend_on_the_cart_size(self):
+        for lines in (1, 20):
+            serializer = self.serializer(self.cart(lines))
+            with self.subTest(lines=lines), CaptureQueriesContext(connection) as queries:
+                order = serializer.save()
+            statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+            self.assertEqual(len(statements), 9, statements)
+            self.assertEqual(order.total, 15 * lines)
+
+    def test_second_checkout_of_the_same_cart_is_rejected(self):
+        cart = self.cart(2)
+        # Both requests got past validation before either one checked out.
+        first, second = self.serializer(cart), self.serializer(cart)
+        first.save()
+        with self.assertRaises(ValidationError) as raised:
+            second.save()
+        self.assertIn('cart_id', raised.exception.detail)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            username='abena', email='abena@example.com', password='x', first_name='Abena')
+        collection = Collection.objects.create(name='Cakes')
+        self.cake = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                           collection=collection, has_size_options=True,
+                                           is_customizable=True, customization_price=5)
+        ProductSize.objects.create(product=self.cake, size_name='Large', price=15)
+        # Customization was asked for, but this product does not offer it.
+        self.bread = Product.objects.create(name='Bread', description='bread', price=4, is_available=True,
+                                            collection=collection, customization_price=3)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.cake, quantity=2, selected_size='Large',
+                                with_customization=True)
+        CartItem.objects.create(cart=self.cart, product=self.bread, quantity=3, with_customization=True)
+
+    def check_out(self):
+        serializer = CreateOrderSerializer(data={
+            'cart_id': str(self.cart.pk), 'recipient_name': 'Abena', 'recipient_number': '0200000000',
+            'recipient_address': 'Accra', 'branch': Branch.objects.create(name='Accra').pk,
+        }, context={'user_id': self.user.pk})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_cart_prices_sizes_and_customization(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/store/carts/{self.cart.pk}/')
+        self.assertEqual(response.status_code, 200)
+        totals = {item['product']['name']: item['total_price'] for item in response.data['items']}
+        self.assertEqual(totals, {'Cake': 40, 'Bread': 12})
+        self.assertEqual(response.data['total_price'], 52)
+
+    def test_checkout_stores_the_prices_it_charged(self):
+        order = self.check_out()
+        self.assertEqual((order.subtotal, order.customization_total, order.total), (42, 10, 52))
+        items = {item.product_id: item for item in order.items.all()}
+        self.assertEqual((items[self.cake.pk].price_at_purchase,
+                          items[self.cake.pk].customization_price_at_purchase), (15, 5))
+        self.assertEqual((items[self.bread.pk].price_at_purchase,
+                          items[self.bread.pk].customization_price_at_purchase), (4, 0))
+
+    def test_order_email_matches_the_checkout(self):
+        order = self.check_out()
+        OutboxEmail.objects.all().delete()
+        mail.outbox = []
+        queue_order_confirmation(order.pk, 'payment:ref-1')
+        deliver_outbox_emails()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, f'Your Simply Organice Order #{order.pk} is Confirmed!')
+        for amount in ('40.00', '12.00', '52.00'):
+            self.assertIn(f'GH₵{amount}', mail.outbox[0].body)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='akua', email='akua@example.com', password='x')
+        product = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                         collection=Collection.objects.create(name='Cakes'))
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+        self.branch = Branch.objects.create(name='Accra')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def check_out(self, key, **data):
+        data = {'cart_id': str(self.cart.pk), 'recipient_name': 'Akua', 'recipient_number': '0200000000',
+                'recipient_address': 'Accra', 'branch': self.branch.pk, **data}
+        return self.client.post('/store/orders/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_gets_the_stored_response(self):
+        first = self.check_out('key-1')
+        retry = self.check_out('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.data), (201, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_a_different_body_is_rejected(self):
+        self.check_out('key-1')
+        response = self.check_out('key-1', recipient_name='Someone else')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retry_while_the_first_request_runs_is_a_conflict(self):
+        save = CreateOrderSerializer.save
+        retries = []
+
+        def retry_then_save(serializer):
+            retries.append(self.check_out('key-1'))
+            return save(serializer)
+
+        with mock.patch.object(CreateOrderSerializer, 'save', retry_then_save):
+            first = self.check_out('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retries[0].status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_client_errors_are_replayed(self):
+        first = self.check_out('key-1', branch=None)
+        retry = self.check_out('key-1', branch=None)
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual((retry.status_code, retry.data), (400, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_server_error_releases_the_key(self):
+        with mock.patch.object(CreateOrderSerializer, 'save', side_effect=RuntimeError('database went away')):
+            with self.assertRaises(RuntimeError):
+                self.check_out('key-1')
+        response = self.check_out('key-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in checks.check_idempotency_cache(None)], ['store.W002'])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_one_of_two_concurrent_checkouts_wins(self):
+        user = get_user_model().objects.create_user(username='adjoa', email='adjoa@example.com', password='x')
+        product = Product.objects.create(name='Cake', description='cake', price=10, is_available=True,
+                                         collection=Collection.objects.create(name='Cakes'))
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, quantity=1)
+        branch = Branch.objects.create(name='Accra')
+        barrier = threading.Barrier(2)
+        statuses = []
+
+        def check_out():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                statuses.append(client.post('/store/orders/', {
+                    'cart_id': str(cart.pk), 'recipient_name': 'Adjoa', 'recipient_number': '0200000000',
+                    'recipient_address': 'Accra', 'branch': branch.pk,
+                }, format='json').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=check_out) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [201, 400])
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class QueryCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='esi', email='esi@example.com', password='x')
+        self.collection = Collection.objects.create(name='Cakes')
+        self.branch = Branch.objects.create(name='Accra')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def product(self, n):
+        product = Product.objects.create(name=f'Cake {n}', description='cake', price=10, is_available=True,
+                                         collection=self.collection, has_size_options=True)
+        ProductSize.objects.create(product=product, size_name='Large', price=15)
+        ProductSize.objects.create(product=product, size_name='Small', price=8)
+        return product
+
+    def cart(self, lines):
+        cart = Cart.objects.create(user=self.user)
+        for n in range(lines):
+            CartItem.objects.create(cart=cart, product=self.product(n), quantity=1, selected_size='Large')
+        return cart
+
+    def orders(self, count):
+        Order.objects.all().delete()
+        for n in range(count):
+            order = Order.objects.create(customer=self.user.customer, branch=self.branch, recipient_name='Esi',
+                                         recipient_number='0200000000', recipient_address='Accra', total=15)
+            OrderItem.objects.create(order=order, product=self.product(n), quantity=1, price_at_purchase=15,
+                                     selected_size='Large')
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_cart_queries_do_not_depend_on_the_number_of_lines(self):
+        small = self.queries(f'/store/carts/{self.cart(2).pk}/')
+        large = self.cart(20)
+        with self.assertNumQueries(small):
+            response = self.client.get(f'/store/carts/{large.pk}/')
+        self.assertEqual(len(response.data['items']), 20)
+
+    def test_order_history_queries_do_not_depend_on_the_number_of_orders(self):
+        self.orders(1)
+        single = self.queries('/store/orders/')
+        self.orders(50)
+        with self.assertNumQueries(single):
+            response = self.client.get('/store/orders/')
+        self.assertEqual(len(response.data), 50)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='yaa', email='yaa@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        """Follow next links from the first page, then previous links back."""
+        response = self.client.get(url, params)
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        forward = [row['id'] for page in pages for row in page['results']]
+        back = [pages[-1]]
+        while back[-1]['previous']:
+            back.append(self.client.get(back[-1]['previous']).data)
+        backward = [row['id'] for page in reversed(back) for row in page['results']]
+        return forward, backward, len(pages)
+
+    def test_products_page_through_ties_on_price(self):
+        collection = Collection.objects.create(name='Cakes')
+        for n in range(25):
+            Product.objects.create(name=f'Cake {n}', description='cake', price=10 if n % 5 else 20,
+                                   is_available=True, collection=collection)
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            forward, backward, pages = self.walk('/store/products/', {'pagination': 'cursor'})
+        self.assertEqual((forward, backward, pages), (expected, expected, 3))
+        # Every page seeks on (price, id); none skips rows with an OFFSET.
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'OFFSET' in q['sql']])
+
+    def test_orders_page_through_orders_placed_at_the_same_time(self):
+        branch = Branch.objects.create(name='Accra')
+        for _ in range(15):
+            Order.objects.create(customer=self.user.customer, branch=branch, recipient_name='Yaa',
+                                 recipient_number='0200000000', recipient_address='Accra', total=10)
+        Order.objects.update(created_at=timezone.now())
+        expected = list(Order.objects.order_by('-id').values_list('id', flat=True))
+
+        forward, backward, pages = self.walk('/store/orders/', {'pagination': 'cursor'})
+        self.assertEqual((forward, backward, pages), (expected, expected, 2))
+
+    def test_malformed_cursor_is_not_found(self):
+        response = self.client.get('/store/products/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cakes = Collection.objects.create(name='Cakes')
+        self.breads = Collection.objects.create(name='Breads')
+        for price, collection, customizable in ((0, self.cakes, True), (49.99, self.cakes, True),
+                                                (50, self.cakes, False), (100, self.breads, False),
+                                                (499.99, self.breads, False), (500, self.breads, True),
+                                                (1000, self.cakes, False)):
+            Product.objects.create(name='Cake', description='cake', price=price, is_available=True,
+                                   collection=collection, is_customizable=customizable)
+        self.client = APIClient()
+
+    def facets(self, **params):
+        response = self.client.get('/store/products/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def bucket_counts(self, facets):
+        return {bucket['label']: bucket['count'] for bucket in facets['price_buckets']}
+
+    def test_boundaries_start_the_next_bucket(self):
+        facets = self.facets()
+        self.assertEqual(facets['count'], 7)
+        self.assertEqual(self.bucket_counts(facets),
+                         {'0-50': 2, '50-100': 1, '100-200': 1, '200-500': 1, '500+': 2})
+        self.assertEqual(facets['price_buckets'][-1], {'label': '500+', 'min': 500, 'max': None, 'count': 2})
+
+    @override_settings(CATALOG_PRICE_BUCKETS=[100])
+    def test_buckets_follow_the_setting(self):
+        self.assertEqual(self.bucket_counts(self.facets()), {'0-100': 3, '100+': 4})
+
+    def test_counts_follow_the_active_filters(self):
+        facets = self.facets(collection_id=self.cakes.pk, price__gt=0)
+        self.assertEqual(facets['count'], 3)
+        self.assertEqual(facets['collections'], [{'id': self.cakes.pk, 'name': 'Cakes', 'count': 3}])
+        self.assertEqual(self.bucket_counts(facets),
+                         {'0-50': 1, '50-100': 1, '100-200': 0, '200-500': 0, '500+': 1})
+        self.assertEqual(facets['is_customizable'], {'true': 1, 'false': 2})
+        self.assertEqual(facets['has_size_options'], {'true': 0, 'false': 3})
+
+    def test_facets_take_one_query(self):
+        with self.assertNumQueries(1):
+            self.facets(price__lt=500)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='afia', email='afia@example.com', password='x')
+        collection = Collection.objects.create(name='Cakes')
+        for n in range(3):
+            self.product = Product.objects.create(name=f'Cake {n}', description='cake', price=10,
+                                                  is_available=True, collection=collection)
+            ProductSize.objects.create(product=self.product, size_name='Large', price=15)
+        order = Order.objects.create(customer=self.user.customer, branch=Branch.objects.create(name='Accra'),
+                                     recipient_name='Afia', recipient_number='0200000000',
+                                     recipient_address='Accra', total=10)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price_at_purchase=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def products(self, **params):
+        response = self.client.get('/store/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_fields_keep_only_the_named_fields(self):
+        self.assertEqual(set(self.products(fields='id,name')[0]), {'id', 'name'})
+
+    def test_optional_fields_are_only_rendered_on_request(self):
+        self.assertNotIn('image', self.products()[0])
+        product = self.products(fields='id,image')[0]
+        self.assertEqual(set(product), {'id', 'image'})
+        self.assertIsNone(product['image'])
+
+    def test_unknown_field_names_are_ignored(self):
+        self.assertEqual(set(self.products(fields='id,bogus')[0]), {'id'})
+        self.assertEqual(set(self.products(expand='bogus')[0]), set(self.products()[0]) - {'images', 'sizes'})
+
+    def test_expand_nests_only_the_named_relations(self):
+        product = self.products(expand='sizes')[0]
+        self.assertNotIn('images', product)
+        self.assertEqual([size['size_name'] for size in product['sizes']], ['Large'])
+
+    def test_unexpanded_relations_render_as_their_key(self):
+        response = self.client.get('/store/orders/', {'fields': 'id,items'})
+        self.assertEqual(set(response.data[0]), {'id', 'items'})
+        self.assertEqual(response.data[0]['items'][0]['product'], self.product.pk)
+
+        response = self.client.get('/store/orders/', {'fields': 'id,items', 'expand': 'product'})
+        self.assertEqual(response.data[0]['items'][0]['product']['name'], self.product.name)
+
+    def test_sparse_list_loads_only_the_named_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.products(fields='id,name')
+        statements = [q['sql'] for q in queries.captured_queries]
+        # The page count and the page itself: no size, image or collection lookups.
+        self.assertEqual(len(statements), 2, statements)
+        self.assertNotIn('"description"', statements[-1])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cakes = Collection.objects.create(name='Cakes')
+        breads = Collection.objects.create(name='Breads')
+        self.sponge = Product.objects.create(name='Vanilla sponge', description='With a chocolate drizzle',
+                                             price=5, is_available=True, collection=self.cakes)
+        self.cake = Product.objects.create(name='Chocolate cake', description='Rich and dark',
+                                           price=30, is_available=True, collection=self.cakes)
+        Product.objects.create(name='Chocolate bread', description='Sweet loaf', price=12,
+                               is_available=True, collection=breads)
+        self.client = APIClient()
+
+    def search(self, **params):
+        response = self.client.get('/store/products/', {'search': 'chocolate', **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.data['results']]
+
+    def test_filters_apply_to_ranked_matches(self):
+        self.assertEqual(self.search(collection_id=self.cakes.pk), [self.cake.pk, self.sponge.pk])
+
+    def test_cursor_pages_keep_relevance_order(self):
+        self.assertEqual(self.search(collection_id=self.cakes.pk, pagination='cursor'),
+                         [self.cake.pk, self.sponge.pk])
+        self.assertEqual(self.search(collection_id=self.cakes.pk, pagination='cursor', ordering='price'),
+                         [self.sponge.pk, self.cake.pk])
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested import routers
 from . import views
@@ -13,22 +14,34 @@ router.register('branches', views.BranchViewSet, basename='branches')
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register('images', views.ProductImageViewSet, basename='product-images')
 
+collections_router = routers.NestedDefaultRouter(router, 'collections', lookup='collection')
+collections_router.register('products', views.CollectionProductViewSet, basename='collection-products')
+
 carts_router = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
+# Under ASGI the async payment views keep the worker free while Paystack answers.
+if settings.PAYSTACK_ASYNC_VIEWS:
+    payment_views = {'initialize': views.AsyncInitializePaymentView, 'verify': views.AsyncVerifyPaymentView,
+                     'webhook': views.AsyncPaystackWebhookView}
+else:
+    payment_views = {'initialize': views.InitializePaymentView, 'verify': views.VerifyPaymentView,
+                     'webhook': views.PaystackWebhookView}
+
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(products_router.urls)),
+    path('', include(collections_router.urls)),
     path('', include(carts_router.urls)),
 
     # Payment routes
     path('orders/<int:order_id>/initialize-payment/',
-         views.InitializePaymentView.as_view(),
+         payment_views['initialize'].as_view(),
          name='initialize-payment'),
     path('payments/verify/',
-         views.VerifyPaymentView.as_view(),
+         payment_views['verify'].as_view(),
          name='verify-payment'),
     path('payments/webhook/',
-         views.PaystackWebhookView.as_view(),
+         payment_views['webhook'].as_view(),
          name='paystack-webhook'),
 ]
\ No newline at end of file
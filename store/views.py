@@ -1,32 +1,41 @@
-from django.db.models import Count
+from django.db.models import Prefetch
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.viewsets import ModelViewSet, GenericViewSet, ReadOnlyModelViewSet
 from rest_framework.mixins import RetrieveModelMixin, CreateModelMixin, DestroyModelMixin, ListModelMixin
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
 from rest_framework.views import APIView
 from rest_framework import status
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-import requests
-import hmac
-import hashlib
-from decimal import Decimal
-from .paystack import PaystackAPI
+from asgiref.sync import sync_to_async
+import inspect
+import json
+from .paystack import PaystackAPI, AsyncPaystackAPI
+from . import payments
+from .cache import CachedCatalogMixin
+from .cart_storage import get_cart_store
+from .idempotency import idempotent
 
 from .models import Product, Collection, Cart, CartItem, Customer, Order, ProductImage, Branch
 
 from .serializers import ProductSerializer, CollectionSerializer, CartSerializer, CartItemSerializer, \
     AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, CreateOrderSerializer, \
-    UpdateOrderSerializer, ProductImageSerializer, BranchSerializer
+    UpdateOrderSerializer, ProductImageSerializer, BranchSerializer, CollectionSummarySerializer, SimpleProductSerializer, \
+    CartBatchSerializer
 
 from .filters import ProductFilter
+from .search import ProductSearchFilter
+from .facets import product_facets
+from .fieldsets import get_sparse_params, sparse_only, wants_expanded, wants_field
+from .pricing import PRODUCT_PRICE_FIELDS
 from .permissions import IsAdminOrReadOnly, ViewCustomerHistoryPermissions
 
-from .pagination import DefaultPagination
+from .pagination import DefaultPagination, ProductCursorPagination, OrderCursorPagination, PaginationModeMixin
 
 
 class BranchViewSet(ReadOnlyModelViewSet):
@@ -36,22 +45,41 @@ class BranchViewSet(ReadOnlyModelViewSet):
         return Branch.objects.filter(is_active=True)
 
 
-class ProductViewSet(ReadOnlyModelViewSet):
+class ProductViewSet(CachedCatalogMixin, PaginationModeMixin, ReadOnlyModelViewSet):
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
     permission_classes = [IsAdminOrReadOnly]
     search_fields = ['name', 'description']
     ordering_fields = ['price']
-    pagination_class = DefaultPagination
+    pagination_modes = {'page': DefaultPagination, 'cursor': ProductCursorPagination}
+    cache_prefix = 'products'
 
     def get_queryset(self):
-        queryset = Product.objects.select_related('collection').prefetch_related('images', 'sizes')
+        request = self.request
+        queryset = Product.objects.all()
+        if wants_field(request, 'collection'):
+            queryset = queryset.select_related('collection')
+        queryset = queryset.prefetch_related(*[
+            name for name in ('images', 'sizes') if wants_field(request, name) and wants_expanded(request, name)
+        ])
+        fields, expand = get_sparse_params(request)
+        if fields and 'image' in fields:
+            queryset = queryset.with_first_image()
+        if fields is None:
+            queryset = queryset.defer('search_vector')
+        queryset = sparse_only(queryset, request, always=['price'])
 
         if not self.request.user.is_staff:
             queryset = queryset.filter(is_available=True)
 
         return queryset
+
+    @action(detail=False)
+    def facets(self, request):
+        """Facet counts for the products matching the current filters and search."""
+        return self.cached_list_response('facets', request, lambda: Response(
+            product_facets(self.filter_queryset(self.get_queryset()))))
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
@@ -66,42 +94,83 @@ class CollectionViewSet(ReadOnlyModelViewSet):
     queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
     permission_classes = [IsAdminOrReadOnly]
+    preview_size = 4
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CollectionSummarySerializer
+        return CollectionSerializer
 
     def get_queryset(self):
         queryset = super().get_queryset()
         if self.action == 'list':
-            return Collection.objects.prefetch_related('products').annotate(
-                product_count=Count('products'))
+            preview = Product.objects.cards().filter(is_available=True).order_by('id')[:self.preview_size]
+            return queryset.prefetch_related(Prefetch('products', queryset=preview, to_attr='preview_products'))
+        return queryset.prefetch_related(
+            Prefetch('products', queryset=Product.objects.prefetch_related('images', 'sizes').defer('search_vector')))
+
+
+class CollectionProductViewSet(CachedCatalogMixin, PaginationModeMixin, ReadOnlyModelViewSet):
+    serializer_class = SimpleProductSerializer
+    permission_classes = [IsAdminOrReadOnly]
+    pagination_modes = {'page': DefaultPagination, 'cursor': ProductCursorPagination}
+    cache_prefix = 'collection-products'
+
+    def get_queryset(self):
+        queryset = Product.objects.cards().filter(collection_id=self.kwargs['collection_pk']).order_by('id')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(is_available=True)
         return queryset
 
 
+def cart_product_queryset(request):
+    """Full product cards when the product is rendered, otherwise just what pricing needs."""
+    if wants_expanded(request, 'product'):
+        return Product.objects.cards()
+    return Product.objects.only(*PRODUCT_PRICE_FIELDS)
+
+
 class CartViewSet(ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
+    # Also applies to the nested items routes, so the stores only ever see valid ids.
+    lookup_value_regex = '[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}'
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user).prefetch_related('items__product')
+        return Cart.objects.filter(user=self.request.user)
 
-    def create(self, request, *args, **kwargs):
-        existing_cart = Cart.objects.filter(user=request.user).first()
+    def get_product_queryset(self):
+        # Items are only loaded when they (or the total) are part of the response.
+        if wants_field(self.request, 'items') or wants_field(self.request, 'total_price'):
+            return cart_product_queryset(self.request)
+        return None
 
-        if existing_cart:
-            serializer = self.get_serializer(existing_cart)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-
-        cart = Cart.objects.create(user=request.user)
+    def create(self, request, *args, **kwargs):
+        cart, created = get_cart_store().get_or_create_cart(request.user.id, self.get_product_queryset())
         serializer = self.get_serializer(cart)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        carts = get_cart_store().get_carts(request.user.id, self.get_product_queryset())
+        serializer = self.get_serializer(carts, many=True)
         return Response(serializer.data)
 
+    def retrieve(self, request, *args, **kwargs):
+        cart = get_cart_store().get_cart(kwargs['pk'], request.user.id, self.get_product_queryset())
+        if cart is None:
+            raise NotFound('No cart with the given ID was found')
+        return Response(self.get_serializer(cart).data)
+
+    def destroy(self, request, *args, **kwargs):
+        if not get_cart_store().delete_cart(kwargs['pk'], request.user.id):
+            raise NotFound('No cart with the given ID was found')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [IsAuthenticated]
+    lookup_value_regex = '[0-9]+'
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -112,47 +181,34 @@ class CartItemViewSet(ModelViewSet):
             return CartItemSerializer
 
     def get_queryset(self):
-        cart_id = self.kwargs['cart_pk']
-        if not Cart.objects.filter(id=cart_id, user=self.request.user).exists():
-            return CartItem.objects.none()
-
-        return CartItem.objects.filter(cart_id=cart_id).select_related('product')
+        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk'], cart__user=self.request.user)
 
     def get_serializer_context(self):
-        return {'cart_id': self.kwargs['cart_pk']}
-
-    def create(self, request, *args, **kwargs):
-        print("=" * 50)
-        print("📥 RECEIVED REQUEST DATA:", request.data)
-        print("=" * 50)
-
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        return {**super().get_serializer_context(), 'cart_id': self.kwargs['cart_pk']}
 
-        print("✅ VALIDATED DATA:", serializer.validated_data)
+    def get_object(self):
+        item = get_cart_store().get_item(self.kwargs['cart_pk'], self.request.user.id, int(self.kwargs['pk']),
+                                         cart_product_queryset(self.request))
+        if item is None:
+            raise NotFound()
+        return item
 
-        self.perform_create(serializer)
+    def list(self, request, *args, **kwargs):
+        items = get_cart_store().get_items(self.kwargs['cart_pk'], request.user.id, cart_product_queryset(request))
+        return Response(self.get_serializer(items, many=True).data)
 
-        cart_item = serializer.instance
-        print("=" * 50)
-        print("✅ CART ITEM CREATED IN DATABASE:")
-        print(f"   ID: {cart_item.id}")
-        print(f"   Product: {cart_item.product.name}")
-        print(f"   Quantity: {cart_item.quantity}")
-        print(f"   with_customization: {cart_item.with_customization}")
-        print(f"   selected_size: {cart_item.selected_size}")
-        print(f"   Product base price: {cart_item.product.price}")
-        print(f"   Product customization price: {cart_item.product.customization_price}")
-        print(f"   Product is_customizable: {cart_item.product.is_customizable}")
+    def perform_destroy(self, instance):
+        get_cart_store().remove_item(self.kwargs['cart_pk'], self.request.user.id, instance.pk)
 
-        calculated_total = cart_item.quantity * cart_item.product.price
-        if cart_item.with_customization and cart_item.product.is_customizable:
-            calculated_total += (cart_item.product.customization_price * cart_item.quantity)
-        print(f"   CALCULATED TOTAL: {calculated_total}")
-        print("=" * 50)
+    @action(detail=False, methods=['post'])
+    def batch(self, request, cart_pk=None):
+        """Apply several add/update/remove operations at once and return the updated cart."""
+        serializer = CartBatchSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
 
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        cart = get_cart_store().get_cart(cart_pk, request.user.id, cart_product_queryset(request))
+        return Response(CartSerializer(cart, context=self.get_serializer_context()).data)
 
 
 class CustomerViewSet(ModelViewSet):
@@ -177,15 +233,19 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(PaginationModeMixin, ModelViewSet):
     serializer_class = OrderSerializer
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    # Unpaginated unless the client asks for ?pagination=cursor or ?pagination=page.
+    pagination_modes = {'page': DefaultPagination, 'cursor': OrderCursorPagination}
+    default_pagination_mode = None
 
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
             data=request.data,
@@ -205,12 +265,21 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.all()
+        if self.request.method == 'GET':
+            if wants_field(self.request, 'items'):
+                if wants_expanded(self.request, 'product'):
+                    queryset = queryset.prefetch_related(
+                        Prefetch('items__product', queryset=Product.objects.cards()))
+                else:
+                    queryset = queryset.prefetch_related('items')
+            queryset = sparse_only(queryset, self.request)
         if user.is_staff:
-            return Order.objects.prefetch_related('items__product').all()
+            return queryset.all()
 
         try:
             customer_id = Customer.objects.only('id').get(user_id=user.id)
-            return Order.objects.prefetch_related('items__product').filter(customer_id=customer_id)
+            return queryset.filter(customer_id=customer_id)
         except Customer.DoesNotExist:
             return Order.objects.none()
 
@@ -275,204 +344,56 @@ class VerifyPaymentView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        result = PaystackAPI.verify_payment(reference)
-
-        if not result['status']:
-            return Response(
-                {"error": result['message']},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        payment_data = result['data']
+        # Once the payment is final the order has the answer; polls stop reaching Paystack.
+        order = Order.objects.select_related('customer').filter(paystack_ref=reference).first()
+        settled = payments.settled_verification(order, request.user)
+        if settled:
+            return Response(*settled)
 
-        order_id = payment_data.get('metadata', {}).get('order_id', None)
+        result = payments.verify_reference(reference)
+        order_id, error = payments.verification_order_id(result)
+        if error:
+            return Response(*error)
 
-        if not order_id:
-            return Response(
-                {"error": "Order ID not found in transaction metadata."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if order is None or str(order.id) != str(order_id):
+            order = Order.objects.select_related('customer').filter(id=order_id).first()
+        error = payments.order_access_error(order, request.user)
+        if error:
+            return Response(*error)
 
-        try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
-            return Response(
-                {"error": "Order not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        try:
-            customer = Customer.objects.get(user_id=request.user.id)
-            if order.customer != customer:
-                return Response(
-                    {"error": "You don't have permission to access this order."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-        except Customer.DoesNotExist:
-            return Response(
-                {"error": "Customer profile not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        payment_status = payment_data.get('status')
-        amount = float(payment_data.get('amount', 0)) / 100
-        currency = payment_data.get('currency', 'GHS')
-        paid_at = payment_data.get('paid_at')
-
-        if payment_status == 'success':
-            if order.payment_status == Order.PAYMENT_COMPLETED:
-                return Response(
-                    {
-                        "message": "Payment already confirmed.",
-                        "order_id": order.id,
-                        "amount": amount,
-                        "currency": currency,
-                        "paid_at": paid_at
-                    },
-                    status=status.HTTP_200_OK
-                )
-
-            if order.payment_status == Order.PAYMENT_PENDING:
-                with transaction.atomic():
-                    order = Order.objects.select_for_update().get(id=order_id)
-                    if order.payment_status == Order.PAYMENT_PENDING:
-                        order.payment_status = Order.PAYMENT_COMPLETED
-                        order.paystack_ref = reference
-                        order.save()
-
-                        from core.tasks import send_email_task
-                        send_email_task(order.id)
-
-                return Response(
-                    {
-                        "message": "Payment verified successfully and order updated.",
-                        "order_id": order.id,
-                        "reference": reference,
-                        "amount": amount,
-                        "currency": currency,
-                        "paid_at": paid_at
-                    },
-                    status=status.HTTP_200_OK
-                )
-            else:
-                return Response(
-                    {
-                        "message": f"Payment status is {order.payment_status}",
-                        "order_id": order.id,
-                        "amount": amount,
-                        "currency": currency
-                    },
-                    status=status.HTTP_200_OK
-                )
-
-        elif payment_status == 'failed':
-            if order.payment_status == Order.PAYMENT_PENDING:
-                order.payment_status = Order.PAYMENT_FAILED
-                order.paystack_ref = reference
-                order.save()
-
-            return Response(
-                {
-                    "error": "Payment verification failed.",
-                    "order_id": order.id,
-                    "status": payment_status,
-                    "gateway_response": payment_data.get('gateway_response', 'Payment was not successful')
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        else:
-            return Response(
-                {
-                    "error": f"Payment status is {payment_status}",
-                    "order_id": order.id,
-                    "status": payment_status,
-                    "message": payment_data.get('gateway_response', 'Payment could not be completed')
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response(*payments.apply_verification(order, reference, result['data']))
 
 
 class InitializePaymentView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request, order_id):
         try:
-            order = Order.objects.prefetch_related('items__product').get(id=order_id)
-
-            customer = Customer.objects.get(user_id=request.user.id)
-            if order.customer != customer:
-                return Response(
-                    {"error": "You don't have permission to access this order."},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-
-            if order.payment_status == Order.PAYMENT_COMPLETED:
-                return Response(
-                    {"error": "This order has already been paid."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            total_amount = sum(
-                (item.price_at_purchase * item.quantity) +
-                (item.customization_price_at_purchase * item.quantity if item.with_customization else 0)
-                for item in order.items.all()
-            )
-
-            if total_amount <= 0:
-                return Response(
-                    {"error": "Order total must be greater than zero."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            order = Order.objects.select_related('customer').filter(id=order_id).first()
+            error = payments.initialization_error(order, request.user)
+            if error:
+                return Response(*error)
 
             customer_email = request.user.email
-
-            if not customer_email:
-                return Response(
-                    {"error": "Customer email is required for payment."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
             callback_url = request.data.get('callback_url', None)
 
+            # Nothing material changed since the last initialization: hand back
+            # the same checkout instead of a round trip to Paystack.
+            reused = payments.reusable_checkout(order, customer_email, callback_url)
+            if reused:
+                return Response(*reused)
+
             result = PaystackAPI.initialize_payment(
                 email=customer_email,
-                amount=total_amount,
+                amount=order.total,
                 order_id=order.id,
                 callback_url=callback_url
             )
-
+            response = payments.record_checkout(order, customer_email, callback_url, result)
             if result['status']:
-                payment_data = result['data']
-                order.paystack_ref = payment_data['reference']
-                order.paystack_access_code = payment_data['access_code']
                 order.save()
-
-                return Response({
-                    "message": "Payment initialized successfully",
-                    "authorization_url": payment_data['authorization_url'],
-                    "access_code": payment_data['access_code'],
-                    "reference": payment_data['reference'],
-                    "amount": float(total_amount),
-                    "currency": "GHS"
-                }, status=status.HTTP_200_OK)
-            else:
-                return Response(
-                    {"error": result['message']},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-        except Order.DoesNotExist:
-            return Response(
-                {"error": "Order not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        except Customer.DoesNotExist:
-            return Response(
-                {"error": "Customer profile not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            return Response(*response)
 
         except Exception as e:
             return Response(
@@ -481,122 +402,126 @@ class InitializePaymentView(APIView):
             )
 
 
-import json
-from django.db import transaction
-
-
 @method_decorator(csrf_exempt, name='dispatch')
 class PaystackWebhookView(APIView):
     permission_classes = []
 
     def post(self, request, *args, **kwargs):
         signature = request.headers.get('X-Paystack-Signature', '')
+        return Response(*payments.handle_webhook(request.body, signature))
 
-        if not signature:
-            return Response(
-                {"error": "No signature provided"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
 
-        payload = request.body
+class AsyncAPIView(APIView):
+    """
+    Async counterpart of APIView for the payment endpoints, used when
+    PAYSTACK_ASYNC_VIEWS is on and the app is served over ASGI: the worker is
+    free while Paystack answers instead of blocking a thread per request.
 
-        if not PaystackAPI.verify_webhook_signature(payload, signature):
-            return Response(
-                {"error": "Invalid signature"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    Handlers are ``async def``. Everything else is APIView's own: request
+    parsing, authentication, permission and throttle checks (run in a thread,
+    since they may query the database or cache), exception handling and
+    content negotiation.
+    """
 
-        try:
-            webhook_data = json.loads(payload)
-        except json.JSONDecodeError:
-            return Response(
-                {"error": "Invalid JSON payload"},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
 
-        event = webhook_data.get('event')
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
 
-        if event == 'charge.success':
-            return self._handle_successful_payment(webhook_data)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
 
-        elif event == 'charge.failed':
-            return self._handle_failed_payment(webhook_data)
+            response = handler(request, *args, **kwargs)
+            # OPTIONS is answered by APIView's sync handler.
+            if inspect.isawaitable(response):
+                response = await response
 
-        return Response({"status": "received"}, status=status.HTTP_200_OK)
+        except Exception as exc:
+            response = self.handle_exception(exc)
 
-    def _handle_successful_payment(self, webhook_data):
-        data = webhook_data.get('data', {})
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
 
-        order_id = data.get('metadata', {}).get('order_id')
 
-        if not order_id:
-            print("Webhook received but no order_id in metadata")
-            return Response({"status": "received"}, status=status.HTTP_200_OK)
+class AsyncVerifyPaymentView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
 
-        reference = data.get('reference')
-        payment_status = data.get('status')
+    async def get(self, request, *args, **kwargs):
+        reference = request.query_params.get('reference', None)
 
         if not reference:
-            print("Webhook received but no reference")
-            return Response({"status": "received"}, status=status.HTTP_200_OK)
-
-        try:
-            with transaction.atomic():
-                order = Order.objects.select_for_update().get(id=order_id)
+            return Response(
+                {"error": "Payment reference is required."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                if order.payment_status == Order.PAYMENT_PENDING:
-                    if payment_status == 'success':
-                        order.payment_status = Order.PAYMENT_COMPLETED
-                        order.paystack_ref = reference
-                        order.save()
+        order = await Order.objects.select_related('customer').filter(paystack_ref=reference).afirst()
+        settled = payments.settled_verification(order, request.user)
+        if settled:
+            return Response(*settled)
 
-                        from core.tasks import send_email_task
-                        send_email_task(order.id)
+        result = await payments.averify_reference(reference)
+        order_id, error = payments.verification_order_id(result)
+        if error:
+            return Response(*error)
 
-                        print(f"✅ Order {order_id} payment confirmed via webhook")
-                    else:
-                        order.payment_status = Order.PAYMENT_FAILED
-                        order.paystack_ref = reference
-                        order.save()
+        if order is None or str(order.id) != str(order_id):
+            order = await Order.objects.select_related('customer').filter(id=order_id).afirst()
+        error = payments.order_access_error(order, request.user)
+        if error:
+            return Response(*error)
 
-                        print(f"⚠️ Order {order_id} marked as failed (unexpected status in charge.success)")
-                else:
-                    print(f"ℹ️ Order {order_id} already processed. Current status: {order.payment_status}")
+        # The async ORM has no transactions; the locked update runs in a thread.
+        return Response(*await sync_to_async(payments.apply_verification)(order, reference, result['data']))
 
-            return Response({"status": "success"}, status=status.HTTP_200_OK)
 
-        except Order.DoesNotExist:
-            print(f"❌ Webhook received for non-existent order: {order_id}")
-            return Response({"status": "received"}, status=status.HTTP_200_OK)
-        except Exception as e:
-            print(f"❌ Error processing webhook for order {order_id}: {str(e)}")
-            return Response({"status": "error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+class AsyncInitializePaymentView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
 
-    def _handle_failed_payment(self, webhook_data):
-        data = webhook_data.get('data', {})
+    @idempotent
+    async def post(self, request, order_id):
+        try:
+            order = await Order.objects.select_related('customer').filter(id=order_id).afirst()
+            error = payments.initialization_error(order, request.user)
+            if error:
+                return Response(*error)
 
-        order_id = data.get('metadata', {}).get('order_id')
-        reference = data.get('reference')
+            customer_email = request.user.email
+            callback_url = request.data.get('callback_url', None)
 
-        if not order_id or not reference:
-            return Response({"status": "received"}, status=status.HTTP_200_OK)
+            reused = payments.reusable_checkout(order, customer_email, callback_url)
+            if reused:
+                return Response(*reused)
 
-        try:
-            with transaction.atomic():
-                order = Order.objects.select_for_update().get(id=order_id)
+            result = await AsyncPaystackAPI.initialize_payment(
+                email=customer_email,
+                amount=order.total,
+                order_id=order.id,
+                callback_url=callback_url
+            )
+            response = payments.record_checkout(order, customer_email, callback_url, result)
+            if result['status']:
+                await order.asave()
+            return Response(*response)
 
-                if order.payment_status == Order.PAYMENT_PENDING:
-                    order.payment_status = Order.PAYMENT_FAILED
-                    order.paystack_ref = reference
-                    order.save()
+        except Exception as e:
+            return Response(
+                {"error": f"An error occurred: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
 
-                    print(f"Order {order_id} payment failed via webhook")
 
-            return Response({"status": "success"}, status=status.HTTP_200_OK)
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPaystackWebhookView(AsyncAPIView):
+    permission_classes = []
 
-        except Order.DoesNotExist:
-            print(f"Webhook received for non-existent order: {order_id}")
-            return Response({"status": "received"}, status=status.HTTP_200_OK)
-        except Exception as e:
-            print(f"Error processing failed payment webhook: {str(e)}")
-            return Response({"status": "error"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+    async def post(self, request, *args, **kwargs):
+        signature = request.headers.get('X-Paystack-Signature', '')
+        return Response(*await sync_to_async(payments.handle_webhook)(request.body, signature))